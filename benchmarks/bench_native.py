@@ -0,0 +1,126 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Benchmarks of the native (in-process) backends
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import time
+import shutil
+import tempfile
+
+import pyplastimatch
+
+from .common import SIZES, get_volumes
+
+## ----------------------------------------
+
+def _throughput(func, num_voxels):
+
+    """
+    Run `func` once and return the throughput, in millions of voxels per second.
+    """
+
+    start_time = time.perf_counter()
+    func()
+
+    return num_voxels / (time.perf_counter() - start_time) / 1e6
+
+## ----------------------------------------
+
+class NativeMetrics:
+
+    """
+    Time, peak memory and throughput of the native dice/hd/compare backends.
+    """
+
+    params = [SIZES]
+    param_names = ["size"]
+    timeout = 900
+
+    def setup(self, size):
+        self.paths = get_volumes(size)
+        self.num_voxels = size**3
+
+    def _dice(self):
+        pyplastimatch.dice(self.paths["mask_ref"], self.paths["mask_test"], verbose = False, backend = "native")
+
+    def _hd(self):
+        pyplastimatch.hd(self.paths["mask_ref"], self.paths["mask_test"], verbose = False, backend = "native")
+
+    def _compare(self):
+        pyplastimatch.compare(self.paths["ct_ref"], self.paths["ct_test"], verbose = False, backend = "native")
+
+    def time_dice(self, size):
+        self._dice()
+
+    def time_hd(self, size):
+        self._hd()
+
+    def time_compare(self, size):
+        self._compare()
+
+    def peakmem_dice(self, size):
+        self._dice()
+
+    def peakmem_hd(self, size):
+        self._hd()
+
+    def peakmem_compare(self, size):
+        self._compare()
+
+    def track_dice_throughput(self, size):
+        return _throughput(self._dice, self.num_voxels)
+
+    def track_hd_throughput(self, size):
+        return _throughput(self._hd, self.num_voxels)
+
+    def track_compare_throughput(self, size):
+        return _throughput(self._compare, self.num_voxels)
+
+    track_dice_throughput.unit = "Mvoxels/s"
+    track_hd_throughput.unit = "Mvoxels/s"
+    track_compare_throughput.unit = "Mvoxels/s"
+
+## ----------------------------------------
+
+class NativeResample:
+
+    """
+    Time, peak memory and throughput of the SimpleITK backend of `resample()`.
+    """
+
+    params = [SIZES]
+    param_names = ["size"]
+    timeout = 900
+
+    def setup(self, size):
+        self.paths = get_volumes(size)
+        self.num_voxels = size**3
+        self.output_dir = tempfile.mkdtemp()
+
+    def teardown(self, size):
+        shutil.rmtree(self.output_dir, ignore_errors = True)
+
+    def _resample(self):
+        pyplastimatch.resample(verbose = False, backend = "sitk", input = self.paths["ct_ref"],
+                               output = os.path.join(self.output_dir, "ct.nrrd"), spacing = "2 2 2")
+
+    def time_resample(self, size):
+        self._resample()
+
+    def peakmem_resample(self, size):
+        self._resample()
+
+    def track_resample_throughput(self, size):
+        return _throughput(self._resample, self.num_voxels)
+
+    track_resample_throughput.unit = "Mvoxels/s"
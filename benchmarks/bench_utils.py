@@ -0,0 +1,68 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Benchmarks of the utility functions
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import shutil
+import tempfile
+import SimpleITK as sitk
+
+from pyplastimatch.utils import save_binary_segmask, dc_dict_to_df, hd_dict_to_df
+
+from .common import SIZES, get_volumes, get_cohort_dicts
+
+## ----------------------------------------
+
+class SaveBinarySegmask:
+
+    """
+    Time and peak memory of `save_binary_segmask` (header read, conversion and write).
+    """
+
+    params = [SIZES]
+    param_names = ["size"]
+    timeout = 600
+
+    def setup(self, size):
+        self.paths = get_volumes(size)
+        self.segmask = sitk.GetArrayFromImage(sitk.ReadImage(self.paths["mask_test"]))
+        self.output_dir = tempfile.mkdtemp()
+
+    def teardown(self, size):
+        shutil.rmtree(self.output_dir, ignore_errors = True)
+
+    def time_save_binary_segmask(self, size):
+        save_binary_segmask(self.paths["ct_ref"], os.path.join(self.output_dir, "mask.nrrd"), self.segmask)
+
+    def peakmem_save_binary_segmask(self, size):
+        save_binary_segmask(self.paths["ct_ref"], os.path.join(self.output_dir, "mask.nrrd"), self.segmask)
+
+## ----------------------------------------
+
+class DictToDataframe:
+
+    """
+    Time the conversion of cohort results dictionaries to Dataframes.
+    """
+
+    params = [[100, 1000, 10000]]
+    param_names = ["num_patients"]
+
+    def setup(self, num_patients):
+        self.dc_dict, self.hd_dict = get_cohort_dicts(num_patients)
+
+    def time_dc_dict_to_df(self, num_patients):
+        dc_dict_to_df(self.dc_dict, "heart")
+
+    def time_hd_dict_to_df(self, num_patients):
+        hd_dict_to_df(self.hd_dict, "heart")
@@ -0,0 +1,69 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Benchmarks of the CLI wrappers (run against the plastimatch stand-in under `stub`)
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import shutil
+import tempfile
+
+import pyplastimatch
+
+from .common import SIZES, get_volumes, use_stub
+
+## ----------------------------------------
+
+class CLIWrappers:
+
+    """
+    Time the wrappers around 'plastimatch convert/resample/dice/compare': process launch,
+    output capture and parsing (plus the file I/O of the stand-in for convert and resample).
+    """
+
+    params = [SIZES]
+    param_names = ["size"]
+    timeout = 600
+
+    def setup(self, size):
+        use_stub()
+        self.paths = get_volumes(size)
+        self.output_dir = tempfile.mkdtemp()
+
+    def teardown(self, size):
+        shutil.rmtree(self.output_dir, ignore_errors = True)
+
+    def time_convert(self, size):
+        pyplastimatch.convert(verbose = False, input = self.paths["ct_ref"],
+                              **{"output-img" : os.path.join(self.output_dir, "ct.nrrd")})
+
+    def time_resample(self, size):
+        pyplastimatch.resample(verbose = False, input = self.paths["ct_ref"],
+                               output = os.path.join(self.output_dir, "ct.nrrd"), spacing = "2 2 2")
+
+    def time_dice(self, size):
+        pyplastimatch.dice(self.paths["mask_ref"], self.paths["mask_test"], verbose = False)
+
+    def time_hd(self, size):
+        pyplastimatch.hd(self.paths["mask_ref"], self.paths["mask_test"], verbose = False)
+
+    def time_compare(self, size):
+        pyplastimatch.compare(self.paths["ct_ref"], self.paths["ct_test"], verbose = False)
+
+## ----------------------------------------
+
+def timeraw_import_pyplastimatch():
+
+    """
+    Time `import pyplastimatch` in a fresh interpreter.
+    """
+
+    return "import pyplastimatch"
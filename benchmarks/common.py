@@ -0,0 +1,126 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Benchmark helpers: synthetic data and plastimatch stand-in
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import tempfile
+import numpy as np
+import SimpleITK as sitk
+
+# edge of the (cubic) synthetic volumes, override with e.g. PYPLASTIMATCH_BENCH_SIZES="64,128"
+SIZES = [int(size) for size in os.environ.get("PYPLASTIMATCH_BENCH_SIZES", "64,128,256,512").split(",")]
+
+# where the synthetic volumes are generated (once, and reused across runs)
+BENCH_DIR = os.environ.get("PYPLASTIMATCH_BENCH_DIR",
+                           os.path.join(tempfile.gettempdir(), "pyplastimatch_benchmarks"))
+
+STUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub")
+
+SPACING = (0.9765625, 0.9765625, 2.5)
+
+## ----------------------------------------
+
+def use_stub():
+
+    """
+    Put the plastimatch stand-in first on PATH, so that the CLI wrappers run without the real binary.
+    """
+
+    path_list = os.environ.get("PATH", "").split(os.pathsep)
+
+    if path_list[0] != STUB_DIR:
+        os.environ["PATH"] = os.pathsep.join([STUB_DIR] + path_list)
+
+## ----------------------------------------
+
+def _write_volume(path_to_file, slice_func, size, dtype):
+
+    """
+    Generate a volume slice by slice (so that 512^3 volumes do not need large temporaries),
+    and save it as an uncompressed NRRD file.
+    """
+
+    arr = np.empty((size, size, size), dtype = dtype)
+
+    for z in range(size):
+        arr[z] = slice_func(z)
+
+    sitk_img = sitk.GetImageFromArray(arr)
+    sitk_img.SetSpacing(SPACING)
+
+    sitk.WriteImage(sitk_img, path_to_file, False)
+
+## ----------------------------------------
+
+def get_volumes(size):
+
+    """
+    Get the paths to the synthetic volumes of a given size, generating them if needed:
+      ct_ref, ct_test: int16 CT-like volumes (an ellipsoid "body" with noise; the test volume is perturbed)
+      mask_ref, mask_test: uint8 binary masks of an ellipsoid "organ" (the test mask is shifted and scaled)
+    """
+
+    size_dir = os.path.join(BENCH_DIR, "%d"%(size))
+
+    paths = {name : os.path.join(size_dir, "%s.nrrd"%(name))
+             for name in ["ct_ref", "ct_test", "mask_ref", "mask_test"]}
+
+    if all(os.path.isfile(path) for path in paths.values()):
+        return paths
+
+    os.makedirs(size_dir, exist_ok = True)
+
+    rng = np.random.default_rng(size)
+    yy, xx = np.mgrid[0:size, 0:size] / size - 0.5
+
+    def _ellipsoid(z, center, radii):
+        return ((xx - center[0])/radii[0])**2 + ((yy - center[1])/radii[1])**2 + \
+               ((z/size - 0.5 - center[2])/radii[2])**2 <= 1
+
+    def _ct_slice(z, noise):
+        body = _ellipsoid(z, (0, 0, 0), (0.45, 0.35, 0.6))
+        ct_slice = np.where(body, 40, -1000) + rng.normal(0, noise, (size, size))
+        return np.clip(ct_slice, -1024, 3071)
+
+    _write_volume(paths["ct_ref"], lambda z: _ct_slice(z, 10), size, np.int16)
+    _write_volume(paths["ct_test"], lambda z: _ct_slice(z, 25), size, np.int16)
+
+    _write_volume(paths["mask_ref"], lambda z: _ellipsoid(z, (0.05, 0, 0), (0.15, 0.12, 0.25)), size, np.uint8)
+    _write_volume(paths["mask_test"], lambda z: _ellipsoid(z, (0.07, 0.01, 0.01), (0.16, 0.11, 0.24)), size, np.uint8)
+
+    return paths
+
+## ----------------------------------------
+
+def get_cohort_dicts(num_patients, structures = ("heart", "esophagus", "lung_l", "lung_r", "spinal_cord")):
+
+    """
+    Build results dictionaries formatted like the output of the eval script (for the `*_dict_to_df` helpers).
+    """
+
+    rng = np.random.default_rng(num_patients)
+
+    dc_dict, hd_dict = dict(), dict()
+
+    for pat_idx in range(num_patients):
+        pat = "PAT-%05d"%(pat_idx)
+        dc_dict[pat], hd_dict[pat] = dict(), dict()
+
+        for structure in structures:
+            dc_dict[pat][structure] = {"com" : {"ref" : rng.normal(0, 50, 3).tolist(),
+                                                "cmp" : rng.normal(0, 50, 3).tolist()},
+                                       "dc" : float(rng.uniform(0.5, 1))}
+            hd_dict[pat][structure] = {key : float(rng.uniform(0, 20))
+                                       for key in ["hd", "hd95", "hd_boundaries", "hd95_boundaries"]}
+
+    return dc_dict, hd_dict
@@ -1,3 +1,38 @@
-from .utils import *
+import importlib
+
+from . import pyplastimatch as _wrappers
+from . import utils as _utils
 from .pyplastimatch import *
 __version__ = "0.1"
+
+# the utilities (see `utils`) are only imported on first use,
+# so that `import pyplastimatch` does not pull in numpy, pandas, SimpleITK, ...
+_LAZY_SUBMODULES = ["aio", "dicomindex", "jobqueue", "pipeline", "utils"]
+
+# utility modules that used to be imported by this module (e.g., `pyplastimatch.eval`),
+# still reachable from here as aliases of `pyplastimatch.utils.<name>`
+_LAZY_UTILS_SUBMODULES = ["data", "eval", "install"]
+
+# `from pyplastimatch import *` still exports the wrappers and the utilities
+# (the latter are imported at that point)
+__all__ = [name for name in dir(_wrappers) if not name.startswith("_")
+           and getattr(getattr(_wrappers, name), "__module__", None) == _wrappers.__name__] + _utils.__all__
+
+
+def __getattr__(name):
+
+  if name in _LAZY_SUBMODULES:
+    return importlib.import_module("." + name, __name__)
+
+  if name in _LAZY_UTILS_SUBMODULES:
+    return importlib.import_module("." + name, _utils.__name__)
+
+  if name in _utils.__all__:
+    return getattr(_utils, name)
+
+  raise AttributeError("module %r has no attribute %r"%(__name__, name))
+
+
+def __dir__():
+
+  return sorted(list(globals()) + _utils.__all__ + _LAZY_SUBMODULES + _LAZY_UTILS_SUBMODULES)
@@ -0,0 +1,147 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Command line interface
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+    Usage:
+      pyplastimatch worker QUEUE_DB [--processes N] [--lease-time S] [--exit-when-empty] ...
+      pyplastimatch status QUEUE_DB
+      pyplastimatch index INDEX_DB DIR [DIR ...] [--output-dir OUT [--queue QUEUE_DB]] ...
+
+"""
+
+import sys
+import json
+import argparse
+import contextlib
+import multiprocessing
+
+from . import jobqueue
+from . import dicomindex
+
+## ----------------------------------------
+
+def _worker_main(args):
+
+  worker_kwargs = {"lease_time" : args.lease_time,
+                   "poll_interval" : args.poll_interval,
+                   "max_jobs" : args.max_jobs,
+                   "exit_when_empty" : args.exit_when_empty,
+                   "verbose" : not args.quiet}
+
+  if args.processes == 1:
+    jobqueue.run_worker(args.queue_db, **worker_kwargs)
+    return 0
+
+  # independent worker processes, each leasing its own jobs
+  processes = [multiprocessing.Process(target = jobqueue.run_worker, args = (args.queue_db,), kwargs = worker_kwargs)
+               for _ in range(args.processes)]
+
+  for process in processes:
+    process.start()
+
+  try:
+    for process in processes:
+      process.join()
+  except KeyboardInterrupt:
+    for process in processes:
+      process.terminate()
+    return 130
+
+  return 0
+
+## ----------------------------------------
+
+def _status_main(args):
+
+  job_queue = jobqueue.JobQueue(args.queue_db)
+
+  for status, count in job_queue.counts().items():
+    print("%-8s %d"%(status, count))
+
+  if args.failed:
+    for job in job_queue.jobs(status = "failed"):
+      print("\njob %d (%s, %d attempts): %s"%(job["id"], job["kind"], job["attempts"], job["error"]))
+
+  return 0
+
+## ----------------------------------------
+
+def _index_main(args):
+
+  # the jobs may be printed as JSON: keep the progress messages out of stdout in that case
+  progress_stream = sys.stderr if args.output_dir is not None and args.queue is None else sys.stdout
+
+  index = dicomindex.DicomIndex(args.index_db)
+
+  with contextlib.redirect_stdout(progress_stream):
+    index.update(args.dirs, max_workers = args.workers, verbose = not args.quiet)
+
+  if args.output_dir is None:
+    for series in index.series():
+      print("%-12s %-10s %5d files  %s"%(series["patient_id"], series["modality"], series["num_files"],
+                                         series["series_uid"]))
+    return 0
+
+  with contextlib.redirect_stdout(progress_stream):
+    jobs = index.get_convert_jobs(args.output_dir, staging_dir = args.staging_dir, verbose = not args.quiet)
+
+  if args.queue is not None:
+    jobqueue.JobQueue(args.queue).enqueue_many([dict(job, kind = "convert") for job in jobs])
+  else:
+    json.dump(jobs, sys.stdout, indent = 2)
+    print()
+
+  return 0
+
+## ----------------------------------------
+
+def main(argv = None):
+
+  parser = argparse.ArgumentParser(prog = "pyplastimatch", description = "PyPlastimatch command line interface")
+  subparsers = parser.add_subparsers(dest = "command", required = True)
+
+  worker_parser = subparsers.add_parser("worker", help = "pull jobs from a queue (see pyplastimatch.jobqueue) and run them")
+  worker_parser.add_argument("queue_db", help = "path to the queue database")
+  worker_parser.add_argument("--processes", type = int, default = 1, help = "number of worker processes to start")
+  worker_parser.add_argument("--lease-time", type = float, default = jobqueue.DEFAULT_LEASE_TIME,
+                             help = "seconds after which the job of an unresponsive worker is handed to another one")
+  worker_parser.add_argument("--poll-interval", type = float, default = 1.0,
+                             help = "seconds to wait before checking an empty queue again")
+  worker_parser.add_argument("--max-jobs", type = int, default = None, help = "stop after running this many jobs")
+  worker_parser.add_argument("--exit-when-empty", action = "store_true", help = "stop when there is no job left to run")
+  worker_parser.add_argument("--quiet", action = "store_true", help = "do not print progress")
+  worker_parser.set_defaults(func = _worker_main)
+
+  status_parser = subparsers.add_parser("status", help = "print the number of jobs per status")
+  status_parser.add_argument("queue_db", help = "path to the queue database")
+  status_parser.add_argument("--failed", action = "store_true", help = "also print the errors of the failed jobs")
+  status_parser.set_defaults(func = _status_main)
+
+  index_parser = subparsers.add_parser("index", help = "index DICOM directories, and generate the convert jobs of the series")
+  index_parser.add_argument("index_db", help = "path to the index database (updated incrementally)")
+  index_parser.add_argument("dirs", nargs = "+", help = "directories to scan")
+  index_parser.add_argument("--workers", type = int, default = None, help = "number of processes reading the headers")
+  index_parser.add_argument("--output-dir", default = None,
+                            help = "generate the convert jobs writing under this directory (otherwise, list the series)")
+  index_parser.add_argument("--staging-dir", default = None,
+                            help = "directory where the series sharing their directory with other series are staged")
+  index_parser.add_argument("--queue", default = None,
+                            help = "add the convert jobs to this queue database (otherwise, print them as JSON)")
+  index_parser.add_argument("--quiet", action = "store_true", help = "do not print progress")
+  index_parser.set_defaults(func = _index_main)
+
+  args = parser.parse_args(argv)
+
+  return args.func(args)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
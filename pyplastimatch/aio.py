@@ -0,0 +1,298 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    asyncio python plastimatch wrapper
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import time
+import asyncio
+import weakref
+import functools
+import collections
+import contextlib
+from typing import Dict
+
+from . import pyplastimatch as _sync
+from .pyplastimatch import PlastimatchCommandResult, get_bash_command
+
+## ----------------------------------------
+
+# maximum number of plastimatch processes run at the same time by the coroutines of this module
+# (shared by every call running on the same event loop, unless a semaphore is passed explicitly)
+_max_concurrency = os.cpu_count() or 1
+
+# one semaphore per event loop, as asyncio primitives can not be shared across loops
+_semaphores = weakref.WeakKeyDictionary()
+
+def set_max_concurrency(max_concurrency: int) -> None:
+  """
+  Set the maximum number of plastimatch processes the coroutines of this module run at the same time.
+  """
+
+  global _max_concurrency
+
+  _max_concurrency = max_concurrency
+  _semaphores.clear()
+
+
+def get_semaphore() -> asyncio.Semaphore:
+  """
+  Get the semaphore shared by the coroutines of this module running on the current event loop.
+  """
+
+  loop = asyncio.get_running_loop() if hasattr(asyncio, "get_running_loop") else asyncio.get_event_loop()
+
+  if loop not in _semaphores:
+    _semaphores[loop] = asyncio.Semaphore(_max_concurrency)
+
+  return _semaphores[loop]
+
+## ----------------------------------------
+
+async def run_plastimatch_command(bash_command, path_to_log_file = None, timeout = None, semaphore = None,
+                                  line_callback = None, tail_lines = None) -> PlastimatchCommandResult:
+  """
+  Asynchronous equivalent of `pyplastimatch.run_plastimatch_command`.
+
+  If the coroutine is cancelled or the timeout expires, the plastimatch process is killed.
+  CPU time and peak memory are not available for processes run through asyncio, so the
+  corresponding fields of the result are None.
+
+  Args:
+      bash_command: the command to run (see `pyplastimatch.get_bash_command`)
+      path_to_log_file: path to file where both stdout and stderr should be logged (appending).
+                        If None, the output is captured and stored in the result.
+      timeout: maximum run time, in seconds (None for no limit). asyncio.TimeoutError is raised on expiry.
+      semaphore: semaphore bounding the number of concurrent processes (defaults to `get_semaphore()`)
+      line_callback: callable run as `line_callback(line, stream_name)` on every line of output, as soon as
+                     plastimatch prints it (see `pyplastimatch.run_plastimatch_command`)
+      tail_lines: number of lines of each stream kept in the result when streaming
+
+  Returns:
+      PlastimatchCommandResult storing the outcome of the run
+  """
+
+  if semaphore is None:
+    semaphore = get_semaphore()
+
+  streaming = line_callback is not None or tail_lines is not None
+
+  async with semaphore:
+    with contextlib.ExitStack() as stack:
+      if streaming:
+        log_file = stack.enter_context(open(path_to_log_file, "ab")) if path_to_log_file else None
+        stdout_file = stderr_file = asyncio.subprocess.PIPE
+      elif path_to_log_file:
+        stdout_file = stderr_file = stack.enter_context(open(path_to_log_file, "a"))
+      else:
+        stdout_file = stderr_file = asyncio.subprocess.PIPE
+
+      tails = {"stdout" : collections.deque(maxlen = tail_lines or _sync.DEFAULT_TAIL_LINES),
+               "stderr" : collections.deque(maxlen = tail_lines or _sync.DEFAULT_TAIL_LINES)}
+
+      async def _read_lines(stream_name, stream_reader):
+        while True:
+          raw_line = await stream_reader.readline()
+          if not raw_line:
+            return
+
+          if log_file is not None:
+            log_file.write(raw_line)
+            log_file.flush()
+
+          line = raw_line.decode(errors = "replace").rstrip("\r\n")
+          tails[stream_name].append(line)
+
+          if line_callback is not None:
+            line_callback(line, stream_name)
+
+      async def _communicate():
+        if not streaming:
+          return await process.communicate()
+
+        await asyncio.gather(_read_lines("stdout", process.stdout), _read_lines("stderr", process.stderr))
+        await process.wait()
+
+        return ["\n".join(tails[stream_name]).encode() for stream_name in ("stdout", "stderr")]
+
+      start_time = time.perf_counter()
+
+      process = await asyncio.create_subprocess_exec(*bash_command, stdout = stdout_file, stderr = stderr_file)
+
+      try:
+        stdout, stderr = await asyncio.wait_for(_communicate(), timeout)
+      except BaseException:
+        # cancelled, timed out, or failing line callback: do not leave plastimatch running
+        if process.returncode is None:
+          process.kill()
+          await process.wait()
+        raise
+
+      wall_time = time.perf_counter() - start_time
+
+  result = PlastimatchCommandResult(bash_command, process.returncode, wall_time,
+                                    path_to_stdout = path_to_log_file, path_to_stderr = path_to_log_file)
+
+  if stdout is not None:
+    result.stdout = stdout.decode(errors = "replace")
+  if stderr is not None:
+    result.stderr = stderr.decode(errors = "replace")
+
+  _sync._run_command_hooks(result)
+
+  return result
+
+## ----------------------------------------
+
+async def convert(verbose = True, path_to_log_file = None, timeout = None, semaphore = None,
+                  line_callback = None, **kwargs) -> PlastimatchCommandResult:
+  """
+  Asynchronous equivalent of `pyplastimatch.convert`.
+
+  Unlike the synchronous wrapper, failures are raised (CalledProcessError) rather than printed.
+
+  Args:
+      path_to_log_file: path to file where stdout and stderr from the processing should be logged
+      timeout: maximum run time, in seconds (None for no limit)
+      semaphore: semaphore bounding the number of concurrent processes (defaults to `get_semaphore()`)
+      line_callback: callable run as `line_callback(line, stream_name)` on every line printed by plastimatch
+
+      **kwargs: all the arguments parsable by 'plastimatch convert'
+  """
+
+  bash_command = get_bash_command("convert", **kwargs)
+
+  if verbose: print("\nRunning '%s'"%(" ".join(bash_command)))
+
+  result = await run_plastimatch_command(bash_command, path_to_log_file, timeout, semaphore, line_callback)
+  result.check_returncode()
+
+  if verbose: print("... Done ('%s')."%(" ".join(bash_command)))
+
+  return result
+
+## ----------------------------------------
+
+async def resample(verbose = True, path_to_log_file = None, timeout = None, semaphore = None,
+                   line_callback = None, **kwargs) -> PlastimatchCommandResult:
+  """
+  Asynchronous equivalent of `pyplastimatch.resample`.
+
+  Unlike the synchronous wrapper, failures are raised (CalledProcessError) rather than printed.
+
+  Args:
+      path_to_log_file: path to file where stdout and stderr from the processing should be logged
+      timeout: maximum run time, in seconds (None for no limit)
+      semaphore: semaphore bounding the number of concurrent processes (defaults to `get_semaphore()`)
+      line_callback: callable run as `line_callback(line, stream_name)` on every line printed by plastimatch
+
+      **kwargs: all the arguments parsable by 'plastimatch resample'
+  """
+
+  bash_command = get_bash_command("resample", **kwargs)
+
+  if verbose: print("\nRunning '%s'"%(" ".join(bash_command)))
+
+  result = await run_plastimatch_command(bash_command, path_to_log_file, timeout, semaphore, line_callback)
+  result.check_returncode()
+
+  if verbose: print("... Done ('%s')."%(" ".join(bash_command)))
+
+  return result
+
+## ----------------------------------------
+
+async def _run_in_executor(func, *args, **kwargs):
+  """
+  Run a blocking function (e.g., a native backend) in the default executor of the event loop.
+  """
+
+  loop = asyncio.get_event_loop()
+
+  return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+## ----------------------------------------
+
+async def dice(path_to_reference_img, path_to_test_img, verbose = True, backend = "cli",
+               timeout = None, semaphore = None):
+  """
+  Asynchronous equivalent of `pyplastimatch.dice`.
+
+  Args:
+      timeout: maximum run time of plastimatch, in seconds (None for no limit)
+      semaphore: semaphore bounding the number of concurrent processes (defaults to `get_semaphore()`)
+  """
+
+  if backend != "cli":
+    return await _run_in_executor(_sync.dice, path_to_reference_img, path_to_test_img,
+                                  verbose = verbose, backend = backend)
+
+  bash_command = get_bash_command("dice", "--dice", path_to_reference_img, path_to_test_img)
+
+  if verbose: print("\nComputing DC between %s and %s with 'plastimatch dice --dice'"%(path_to_reference_img,
+                                                                                        path_to_test_img))
+
+  result = await run_plastimatch_command(bash_command, timeout = timeout, semaphore = semaphore)
+  result.check_returncode()
+
+  return _sync._parse_dice_output(result.stdout)
+
+## ----------------------------------------
+
+async def hd(path_to_reference_img, path_to_test_img, verbose = True, backend = "cli",
+             timeout = None, semaphore = None):
+  """
+  Asynchronous equivalent of `pyplastimatch.hd`.
+
+  Args:
+      timeout: maximum run time of plastimatch, in seconds (None for no limit)
+      semaphore: semaphore bounding the number of concurrent processes (defaults to `get_semaphore()`)
+  """
+
+  if backend != "cli":
+    return await _run_in_executor(_sync.hd, path_to_reference_img, path_to_test_img,
+                                  verbose = verbose, backend = backend)
+
+  bash_command = get_bash_command("dice", "--hausdorff", path_to_reference_img, path_to_test_img)
+
+  if verbose: print("\nComputing the HD between %s and %s with 'plastimatch dice --hausdorff'"%(path_to_reference_img,
+                                                                                                 path_to_test_img))
+
+  result = await run_plastimatch_command(bash_command, timeout = timeout, semaphore = semaphore)
+  result.check_returncode()
+
+  return _sync._parse_hd_output(result.stdout)
+
+## ----------------------------------------
+
+async def compare(path_to_reference_img, path_to_test_img, verbose = True, backend = "cli",
+                  timeout = None, semaphore = None) -> Dict[str, float]:
+  """
+  Asynchronous equivalent of `pyplastimatch.compare`.
+
+  Args:
+      timeout: maximum run time of plastimatch, in seconds (None for no limit)
+      semaphore: semaphore bounding the number of concurrent processes (defaults to `get_semaphore()`)
+  """
+
+  if backend != "cli":
+    return await _run_in_executor(_sync.compare, path_to_reference_img, path_to_test_img,
+                                  verbose = verbose, backend = backend)
+
+  bash_command = get_bash_command("compare", path_to_reference_img, path_to_test_img)
+
+  if verbose: print("\nComparing %s and %s with 'plastimatch compare'"%(path_to_reference_img, path_to_test_img))
+
+  result = await run_plastimatch_command(bash_command, timeout = timeout, semaphore = semaphore)
+  result.check_returncode()
+
+  return _sync._parse_compare_output(result.stdout)
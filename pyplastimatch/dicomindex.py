@@ -0,0 +1,408 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Persistent (SQLite) index of DICOM directories
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import json
+import time
+import sqlite3
+import contextlib
+import concurrent.futures
+from typing import Dict, List
+
+# header fields read from every file (the pixel data, and anything after it, is never read)
+DICOM_TAGS = ["PatientID", "StudyInstanceUID", "SeriesInstanceUID", "SOPInstanceUID", "Modality",
+              "FrameOfReferenceUID", "SeriesDescription", "ReferencedFrameOfReferenceSequence"]
+
+# modalities converted to a volume by 'plastimatch convert'
+IMAGE_MODALITIES = ["CT", "MR", "PT"]
+
+FILE_COLUMNS = ["path", "directory", "mtime_ns", "size", "is_dicom", "patient_id", "study_uid",
+                "series_uid", "sop_uid", "modality", "frame_of_reference_uid", "series_description",
+                "referenced_series_uids"]
+
+# number of files read by a worker process at a time
+SCAN_CHUNK_SIZE = 256
+
+## ----------------------------------------
+
+def _referenced_series_uids(ds) -> List[str]:
+  """
+  UIDs of the image series an RTSTRUCT is drawn on
+  (ReferencedFrameOfReferenceSequence > RTReferencedStudySequence > RTReferencedSeriesSequence).
+  """
+
+  series_uids = list()
+
+  for frame_of_reference in ds.get("ReferencedFrameOfReferenceSequence", []):
+    for study in frame_of_reference.get("RTReferencedStudySequence", []):
+      for series in study.get("RTReferencedSeriesSequence", []):
+        if "SeriesInstanceUID" in series:
+          series_uids.append(str(series.SeriesInstanceUID))
+
+  return series_uids
+
+
+def read_dicom_headers(file_list) -> List[Dict]:
+  """
+  Read the header fields of the index from a list of files (run in the worker processes).
+
+  Returns:
+      list of dictionaries (one per file, in the same order as `file_list`) storing the FILE_COLUMNS
+      but "directory", "mtime_ns" and "size". Files that are not DICOM, or whose header can not
+      be parsed, have "is_dicom" set to False.
+  """
+
+  # imported here so that the worker processes only import it once they are started
+  import pydicom
+
+  records = list()
+
+  for path in file_list:
+    record = {"path" : path, "is_dicom" : False}
+
+    try:
+      ds = pydicom.dcmread(path, stop_before_pixels = True, specific_tags = DICOM_TAGS)
+
+      if "SOPInstanceUID" not in ds and "SeriesInstanceUID" not in ds:
+        # e.g., DICOMDIR files
+        records.append(record)
+        continue
+
+      # the values are only decoded when accessed, so malformed elements fail here
+      fields = {"patient_id" : str(ds.get("PatientID", "")),
+                "study_uid" : str(ds.get("StudyInstanceUID", "")),
+                "series_uid" : str(ds.get("SeriesInstanceUID", "")),
+                "sop_uid" : str(ds.get("SOPInstanceUID", "")),
+                "modality" : str(ds.get("Modality", "")),
+                "frame_of_reference_uid" : str(ds.get("FrameOfReferenceUID", "")),
+                "series_description" : str(ds.get("SeriesDescription", "")),
+                "referenced_series_uids" : json.dumps(_referenced_series_uids(ds))}
+
+    except Exception:
+      # any parse error (e.g., InvalidDicomError, EOFError on truncated files, KeyError or AttributeError
+      # on malformed elements) marks a single file as unreadable, instead of failing the whole scan
+      records.append(record)
+      continue
+
+    record["is_dicom"] = True
+    record.update(fields)
+
+    records.append(record)
+
+  return records
+
+## ----------------------------------------
+
+def _stat_files(root_dir):
+  """
+  List the files under `root_dir`, with their modification time and size.
+  """
+
+  file_stats = dict()
+
+  for dir_path, dir_names, file_names in os.walk(root_dir):
+    dir_names.sort()
+    for file_name in file_names:
+      path = os.path.join(dir_path, file_name)
+      try:
+        file_stat = os.stat(path)
+      except OSError:
+        continue
+      file_stats[path] = (file_stat.st_mtime_ns, file_stat.st_size)
+
+  return file_stats
+
+## ----------------------------------------
+
+class DicomIndex:
+  """
+  Index of the DICOM files found under one or more directories (Study/Series/SOP Instance UIDs,
+  modality, and the series each RTSTRUCT references), stored in a SQLite database, so that
+  the 'plastimatch convert' jobs of a collection can be generated without rescanning it.
+
+  `update()` only reads the headers of the files that are new or changed since the last scan.
+
+  Example:
+      index = DicomIndex("dicom_index.db")
+      index.update(["/data/collection"])
+      jobs = index.get_convert_jobs("/data/nrrd")
+      pypla.convert_many(jobs)
+      # or: JobQueue("queue.db").enqueue_many([dict(job, kind = "convert") for job in jobs])
+
+  Args:
+      path_to_db: path to the index database (created if it does not exist)
+  """
+
+  def __init__(self, path_to_db):
+
+    self.path_to_db = path_to_db
+
+    with self._connect() as conn:
+      conn.execute("CREATE TABLE IF NOT EXISTS files ("
+                   "path TEXT PRIMARY KEY, directory TEXT, mtime_ns INTEGER, size INTEGER, "
+                   "is_dicom INTEGER, patient_id TEXT, study_uid TEXT, series_uid TEXT, sop_uid TEXT, "
+                   "modality TEXT, frame_of_reference_uid TEXT, series_description TEXT, "
+                   "referenced_series_uids TEXT)")
+      conn.execute("CREATE INDEX IF NOT EXISTS files_series ON files (series_uid)")
+      conn.execute("CREATE INDEX IF NOT EXISTS files_directory ON files (directory)")
+
+
+  @contextlib.contextmanager
+  def _connect(self):
+    """
+    Open a new connection to the index database, committing on success.
+    """
+
+    conn = sqlite3.connect(self.path_to_db, timeout = 60)
+    conn.row_factory = sqlite3.Row
+
+    try:
+      with conn:
+        yield conn
+    finally:
+      conn.close()
+
+
+  def update(self, root_dirs, max_workers = None, verbose = True) -> Dict[str, int]:
+    """
+    Scan one or more directories (recursively), reading the headers of the new and changed files
+    in parallel, and removing from the index the files that no longer exist.
+
+    Args:
+        root_dirs: directory, or list of directories, to scan
+        max_workers: maximum number of processes reading the headers (defaults to the number of CPUs)
+
+    Returns:
+        dictionary storing the number of files "added", "updated", "removed" and "unchanged"
+    """
+
+    if isinstance(root_dirs, (str, os.PathLike)):
+      root_dirs = [root_dirs]
+
+    root_dirs = [os.path.abspath(str(root_dir)) for root_dir in root_dirs]
+
+    start_time = time.time()
+
+    file_stats = dict()
+    for root_dir in root_dirs:
+      file_stats.update(_stat_files(root_dir))
+
+    with self._connect() as conn:
+      indexed = {row["path"] : (row["mtime_ns"], row["size"])
+                 for row in conn.execute("SELECT path, mtime_ns, size FROM files")}
+
+    removed = [path for path in indexed if path not in file_stats and
+               any(path.startswith(os.path.join(root_dir, "")) for root_dir in root_dirs)]
+    to_scan = [path for path, file_stat in file_stats.items() if indexed.get(path) != file_stat]
+
+    stats = {"added" : sum(path not in indexed for path in to_scan),
+             "updated" : sum(path in indexed for path in to_scan),
+             "removed" : len(removed),
+             "unchanged" : len(file_stats) - len(to_scan)}
+
+    if verbose:
+      print("\nIndexing %d files (%d new or changed)..."%(len(file_stats), len(to_scan)))
+
+    chunks = [to_scan[idx:idx + SCAN_CHUNK_SIZE] for idx in range(0, len(to_scan), SCAN_CHUNK_SIZE)]
+
+    def _store(records):
+      with self._connect() as conn:
+        for record in records:
+          record["directory"] = os.path.dirname(record["path"])
+          record["mtime_ns"], record["size"] = file_stats[record["path"]]
+          conn.execute("INSERT OR REPLACE INTO files (%s) VALUES (%s)"%(", ".join(FILE_COLUMNS),
+                                                                         ", ".join("?"*len(FILE_COLUMNS))),
+                       [record.get(column) for column in FILE_COLUMNS])
+
+    if len(chunks) > 1 and (max_workers is None or max_workers > 1):
+      with concurrent.futures.ProcessPoolExecutor(max_workers = max_workers) as executor:
+        futures = [executor.submit(read_dicom_headers, chunk) for chunk in chunks]
+        for future in concurrent.futures.as_completed(futures):
+          _store(future.result())
+    else:
+      for chunk in chunks:
+        _store(read_dicom_headers(chunk))
+
+    with self._connect() as conn:
+      conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+
+    if verbose:
+      print("... Done (%d added, %d updated, %d removed, %.2f s)."%(stats["added"], stats["updated"],
+                                                                     stats["removed"], time.time() - start_time))
+
+    return stats
+
+
+  def series(self, modality = None) -> List[Dict]:
+    """
+    List the indexed series.
+
+    Args:
+        modality: only list the series of this modality (e.g., "CT", "RTSTRUCT")
+
+    Returns:
+        list of dictionaries (sorted by patient, study and series) storing, for every series:
+          patient_id, study_uid, series_uid, modality, frame_of_reference_uid, series_description
+          directories             directories the files of the series are stored in
+          num_files               number of files (instances) of the series
+          referenced_series_uids  UIDs of the series the series references (RTSTRUCT)
+    """
+
+    query = "SELECT * FROM files WHERE is_dicom = 1"
+    params = list()
+
+    if modality is not None:
+      query += " AND modality = ?"
+      params.append(modality)
+
+    series_dict = dict()
+
+    with self._connect() as conn:
+      for row in conn.execute(query + " ORDER BY path", params):
+        if row["series_uid"] not in series_dict:
+          series_dict[row["series_uid"]] = {key : row[key] for key in ["patient_id", "study_uid", "series_uid",
+                                                                      "modality", "frame_of_reference_uid",
+                                                                      "series_description"]}
+          series_dict[row["series_uid"]].update({"directories" : list(), "num_files" : 0,
+                                                 "referenced_series_uids" : list()})
+
+        series = series_dict[row["series_uid"]]
+        series["num_files"] += 1
+
+        if row["directory"] not in series["directories"]:
+          series["directories"].append(row["directory"])
+
+        for uid in json.loads(row["referenced_series_uids"] or "[]"):
+          if uid not in series["referenced_series_uids"]:
+            series["referenced_series_uids"].append(uid)
+
+    return sorted(series_dict.values(), key = lambda series: (series["patient_id"], series["study_uid"],
+                                                              series["series_uid"]))
+
+
+  def files(self, series_uid) -> List[str]:
+    """
+    List the files of a series.
+    """
+
+    with self._connect() as conn:
+      return [row["path"] for row in conn.execute("SELECT path FROM files WHERE series_uid = ? ORDER BY path",
+                                                  (series_uid,))]
+
+
+  def get_series_input(self, series_uid, staging_dir = None):
+    """
+    Get the directory 'plastimatch convert --input' can read a series from: the directory storing
+    the series, if it stores no other DICOM series, otherwise a directory of symbolic links to the
+    files of the series, created under `staging_dir` (None if `staging_dir` is not set).
+
+    The links left in the staging directory by a previous call are updated to the current files
+    of the series (e.g., links to removed files are deleted).
+    """
+
+    with self._connect() as conn:
+      directories = [row["directory"] for row in
+                     conn.execute("SELECT DISTINCT directory FROM files WHERE series_uid = ?", (series_uid,))]
+
+      if len(directories) == 1:
+        num_other = conn.execute("SELECT COUNT(*) FROM files WHERE directory = ? AND is_dicom = 1 "
+                                 "AND series_uid != ?", (directories[0], series_uid)).fetchone()[0]
+        if num_other == 0:
+          return directories[0]
+
+    if staging_dir is None:
+      return None
+
+    series_dir = os.path.join(staging_dir, series_uid)
+    os.makedirs(series_dir, exist_ok = True)
+
+    # prefix the links, as files of different directories may have the same name
+    links = {"%06d_%s"%(idx, os.path.basename(path)) : path for idx, path in enumerate(self.files(series_uid))}
+
+    for link_name in os.listdir(series_dir):
+      path_to_link = os.path.join(series_dir, link_name)
+      if link_name not in links or not os.path.islink(path_to_link) or os.readlink(path_to_link) != links[link_name]:
+        os.remove(path_to_link)
+
+    for link_name, path in links.items():
+      path_to_link = os.path.join(series_dir, link_name)
+      if not os.path.lexists(path_to_link):
+        os.symlink(path, path_to_link)
+
+    return series_dir
+
+
+  def get_convert_jobs(self, output_dir, modalities = IMAGE_MODALITIES, rtstruct = True,
+                       staging_dir = None, output_format = "nrrd", verbose = True) -> List[Dict]:
+    """
+    Generate the 'plastimatch convert' jobs converting the indexed series, ready to be passed
+    to `convert_many` (or, with kind = "convert", to `JobQueue.enqueue_many`):
+      - every image series (of the given modalities) is converted to
+        "<output_dir>/<PatientID>/<Modality>_<SeriesInstanceUID>.<output_format>"
+      - every RTSTRUCT whose referenced series is indexed is converted to one mask per structure,
+        under "<output_dir>/<PatientID>/RTSTRUCT_<SeriesInstanceUID>/"
+
+    Args:
+        output_dir: directory the outputs are written under
+        modalities: modalities of the image series to convert
+        rtstruct: also convert the RTSTRUCTs
+        staging_dir: directory where the series sharing their directory with other series are
+                     staged (as symbolic links); if None, those series are skipped
+        output_format: format of the volumes and of the masks (e.g., "nrrd", "nii.gz")
+
+    Returns:
+        list of dictionaries, each storing the arguments of a 'plastimatch convert' call
+    """
+
+    jobs = list()
+    skipped = list()
+
+    for series in self.series():
+      modality = series["modality"]
+      patient_dir = os.path.join(output_dir, series["patient_id"] or "unknown")
+
+      if modality in modalities:
+        input_dir = self.get_series_input(series["series_uid"], staging_dir)
+
+        if input_dir is None:
+          skipped.append((series["series_uid"], "its directory stores other series"))
+          continue
+
+        jobs.append({"input" : input_dir,
+                     "output-img" : os.path.join(patient_dir, "%s_%s.%s"%(modality, series["series_uid"],
+                                                                          output_format))})
+
+      elif modality == "RTSTRUCT" and rtstruct:
+        referenced_dirs = [self.get_series_input(uid, staging_dir) for uid in series["referenced_series_uids"]
+                           if self.files(uid)]
+        referenced_dirs = [path for path in referenced_dirs if path is not None]
+
+        if not referenced_dirs:
+          skipped.append((series["series_uid"], "the referenced series is not indexed (or not convertible)"))
+          continue
+
+        output_prefix = os.path.join(patient_dir, "RTSTRUCT_%s"%(series["series_uid"]))
+
+        for idx, path in enumerate(self.files(series["series_uid"])):
+          jobs.append({"input" : path,
+                       "referenced-ct" : referenced_dirs[0],
+                       "output-prefix" : output_prefix if idx == 0 else "%s_%d"%(output_prefix, idx),
+                       "prefix-format" : output_format})
+
+    if verbose:
+      print("\nGenerated %d convert jobs (%d series skipped)."%(len(jobs), len(skipped)))
+      for series_uid, reason in skipped:
+        print("  Skipped %s: %s."%(series_uid, reason))
+
+    return jobs
@@ -0,0 +1,400 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    File-based (SQLite) job queue and workers
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+import contextlib
+from typing import Dict, List, Optional
+
+from . import pyplastimatch as _sync
+from .pipeline import COMMAND_STEPS, EVALUATION_STEPS
+
+# kinds of job the workers can run
+JOB_KINDS = COMMAND_STEPS + list(EVALUATION_STEPS)
+
+DEFAULT_LEASE_TIME = 60
+DEFAULT_MAX_ATTEMPTS = 3
+
+JOB_COLUMNS = ["id", "kind", "kwargs", "status", "priority", "attempts", "max_attempts", "worker",
+               "lease_expires", "created", "started", "finished", "result", "error"]
+
+## ----------------------------------------
+
+def get_worker_id() -> str:
+  """
+  Identifier of the calling worker process, unique across the hosts sharing a queue.
+  """
+
+  return "%s:%d"%(socket.gethostname(), os.getpid())
+
+## ----------------------------------------
+
+class JobQueue:
+  """
+  Queue of 'convert', 'resample', 'dice', 'hd' and 'compare' jobs stored in a SQLite database,
+  which any number of worker processes (on any host sharing the file) can pull jobs from.
+
+  A worker claiming a job holds a lease on it, which it renews (heartbeat) while the job runs.
+  If the worker dies, the lease expires and the job is handed to another worker. Failed jobs
+  are retried until they have been attempted `max_attempts` times.
+
+  Note that SQLite relies on the file locks of the filesystem: on network filesystems (e.g., NFS),
+  make sure locking is supported and enabled.
+
+  Args:
+      path_to_db: path to the queue database (created if it does not exist)
+  """
+
+  def __init__(self, path_to_db):
+
+    self.path_to_db = path_to_db
+
+    with self._connect() as conn:
+      conn.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                   "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, kwargs TEXT, "
+                   "status TEXT, priority INTEGER, attempts INTEGER, max_attempts INTEGER, "
+                   "worker TEXT, lease_expires REAL, created REAL, started REAL, finished REAL, "
+                   "result TEXT, error TEXT)")
+      conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority, id)")
+
+
+  @contextlib.contextmanager
+  def _connect(self):
+    """
+    Open a new connection to the queue database, holding the write lock from the start
+    of the transaction (so that two workers can not claim the same job), committing on success.
+    """
+
+    conn = sqlite3.connect(self.path_to_db, timeout = 60, isolation_level = None)
+
+    try:
+      conn.execute("BEGIN IMMEDIATE")
+      try:
+        yield conn
+        conn.execute("COMMIT")
+      except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+      conn.close()
+
+
+  def enqueue(self, kind, priority = 0, max_attempts = DEFAULT_MAX_ATTEMPTS, **kwargs) -> int:
+    """
+    Add a job to the queue.
+
+    Args:
+        kind: "convert" or "resample" (kwargs: the arguments of the plastimatch command, plus
+              an optional "path_to_log_file"), "dice", "hd" or "compare" (kwargs: the arguments
+              of the wrapper, e.g. `path_to_reference_img` and `path_to_test_img`)
+        priority: jobs with a higher priority are claimed first
+        max_attempts: number of times the job is attempted before being marked as failed
+
+    Returns:
+        the id of the job
+    """
+
+    return self.enqueue_many([dict(kwargs, kind = kind)], priority, max_attempts)[0]
+
+
+  def enqueue_many(self, jobs, priority = 0, max_attempts = DEFAULT_MAX_ATTEMPTS) -> List[int]:
+    """
+    Add many jobs to the queue at once (in a single transaction).
+
+    Args:
+        jobs: list of dictionaries, each storing the kind of the job under "kind",
+              and its arguments (see `enqueue`)
+
+    Returns:
+        the ids of the jobs, in the same order as `jobs`
+    """
+
+    job_ids = list()
+    now = time.time()
+
+    with self._connect() as conn:
+      for job in jobs:
+        job = dict(job)
+        kind = job.pop("kind")
+
+        if kind not in JOB_KINDS:
+          raise ValueError("Unknown job kind '%s' (expected one of %s)."%(kind, JOB_KINDS))
+
+        cursor = conn.execute("INSERT INTO jobs (kind, kwargs, status, priority, attempts, max_attempts, created) "
+                              "VALUES (?, ?, 'pending', ?, 0, ?, ?)",
+                              (kind, json.dumps(job), priority, max_attempts, now))
+        job_ids.append(cursor.lastrowid)
+
+    return job_ids
+
+
+  def claim(self, worker_id = None, lease_time = DEFAULT_LEASE_TIME) -> Optional[Dict]:
+    """
+    Lease the next job to run: the pending job with the highest priority, or a running job
+    whose lease expired (i.e., its worker stopped sending heartbeats).
+
+    Returns:
+        the job (see `get_job`), or None if there is nothing to run
+    """
+
+    worker_id = worker_id or get_worker_id()
+    now = time.time()
+
+    with self._connect() as conn:
+      # jobs whose worker vanished on their last attempt are not retried
+      conn.execute("UPDATE jobs SET status = 'failed', finished = ?, "
+                   "error = COALESCE(error || '\n', '') || 'lease expired (worker ' || worker || ' lost)' "
+                   "WHERE status = 'running' AND lease_expires < ? AND attempts >= max_attempts", (now, now))
+
+      row = conn.execute("SELECT id FROM jobs WHERE status = 'pending' OR "
+                         "(status = 'running' AND lease_expires < ?) "
+                         "ORDER BY priority DESC, id ASC LIMIT 1", (now,)).fetchone()
+
+      if row is None:
+        return None
+
+      conn.execute("UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+                   "lease_expires = ?, started = ? WHERE id = ?",
+                   (worker_id, now + lease_time, now, row[0]))
+
+    return self.get_job(row[0])
+
+
+  def heartbeat(self, job_id, worker_id = None, lease_time = DEFAULT_LEASE_TIME) -> bool:
+    """
+    Renew the lease on a running job.
+
+    Returns:
+        False if the worker does not hold the job anymore (e.g., its lease expired and the job
+        was handed to another worker), True otherwise
+    """
+
+    with self._connect() as conn:
+      cursor = conn.execute("UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                            (time.time() + lease_time, job_id, worker_id or get_worker_id()))
+
+    return cursor.rowcount == 1
+
+
+  def complete(self, job_id, result, worker_id = None) -> bool:
+    """
+    Store the (JSON-serializable) result of a job and mark it as done.
+
+    Returns:
+        False if the worker does not hold the job anymore (the result is then discarded)
+    """
+
+    with self._connect() as conn:
+      cursor = conn.execute("UPDATE jobs SET status = 'done', result = ?, finished = ?, lease_expires = NULL "
+                            "WHERE id = ? AND worker = ? AND status = 'running'",
+                            (json.dumps(result), time.time(), job_id, worker_id or get_worker_id()))
+
+    return cursor.rowcount == 1
+
+
+  def fail(self, job_id, error, worker_id = None) -> bool:
+    """
+    Record the failure of a job: it is queued again if it has attempts left, and marked as failed otherwise.
+
+    Returns:
+        False if the worker does not hold the job anymore
+    """
+
+    with self._connect() as conn:
+      cursor = conn.execute("UPDATE jobs SET "
+                            "status = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END, "
+                            "error = ?, finished = ?, lease_expires = NULL "
+                            "WHERE id = ? AND worker = ? AND status = 'running'",
+                            (error, time.time(), job_id, worker_id or get_worker_id()))
+
+    return cursor.rowcount == 1
+
+
+  def retry_failed(self, extra_attempts = 1) -> int:
+    """
+    Queue the failed jobs again, granting each of them `extra_attempts` more attempts.
+
+    Returns:
+        the number of jobs queued again
+    """
+
+    with self._connect() as conn:
+      cursor = conn.execute("UPDATE jobs SET status = 'pending', max_attempts = attempts + ? "
+                            "WHERE status = 'failed'", (extra_attempts,))
+
+    return cursor.rowcount
+
+
+  def _row_to_job(self, row):
+
+    job = dict(zip(JOB_COLUMNS, row))
+    job["kwargs"] = json.loads(job["kwargs"])
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+
+    return job
+
+
+  def get_job(self, job_id) -> Optional[Dict]:
+    """
+    Get a job (a dictionary with the columns of the job table, i.e. JOB_COLUMNS) by id.
+    """
+
+    with self._connect() as conn:
+      row = conn.execute("SELECT %s FROM jobs WHERE id = ?"%(", ".join(JOB_COLUMNS)), (job_id,)).fetchone()
+
+    return self._row_to_job(row) if row is not None else None
+
+
+  def jobs(self, status = None) -> List[Dict]:
+    """
+    List the jobs (optionally, only the ones with the given status), in order of creation.
+    """
+
+    query = "SELECT %s FROM jobs"%(", ".join(JOB_COLUMNS))
+    params = ()
+
+    if status is not None:
+      query += " WHERE status = ?"
+      params = (status,)
+
+    with self._connect() as conn:
+      rows = conn.execute(query + " ORDER BY id", params).fetchall()
+
+    return [self._row_to_job(row) for row in rows]
+
+
+  def counts(self) -> Dict[str, int]:
+    """
+    Number of jobs per status ("pending", "running", "done", "failed").
+    """
+
+    counts = {status : 0 for status in ["pending", "running", "done", "failed"]}
+
+    with self._connect() as conn:
+      for status, count in conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+        counts[status] = count
+
+    return counts
+
+## ----------------------------------------
+
+def _run_job(job):
+  """
+  Run a job, returning its (JSON-serializable) result.
+  """
+
+  kwargs = dict(job["kwargs"])
+
+  if job["kind"] in EVALUATION_STEPS:
+    return EVALUATION_STEPS[job["kind"]](verbose = False, **kwargs)
+
+  path_to_log_file = kwargs.pop("path_to_log_file", None)
+
+  result = _sync.run_plastimatch_command(_sync.get_bash_command(job["kind"], **kwargs),
+                                         path_to_log_file = path_to_log_file)
+  result.check_returncode()
+
+  return {"returncode" : result.returncode,
+          "wall_time" : result.wall_time,
+          "user_time" : result.user_time,
+          "sys_time" : result.sys_time,
+          "max_rss" : result.max_rss}
+
+## ----------------------------------------
+
+def run_worker(path_to_db, worker_id = None, lease_time = DEFAULT_LEASE_TIME, poll_interval = 1.0,
+               max_jobs = None, exit_when_empty = False, verbose = True) -> int:
+  """
+  Pull jobs from a queue and run them, one at a time, until stopped (or until the queue is empty,
+  if `exit_when_empty` is set). Run as many workers as needed, on any host sharing the queue.
+
+  While a job runs, a background thread renews its lease every `lease_time`/3 seconds
+  (and retries every `lease_time`/30 seconds if renewing it fails).
+
+  Args:
+      path_to_db: path to the queue database (see `JobQueue`)
+      worker_id: identifier of the worker (defaults to "<hostname>:<pid>")
+      lease_time: time, in seconds, after which the job of a worker that stopped sending heartbeats
+                  is handed to another worker
+      poll_interval: time, in seconds, to wait before checking the queue again when it is empty
+      max_jobs: stop after running this many jobs (None for no limit)
+      exit_when_empty: stop as soon as there is no job to run
+
+  Returns:
+      the number of jobs run by the worker
+  """
+
+  job_queue = JobQueue(path_to_db)
+  worker_id = worker_id or get_worker_id()
+
+  num_jobs = 0
+
+  if verbose: print("Worker %s pulling jobs from %s"%(worker_id, path_to_db))
+
+  while max_jobs is None or num_jobs < max_jobs:
+    job = job_queue.claim(worker_id, lease_time)
+
+    if job is None:
+      if exit_when_empty:
+        break
+      time.sleep(poll_interval)
+      continue
+
+    if verbose: print("  job %d (%s, attempt %d)..."%(job["id"], job["kind"], job["attempts"]), end = " ", flush = True)
+
+    stop_heartbeat = threading.Event()
+
+    def _heartbeat(job_id = job["id"]):
+      interval = lease_time / 3
+      while not stop_heartbeat.wait(interval):
+        try:
+          job_queue.heartbeat(job_id, worker_id, lease_time)
+          interval = lease_time / 3
+        except Exception as e:
+          # e.g., the database stayed locked, or the shared filesystem was briefly unavailable:
+          # keep trying (sooner than usual), the lease is only lost if no heartbeat succeeds in time
+          print("Heartbeat of job %d failed, retrying: %s"%(job_id, e))
+          interval = lease_time / 30
+
+    heartbeat_thread = threading.Thread(target = _heartbeat, daemon = True)
+    heartbeat_thread.start()
+
+    try:
+      result = _run_job(job)
+      error = None
+    except Exception as e:
+      error = str(e) or repr(e)
+      # without a log file, the tail of stderr is the only trace of what went wrong
+      if getattr(e, "stderr", None):
+        error += "\n" + e.stderr[-2048:]
+    finally:
+      stop_heartbeat.set()
+      heartbeat_thread.join()
+
+    if error is None:
+      recorded = job_queue.complete(job["id"], result, worker_id)
+    else:
+      recorded = job_queue.fail(job["id"], error, worker_id)
+
+    if verbose:
+      status = "Done" if error is None else "FAILED (%s)"%(error.splitlines()[0])
+      print(status + ("." if recorded else " (lease lost, outcome discarded)."))
+
+    num_jobs += 1
+
+  return num_jobs
@@ -0,0 +1,333 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Declarative multi-step pipelines
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import collections
+import concurrent.futures
+from typing import Dict
+
+from . import pyplastimatch as _sync
+
+# steps running a plastimatch command (failures are raised, unlike the `convert`/`resample` wrappers)
+COMMAND_STEPS = ["convert", "resample"]
+
+# steps running an evaluation wrapper (all the arguments are passed as keywords)
+EVALUATION_STEPS = {"dice" : _sync.dice, "hd" : _sync.hd, "compare" : _sync.compare}
+
+## ----------------------------------------
+
+class Scratch:
+  """
+  Placeholder for an intermediate file or directory of a pipeline, stored in the scratch area
+  and deleted as soon as every node using it is done.
+
+  Use `Pipeline.scratch()` to create one, and `/` to refer to a file inside a scratch directory
+  (e.g., `masks / "heart.nrrd"` for the masks written by 'plastimatch convert --output-prefix').
+  """
+
+  def __init__(self, root, relpath = ""):
+    self.root = root
+    self.relpath = relpath
+
+  def __truediv__(self, name):
+    return Scratch(self.root, os.path.join(self.relpath, str(name)))
+
+  def __repr__(self):
+    return "Scratch(%r)"%(os.path.join(self.root, self.relpath) if self.relpath else self.root)
+
+## ----------------------------------------
+
+class Pipeline:
+  """
+  Declare per-patient processing steps (e.g., convert -> resample -> dice/hd), then run them
+  as a dependency graph, with independent nodes running in parallel.
+
+  A node depends on the nodes writing the Scratch objects it reads (i.e., passed under
+  a key starting with "output", such as "output-img" or "output-prefix"), and on the nodes
+  listed in its `after` argument. If a node fails, the nodes depending on it are skipped.
+
+  Example:
+      pipe = Pipeline()
+      for pat, (ct_dir, rt_file, pred_file) in cohort.items():
+        masks = pipe.scratch("masks")
+        pipe.add(pat + "/convert", "convert", input = rt_file,
+                 **{"referenced-ct" : ct_dir, "output-prefix" : masks})
+        pipe.add(pat + "/resample", "resample", input = pred_file, fixed = masks / "heart.nrrd",
+                 output = pipe.scratch("pred.nrrd"))
+        ...
+      nodes = pipe.run()
+
+  Args:
+      scratch_dir: directory where the intermediates are stored (defaults to tmpfs where available,
+                   see `utils.images.get_scratch_dir`)
+      max_workers: maximum number of nodes running at the same time (defaults to the number of CPUs)
+      keep_intermediates: do not delete the intermediates (e.g., for debugging)
+  """
+
+  def __init__(self, scratch_dir = None, max_workers = None, keep_intermediates = False):
+
+    self.scratch_dir = scratch_dir
+    self.max_workers = max_workers or os.cpu_count() or 1
+    self.keep_intermediates = keep_intermediates
+
+    self.nodes = collections.OrderedDict()
+    self.records = collections.OrderedDict()
+    self._num_scratch = 0
+
+
+  def scratch(self, name) -> Scratch:
+    """
+    Create a new intermediate (file or directory), named after `name` (e.g., "ct.nrrd", "masks").
+    """
+
+    self._num_scratch += 1
+
+    return Scratch("%05d_%s"%(self._num_scratch, name))
+
+
+  def add(self, name, step, after = (), stage = None, path_to_log_file = None, **kwargs):
+    """
+    Add a node to the pipeline.
+
+    Args:
+        name: unique name of the node (e.g., "LUNG1-001/convert")
+        step: "convert" or "resample" (kwargs: the arguments of the plastimatch command),
+              "dice", "hd" or "compare" (kwargs: the arguments of the wrapper, e.g. `path_to_reference_img`),
+              or any callable (called with the kwargs)
+        after: names of nodes this node depends on (in addition to the ones inferred from the intermediates)
+        stage: name the timings of the node are grouped under in `summary()` (defaults to the step name)
+        path_to_log_file: log file of the plastimatch command ("convert" and "resample" only)
+
+        **kwargs: arguments of the step. Scratch objects are replaced with the corresponding paths.
+    """
+
+    if name in self.nodes:
+      raise ValueError("A node named '%s' already exists."%(name))
+
+    if not callable(step) and step not in COMMAND_STEPS and step not in EVALUATION_STEPS:
+      raise ValueError("Unknown step '%s' (expected one of %s, or a callable)."%(step, COMMAND_STEPS +
+                                                                                 list(EVALUATION_STEPS)))
+
+    for dependency in after:
+      if dependency not in self.nodes:
+        raise ValueError("Unknown node '%s' (nodes must be added after their dependencies)."%(dependency))
+
+    node = dict()
+    node["step"] = step
+    node["stage"] = stage or (step if isinstance(step, str) else getattr(step, "__name__", "callable"))
+    node["kwargs"] = kwargs
+    node["path_to_log_file"] = path_to_log_file
+    node["writes"] = {val.root for key, val in kwargs.items() if isinstance(val, Scratch) and key.startswith("output")}
+    node["reads"] = {val.root for key, val in kwargs.items() if isinstance(val, Scratch)} - node["writes"]
+    node["after"] = set(after)
+
+    for root in node["reads"]:
+      writers = [other for other, other_node in self.nodes.items() if root in other_node["writes"]]
+      if not writers:
+        raise ValueError("Node '%s' reads an intermediate no previous node writes (%s)."%(name, root))
+      node["after"].update(writers)
+
+    self.nodes[name] = node
+
+
+  def _resolve(self, value, run_dir):
+    if not isinstance(value, Scratch):
+      return value
+
+    path = os.path.join(run_dir, value.root)
+
+    return os.path.join(path, value.relpath) if value.relpath else path
+
+
+  def _run_node(self, name, run_dir):
+    """
+    Run a single node (in the worker threads), returning its result.
+    """
+
+    node = self.nodes[name]
+    kwargs = {key : self._resolve(val, run_dir) for key, val in node["kwargs"].items()}
+
+    # make sure the parent directory of a file intermediate exists (e.g., "pred.nrrd" under a patient folder)
+    for key, val in node["kwargs"].items():
+      if isinstance(val, Scratch) and key.startswith("output"):
+        os.makedirs(os.path.dirname(kwargs[key]), exist_ok = True)
+
+    step = node["step"]
+
+    if callable(step):
+      return step(**kwargs)
+
+    if step in EVALUATION_STEPS:
+      return EVALUATION_STEPS[step](verbose = False, **kwargs)
+
+    result = _sync.run_plastimatch_command(_sync.get_bash_command(step, **kwargs),
+                                           path_to_log_file = node["path_to_log_file"])
+    result.check_returncode()
+
+    return result
+
+
+  def _delete_intermediate(self, root, run_dir):
+
+    if self.keep_intermediates:
+      return
+
+    path = os.path.join(run_dir, root)
+
+    if os.path.isdir(path):
+      shutil.rmtree(path, ignore_errors = True)
+    elif os.path.exists(path):
+      os.remove(path)
+
+
+  def run(self, verbose = True) -> Dict[str, Dict]:
+    """
+    Run every node of the pipeline, as soon as all its dependencies are done.
+
+    Returns:
+        dictionary storing, for every node (in the order they were added):
+          status      "done", "failed", or "skipped" (a dependency failed)
+          result      what the step returned (e.g., the `dice()` dictionary, or a PlastimatchCommandResult)
+          error       description of the failure (None on success)
+          start_time  start time of the node, in seconds since the start of the run (None if skipped)
+          wall_time   run time of the node, in seconds (None if skipped)
+    """
+
+    if self.scratch_dir is None:
+      # imported here so that pipelines can be declared without the numerical stack
+      from .utils.images import get_scratch_dir
+      self.scratch_dir = get_scratch_dir()
+
+    os.makedirs(self.scratch_dir, exist_ok = True)
+    run_dir = tempfile.mkdtemp(prefix = "pyplastimatch_pipeline_", dir = self.scratch_dir)
+
+    records = collections.OrderedDict((name, {"status" : None, "result" : None, "error" : None,
+                                              "start_time" : None, "wall_time" : None})
+                                      for name in self.nodes)
+
+    # number of nodes still to settle (done, failed or skipped) before each intermediate can be deleted
+    pending_users = collections.Counter()
+    for node in self.nodes.values():
+      for root in node["reads"] | node["writes"]:
+        pending_users[root] += 1
+
+    remaining = set(self.nodes)
+    running = dict()
+    run_start = time.perf_counter()
+
+    if verbose:
+      print("\nRunning a pipeline of %d nodes (%d at a time)"%(len(self.nodes), self.max_workers))
+
+    def _settle(name, status):
+      records[name]["status"] = status
+      remaining.discard(name)
+
+      node = self.nodes[name]
+      for root in node["reads"] | node["writes"]:
+        pending_users[root] -= 1
+        if pending_users[root] == 0:
+          self._delete_intermediate(root, run_dir)
+
+      if verbose:
+        wall_time = records[name]["wall_time"]
+        timing = " (%.2f s)"%(wall_time) if wall_time is not None else ""
+        print("  [%d/%d] %s... %s%s."%(len(self.nodes) - len(remaining), len(self.nodes), name,
+                                       status.capitalize(), timing))
+        if records[name]["error"] is not None:
+          print("    " + records[name]["error"].replace("\n", "\n    "))
+
+    def _run_timed(name):
+      start_time = time.perf_counter()
+      records[name]["start_time"] = start_time - run_start
+      try:
+        return self._run_node(name, run_dir)
+      finally:
+        records[name]["wall_time"] = time.perf_counter() - start_time
+
+    try:
+      with concurrent.futures.ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+        while remaining:
+          # skip the nodes whose dependencies failed (in declaration order, so skips propagate)
+          for name in list(self.nodes):
+            if name in remaining and name not in running:
+              failed = [dep for dep in self.nodes[name]["after"] if records[dep]["status"] in ("failed", "skipped")]
+              if failed:
+                records[name]["error"] = "dependency '%s' did not complete"%(failed[0])
+                _settle(name, "skipped")
+
+          for name in list(self.nodes):
+            if name in remaining and name not in running and \
+               all(records[dep]["status"] == "done" for dep in self.nodes[name]["after"]):
+              running[name] = executor.submit(_run_timed, name)
+
+          if not running:
+            break
+
+          done, _ = concurrent.futures.wait(list(running.values()),
+                                            return_when = concurrent.futures.FIRST_COMPLETED)
+
+          for name in [name for name, future in running.items() if future in done]:
+            future = running.pop(name)
+            try:
+              records[name]["result"] = future.result()
+              _settle(name, "done")
+            except Exception as e:
+              records[name]["error"] = str(e) or repr(e)
+              # without a log file, the tail of stderr is the only trace of what went wrong
+              if getattr(e, "stderr", None):
+                records[name]["error"] += "\n" + e.stderr[-2048:]
+              _settle(name, "failed")
+    finally:
+      if not self.keep_intermediates:
+        shutil.rmtree(run_dir, ignore_errors = True)
+
+    self.records = records
+
+    if verbose:
+      print("... Done (%.2f s)."%(time.perf_counter() - run_start))
+
+    return records
+
+
+  def summary(self) -> Dict[str, Dict]:
+    """
+    Aggregate the timings of the last run per stage, to find the bottleneck.
+
+    Returns:
+        dictionary storing, for every stage (sorted by decreasing total time):
+          count, failed   number of nodes run, and of failed ones
+          total, mean, max   total, average and maximum run time of the nodes, in seconds
+    """
+
+    stage_times = collections.defaultdict(list)
+    stage_failed = collections.Counter()
+
+    for name, record in self.records.items():
+      if record["wall_time"] is None:
+        continue
+      stage = self.nodes[name]["stage"]
+      stage_times[stage].append(record["wall_time"])
+      stage_failed[stage] += record["status"] == "failed"
+
+    summary = {stage : {"count" : len(times),
+                        "failed" : stage_failed[stage],
+                        "total" : sum(times),
+                        "mean" : sum(times) / len(times),
+                        "max" : max(times)}
+               for stage, times in stage_times.items()}
+
+    return dict(sorted(summary.items(), key = lambda item: -item[1]["total"]))
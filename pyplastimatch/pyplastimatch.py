@@ -13,18 +13,327 @@
 """
 
 import os
+import sys
 import json
+import time
+import queue
+import tempfile
+import threading
+import collections
+import contextlib
 import subprocess
-from typing import Dict
+from typing import Callable, Dict, List
 
 ## ----------------------------------------
 
-# FIXME: like this, every command is basically the same function with a line changed
-# define classes/something more fancy (for parsing etc.)?
-# Otherwise we may very well just have a function called "run_plastimatch_command"
-# and pass it also the command we want to run (convert, resample, etc.)
+# options that can be passed more than once: if given as a list, each item becomes a separate "--key item"
+REPEATABLE_OPTIONS = ["metadata"]
 
-def convert(verbose = True, path_to_log_file = None, return_bash_command = False, **kwargs):
+# callables run on the PlastimatchCommandResult of every plastimatch command (e.g., to feed a profiler)
+_command_hooks = list()
+
+# number of lines of each stream kept in memory when streaming the output of a command
+DEFAULT_TAIL_LINES = 200
+
+# maximum number of output lines waiting to be handled when streaming (bounds memory if a callback is slow)
+STREAM_QUEUE_SIZE = 1024
+
+## ----------------------------------------
+
+class PlastimatchCommandResult:
+  """
+  Outcome of a plastimatch command, as returned by `run_plastimatch_command`.
+  
+  Attributes:
+      bash_command: the executed command
+      returncode: exit code of plastimatch (negative if the process was killed by a signal)
+      wall_time: wall-clock time of the run, in seconds
+      user_time: user CPU time of the process, in seconds (None where resource usage is not available)
+      sys_time: system CPU time of the process, in seconds (None where resource usage is not available)
+      max_rss: peak resident set size of the process, in bytes (None where resource usage is not available).
+               On Linux, the figure can not be lower than the resident set size of the Python process
+               at the time plastimatch was launched, which is inherited before the exec.
+      path_to_stdout: file stdout was written to (None if it was captured)
+      path_to_stderr: file stderr was written to (None if it was captured)
+      stdout: captured stdout (None if it was written to a file)
+      stderr: captured stderr (None if it was written to a file)
+  """
+  
+  def __init__(self, bash_command, returncode, wall_time, user_time = None, sys_time = None, max_rss = None,
+               path_to_stdout = None, path_to_stderr = None, stdout = None, stderr = None):
+
+    self.bash_command = bash_command
+    self.returncode = returncode
+
+    self.wall_time = wall_time
+    self.user_time = user_time
+    self.sys_time = sys_time
+    self.max_rss = max_rss
+
+    self.path_to_stdout = path_to_stdout
+    self.path_to_stderr = path_to_stderr
+    self.stdout = stdout
+    self.stderr = stderr
+
+
+  def __repr__(self):
+
+    return "PlastimatchCommandResult(command=%r, returncode=%r, wall_time=%.3f, max_rss=%r)"%(
+      " ".join(self.bash_command[:2]), self.returncode, self.wall_time, self.max_rss)
+
+
+  def check_returncode(self):
+    """
+    Raise a CalledProcessError if plastimatch exited with a non-zero exit code.
+    
+    The exception holds the arguments, the exit code, and stdout and stderr if they were captured.
+    For details, see: https://docs.python.org/3/library/subprocess.html#subprocess.CalledProcessError
+    """
+
+    if self.returncode:
+      raise subprocess.CalledProcessError(self.returncode, self.bash_command,
+                                          output = self.stdout, stderr = self.stderr)
+
+## ----------------------------------------
+
+def add_command_hook(hook: Callable[[PlastimatchCommandResult], None]) -> None:
+  """
+  Register a callable to be run on the PlastimatchCommandResult of every plastimatch command
+  (e.g., to ship the timing and memory figures to a profiler).
+  """
+
+  _command_hooks.append(hook)
+
+
+def remove_command_hook(hook: Callable[[PlastimatchCommandResult], None]) -> None:
+  """
+  Unregister a callable previously registered with `add_command_hook`.
+  """
+
+  _command_hooks.remove(hook)
+
+## ----------------------------------------
+
+def get_bash_command(command, *args, **kwargs) -> List[str]:
+  """
+  Build a plastimatch command.
+  
+  Args:
+      command: the plastimatch command to run (e.g., "convert", "resample", "dice")
+      *args: arguments passed as they are, before the options (e.g., flags and input files)
+      **kwargs: options, each passed as "--key value" (see REPEATABLE_OPTIONS for the ones that can be lists)
+  """
+
+  bash_command = list()
+  bash_command += ["plastimatch", command]
+  bash_command += [str(arg) for arg in args]
+  
+  for key, val in kwargs.items():
+      if key in REPEATABLE_OPTIONS and isinstance(val, list):
+          for item in val:
+              bash_command += [f"--{key}", str(item)]
+      else:
+          bash_command += [f"--{key}", str(val)]
+
+  return bash_command
+
+## ----------------------------------------
+
+def _wait_process(process):
+  """
+  Wait for a process to exit, collecting its resource usage where the platform supports it.
+  
+  Returns:
+      the exit code of the process and its `resource.struct_rusage` (or None)
+  """
+
+  if not hasattr(os, "wait4"):
+    return process.wait(), None
+  
+  _, wait_status, rusage = os.wait4(process.pid, 0)
+
+  if os.WIFSIGNALED(wait_status):
+    returncode = -os.WTERMSIG(wait_status)
+  else:
+    returncode = os.WEXITSTATUS(wait_status)
+  
+  # the process was reaped by wait4: let Popen know, so that it does not try to wait for it again
+  process.returncode = returncode
+
+  return returncode, rusage
+
+## ----------------------------------------
+
+def _stream_output(process, line_callback, tail_lines, log_file):
+  """
+  Read the output of a running process line by line, as it is produced.
+  
+  Each line is appended to the log file (if any), passed to `line_callback` (if any) in the calling thread,
+  and stored in a ring buffer holding the last `tail_lines` lines of its stream.
+  If the callback raises, the process is killed, and the exception is returned once the output is drained.
+  
+  Returns:
+      the tail of stdout and stderr (as strings), and the exception raised by the callback (or None)
+  """
+
+  line_queue = queue.Queue(maxsize = STREAM_QUEUE_SIZE)
+
+  def _read_lines(stream_name, pipe):
+    for raw_line in iter(pipe.readline, b""):
+      line_queue.put((stream_name, raw_line))
+    pipe.close()
+    line_queue.put((stream_name, None))
+
+  reader_threads = [threading.Thread(target = _read_lines, args = (stream_name, pipe), daemon = True)
+                    for stream_name, pipe in (("stdout", process.stdout), ("stderr", process.stderr))]
+  for reader_thread in reader_threads:
+    reader_thread.start()
+
+  tails = {"stdout" : collections.deque(maxlen = tail_lines), "stderr" : collections.deque(maxlen = tail_lines)}
+  callback_error = None
+  num_open_streams = len(reader_threads)
+
+  while num_open_streams:
+    stream_name, raw_line = line_queue.get()
+
+    if raw_line is None:
+      num_open_streams -= 1
+      continue
+
+    if log_file is not None:
+      log_file.write(raw_line)
+      log_file.flush()
+
+    line = raw_line.decode(errors = "replace").rstrip("\r\n")
+    tails[stream_name].append(line)
+
+    if line_callback is not None and callback_error is None:
+      try:
+        line_callback(line, stream_name)
+      except Exception as e:
+        callback_error = e
+        process.kill()
+
+  for reader_thread in reader_threads:
+    reader_thread.join()
+
+  return {stream_name : "\n".join(tail) for stream_name, tail in tails.items()}, callback_error
+
+## ----------------------------------------
+
+def run_plastimatch_command(bash_command, path_to_log_file = None,
+                            path_to_stdout = None, path_to_stderr = None,
+                            line_callback = None, tail_lines = None) -> PlastimatchCommandResult:
+  """
+  Run a plastimatch command, measuring its wall time, CPU time and peak memory.
+  
+  The command is not checked: failures are reported by the exit code of the returned result
+  (see `PlastimatchCommandResult.check_returncode`). After the run, every hook registered with
+  `add_command_hook` is called on the result.
+  
+  Args:
+      bash_command: the command to run (see `get_bash_command`)
+      path_to_log_file: path to file where both stdout and stderr should be logged (appending)
+      path_to_stdout: path to file where stdout should be written (appending), if no log file is specified
+      path_to_stderr: path to file where stderr should be written (appending), if no log file is specified
+      
+      Streams that are not written to a file are captured, and stored in the result.
+      
+      (STREAMING)
+      line_callback: callable run as `line_callback(line, stream_name)` on every line of output
+                     ("stdout" or "stderr"), as soon as plastimatch prints it (e.g., to track progress).
+                     If the callback raises, plastimatch is killed and the exception is re-raised.
+      tail_lines: number of lines of each stream kept in the result when streaming
+                  (defaults to DEFAULT_TAIL_LINES)
+      
+      Setting any of these streams the output: only its tail is kept in memory (and stored in the result),
+      while the full output is appended to `path_to_log_file`, if specified.
+      
+  Returns:
+      PlastimatchCommandResult storing the outcome of the run
+  """
+
+  streaming = line_callback is not None or tail_lines is not None
+
+  if streaming and (path_to_stdout or path_to_stderr):
+    raise ValueError("When streaming the output, use path_to_log_file to write it to file.")
+
+  if path_to_log_file:
+    path_to_stdout = path_to_stderr = path_to_log_file
+
+  callback_error = None
+
+  with contextlib.ExitStack() as stack:
+    if streaming:
+      log_file = stack.enter_context(open(path_to_log_file, "ab")) if path_to_log_file else None
+      stdout_file = stderr_file = subprocess.PIPE
+    elif path_to_log_file:
+      stdout_file = stderr_file = stack.enter_context(open(path_to_log_file, "a"))
+    else:
+      # the output is captured in temporary files, so that there are no pipes to drain
+      # while waiting for the process (needed to collect its resource usage)
+      stdout_file = stack.enter_context(open(path_to_stdout, "a") if path_to_stdout else tempfile.TemporaryFile())
+      stderr_file = stack.enter_context(open(path_to_stderr, "a") if path_to_stderr else tempfile.TemporaryFile())
+
+    start_time = time.perf_counter()
+    
+    process = subprocess.Popen(bash_command, stdout = stdout_file, stderr = stderr_file)
+
+    if streaming:
+      # the pipes are drained before waiting for the process, so it can never block on a full pipe
+      captured_output, callback_error = _stream_output(process, line_callback,
+                                                       tail_lines or DEFAULT_TAIL_LINES, log_file)
+
+    returncode, rusage = _wait_process(process)
+    
+    wall_time = time.perf_counter() - start_time
+
+    if not streaming:
+      captured_output = dict()
+      for key, path, stream_file in (("stdout", path_to_stdout, stdout_file),
+                                     ("stderr", path_to_stderr, stderr_file)):
+        if path is None:
+          stream_file.seek(0)
+          captured_output[key] = stream_file.read().decode(errors = "replace")
+        else:
+          captured_output[key] = None
+
+  result = PlastimatchCommandResult(bash_command, returncode, wall_time,
+                                    path_to_stdout = path_to_stdout, path_to_stderr = path_to_stderr,
+                                    **captured_output)
+
+  if rusage is not None:
+    result.user_time = rusage.ru_utime
+    result.sys_time = rusage.ru_stime
+    # ru_maxrss is in kilobytes on Linux, and in bytes on macOS
+    result.max_rss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss*1024
+
+  _run_command_hooks(result)
+
+  if callback_error is not None:
+    raise callback_error
+
+  return result
+
+## ----------------------------------------
+
+def _run_command_hooks(result):
+  """
+  Call every hook registered with `add_command_hook` on the result of a plastimatch command.
+  """
+
+  for hook in _command_hooks:
+    try:
+      hook(result)
+    except Exception as e:
+      # a failing hook (e.g., an unreachable profiler) should not fail the processing
+      print("Command hook %r failed: %s"%(hook, e))
+
+## ----------------------------------------
+
+def convert(verbose = True, path_to_log_file = None, return_bash_command = False,
+            incremental = False, force = False, hash_inputs = False, line_callback = None,
+            backend = "cli", **kwargs):
   """
   Convert DICOM series to any supported file format.
   
@@ -35,37 +344,80 @@ def convert(verbose = True, path_to_log_file = None, return_bash_command = False
       (GENERAL)
       path_to_log_file: path to file where stdout and stderr from the processing should be logged
       return_bash_command: return the executed command together with the exit status
+      incremental: record a manifest of the inputs, arguments and outputs next to the outputs
+                   (see `utils.manifest`), and skip the conversion if nothing changed since the last run
+      force: run the conversion even if the manifest says it is up to date
+      hash_inputs: identify the input files by the hash of their content as well
+                   (more robust, but every input file is read)
+      line_callback: callable run as `line_callback(line, stream_name)` on every line printed by plastimatch,
+                     as soon as it is printed (see `run_plastimatch_command`). Only the tail of the output
+                     is then kept in memory.
+      backend: "cli" to run 'plastimatch convert', "native" to rasterize an RTSTRUCT in-process
+               (see `utils.rtstruct.native_convert`). Calls using options the native backend does not
+               support (see `utils.rtstruct.NATIVE_CONVERT_OPTIONS`), or failing with it, fall back to the CLI.
       
       **kwargs: all the arguments parsable by 'plastimatch convert'
         Special Cases:
             - metadata (list): If provided as a list, each item is passed as a separate `--metadata` argument.
+  
+  Returns:
+      the executed command if `return_bash_command` is set, otherwise the PlastimatchCommandResult
+      of the run (None if the conversion was skipped, or run in-process)
   """
 
-  bash_command = list()
-  bash_command += ["plastimatch", "convert"]
+  bash_command = get_bash_command("convert", **kwargs)
   
-  for key, val in kwargs.items():
-      if key == "metadata" and isinstance(val, list):
-          for meta in val:
-              bash_command += ["--metadata", str(meta)]
-      else:
-          bash_command += [f"--{key}", str(val)]
+  if incremental:
+    # imported here so that the manifest utilities are only loaded if requested
+    from .utils import manifest
+
+    if not force and manifest.is_up_to_date(kwargs, hash_inputs = hash_inputs):
+      if verbose: print("\nInputs and arguments unchanged since the last run, skipping 'plastimatch convert'.")
+      if return_bash_command:
+        return bash_command
+      return
   
   if verbose:
     print("\nRunning 'plastimatch convert' with the specified arguments:")
     for arg in bash_command[2:]:
         print(f"  {arg}")
   
+  result = None
+
+  if backend == "native":
+    # imported here so that the CLI wrappers do not need the numerical stack
+    from .utils.rtstruct import get_native_convert_unsupported, native_convert
+
+    unsupported = get_native_convert_unsupported(kwargs)
+
+    if not unsupported:
+      try:
+        native_convert(**kwargs)
+        if incremental:
+          manifest.write_manifest(kwargs, hash_inputs = hash_inputs)
+        if verbose: print("... Done (native backend).")
+
+        return bash_command if return_bash_command else result
+      
+      except Exception as e:
+        # e.g., unevenly spaced slices, which plastimatch resamples
+        if verbose: print("Falling back to the CLI (native backend failed: %s)"%(e))
+
+    elif verbose:
+      print("Falling back to the CLI (not supported by the native backend: %s)"%(", ".join(unsupported)))
+
+  elif backend != "cli":
+    raise ValueError("Unknown backend '%s' (expected 'cli' or 'native')."%(backend))
+
   try:
-    if path_to_log_file:
-      with open(path_to_log_file, "a") as log_file:
-        bash_exit_status = subprocess.run(bash_command,
-                                          stdout = log_file, stderr = log_file,
-                                          check = True)
-    else:
-      # if no log file is specified, output to the default stdout and stderr
-      bash_exit_status = subprocess.run(bash_command, capture_output = True, check = True)
+    # if no log file is specified, the output is captured
+    result = run_plastimatch_command(bash_command, path_to_log_file = path_to_log_file,
+                                     line_callback = line_callback)
+    result.check_returncode()
       
+    if incremental:
+      manifest.write_manifest(kwargs, hash_inputs = hash_inputs)
+    
     if verbose: print("... Done.")
     
   except Exception as e:
@@ -79,9 +431,161 @@ def convert(verbose = True, path_to_log_file = None, return_bash_command = False
   if return_bash_command:
     return bash_command
 
+  return result
+
+## ----------------------------------------
+
+def _run_convert_job(job_idx, job, log_dir = None, incremental = False, force = False, hash_inputs = False,
+                     backend = "cli") -> Dict:
+  """
+  Run a single 'plastimatch convert' job of a batch, and collect its outcome instead of printing it.
+  """
+
+  job = dict(job)
+
+  # each job gets its own log file, so that concurrent jobs do not interleave their output
+  path_to_log_file = job.pop("path_to_log_file", None)
+  if path_to_log_file is None and log_dir is not None:
+    path_to_log_file = os.path.join(log_dir, "convert_%05d.log"%(job_idx))
+
+  bash_command = get_bash_command("convert", **job)
+
+  job_result = dict()
+  job_result["bash_command"] = bash_command
+  job_result["path_to_log_file"] = path_to_log_file
+  job_result["backend"] = "cli"
+  job_result["returncode"] = None
+  job_result["error"] = None
+  job_result["skipped"] = False
+  job_result["result"] = None
+
+  if incremental:
+    from .utils import manifest
+
+    if not force and manifest.is_up_to_date(job, hash_inputs = hash_inputs):
+      job_result["skipped"] = True
+      return job_result
+
+  if backend == "native":
+    from .utils.rtstruct import get_native_convert_unsupported, native_convert
+
+    if not get_native_convert_unsupported(job):
+      try:
+        # the batch already runs jobs in parallel, rasterize the structures of each job one at a time
+        native_convert(max_workers = 1, **job)
+        if incremental:
+          manifest.write_manifest(job, hash_inputs = hash_inputs)
+
+        job_result["backend"] = "native"
+        job_result["returncode"] = 0
+        return job_result
+      except Exception:
+        # fall back to the CLI, e.g. for unevenly spaced slices
+        pass
+
+  try:
+    result = run_plastimatch_command(bash_command, path_to_log_file = path_to_log_file)
+
+    job_result["result"] = result
+    job_result["returncode"] = result.returncode
+    result.check_returncode()
+
+    if incremental:
+      manifest.write_manifest(job, hash_inputs = hash_inputs)
+
+  except subprocess.CalledProcessError as e:
+    job_result["returncode"] = e.returncode
+    job_result["error"] = str(e)
+
+    # without a log file, the tail of stderr is the only trace of what went wrong
+    if e.stderr:
+      job_result["error"] += "\n" + e.stderr[-2048:]
+
+  except Exception as e:
+    # e.g., the plastimatch executable could not be found, or the log file could not be opened
+    job_result["error"] = repr(e)
+
+  return job_result
+
+## ----------------------------------------
+
+def convert_many(jobs, max_workers = None, log_dir = None, verbose = True,
+                 incremental = False, force = False, hash_inputs = False, backend = "cli") -> List[Dict]:
+  """
+  Run many 'plastimatch convert' invocations at once, with bounded concurrency.
+  
+  Every job is run in its own plastimatch process and logs to its own file. Failures do not
+  stop the batch: they are reported in the result of the corresponding job.
+  
+  Args:
+      jobs: list of dictionaries, each storing the arguments parsable by 'plastimatch convert' for one job.
+            A job can specify its own log file under the "path_to_log_file" key.
+      max_workers: maximum number of plastimatch processes running at the same time
+                   (defaults to the number of CPUs).
+      log_dir: directory where the log of each job not specifying "path_to_log_file" is stored
+               (as "convert_<job index>.log"). If None, the output of those jobs is captured instead.
+      incremental: skip the jobs whose inputs and arguments did not change since their last run
+                   (see `convert`)
+      force: run all the jobs, even if they are up to date
+      hash_inputs: identify the input files of the jobs by the hash of their content as well (see `convert`)
+      backend: "cli", or "native" to run the RTSTRUCT conversions the native backend supports in-process
+               (see `convert`)
+      
+  Returns:
+      list of dictionaries (one per job, in the same order as `jobs`):
+        bash_command      the executed command
+        path_to_log_file  path to the log file of the job (or None)
+        backend           "native" if the job was run in-process, "cli" otherwise
+        returncode        exit code of plastimatch (0 for the jobs run in-process,
+                          None if the job was skipped or the process could not be started)
+        error             error message if the job failed, None otherwise
+        skipped           True if the job was skipped because it was up to date
+        result            PlastimatchCommandResult of the run, with its timing and memory figures
+                          (None if the job was skipped, run in-process, or the process could not be started)
+  """
+
+  # imported here, as it is not needed (and comparatively slow to import) for a single command
+  import concurrent.futures
+
+  if backend not in ("cli", "native"):
+    raise ValueError("Unknown backend '%s' (expected 'cli' or 'native')."%(backend))
+
+  jobs = list(jobs)
+
+  if max_workers is None:
+    max_workers = os.cpu_count() or 1
+
+  if log_dir is not None:
+    os.makedirs(log_dir, exist_ok = True)
+
+  if verbose:
+    print("\nRunning %d 'plastimatch convert' jobs (%d at a time)"%(len(jobs), max_workers))
+
+  results = [None]*len(jobs)
+
+  # the heavy lifting happens in the plastimatch processes, so threads are enough to drive them
+  with concurrent.futures.ThreadPoolExecutor(max_workers = max_workers) as executor:
+    future_to_idx = {executor.submit(_run_convert_job, job_idx, job, log_dir, incremental, force,
+                                     hash_inputs, backend) : job_idx
+                     for job_idx, job in enumerate(jobs)}
+    
+    for n_done, future in enumerate(concurrent.futures.as_completed(future_to_idx), 1):
+      job_idx = future_to_idx[future]
+      results[job_idx] = future.result()
+
+      if verbose:
+        if results[job_idx]["skipped"]:
+          status = "Skipped (up to date)"
+        else:
+          status = "Done" if results[job_idx]["error"] is None else "FAILED"
+        print("  [%d/%d] job %d... %s."%(n_done, len(jobs), job_idx, status))
+
+  return results
+
 ## ----------------------------------------
 
-def resample(verbose = True, path_to_log_file = None, return_bash_command = False, **kwargs):
+def resample(verbose = True, path_to_log_file = None, return_bash_command = False, line_callback = None,
+             backend = "cli", **kwargs):
   """
   Resample any volume of a supported format.
   
@@ -92,31 +596,58 @@ def resample(verbose = True, path_to_log_file = None, return_bash_command = Fals
       (GENERAL)
       path_to_log_file: path to file where stdout and stderr from the processing should be logged
       return_bash_command: return the executed command together with the exit status
+      line_callback: callable run as `line_callback(line, stream_name)` on every line printed by plastimatch,
+                     as soon as it is printed (see `run_plastimatch_command`). Only the tail of the output
+                     is then kept in memory.
+      backend: "cli" to run 'plastimatch resample', "sitk" to resample in-process with SimpleITK
+               (see `utils.images.sitk_resample`). Calls using options the SimpleITK backend does not
+               support (see `utils.images.SITK_RESAMPLE_OPTIONS`), or failing with it, fall back to the CLI.
       
       **kwargs: all the arguments parsable by 'plastimatch resample'
       
+  Returns:
+      the executed command if `return_bash_command` is set, otherwise the PlastimatchCommandResult of the run
+      (None if the volume was resampled in-process)
+      
   """
   
-  bash_command = list()
-  bash_command += ["plastimatch", "resample"]
-  
-  for key, val in kwargs.items():
-    bash_command += ["--%s"%(key), val]
+  bash_command = get_bash_command("resample", **kwargs)
   
   if verbose:
     print("\nRunning 'plastimatch resample' with the specified arguments:")
     for key, val in kwargs.items():
       print("  --%s"%(key), val)
   
+  result = None
+
+  if backend == "sitk":
+    # imported here so that the CLI wrappers do not need the numerical stack
+    from .utils.images import get_sitk_resample_unsupported, sitk_resample
+
+    unsupported = get_sitk_resample_unsupported(kwargs)
+
+    if not unsupported:
+      try:
+        sitk_resample(**kwargs)
+        if verbose: print("... Done (SimpleITK backend).")
+
+        return bash_command if return_bash_command else result
+
+      except Exception as e:
+        # e.g., an image SimpleITK can not read
+        if verbose: print("Falling back to the CLI (SimpleITK backend failed: %s)"%(e))
+
+    elif verbose:
+      print("Falling back to the CLI (not supported by the SimpleITK backend: %s)"%(", ".join(unsupported)))
+
+  elif backend != "cli":
+    raise ValueError("Unknown backend '%s' (expected 'cli' or 'sitk')."%(backend))
+
   try:
-    if path_to_log_file:
-      with open(path_to_log_file, "a") as log_file:
-        bash_exit_status = subprocess.run(bash_command,
-                                          stdout = log_file, stderr = log_file,
-                                          check = True)
-    else:
-      # if no log file is specified, output to the default stdout and stderr
-      bash_exit_status = subprocess.run(bash_command, capture_output = True, check = True)
+    # if no log file is specified, the output is captured
+    result = run_plastimatch_command(bash_command, path_to_log_file = path_to_log_file,
+                                     line_callback = line_callback)
+    result.check_returncode()
       
     if verbose: print("... Done.")
     
@@ -130,10 +661,37 @@ def resample(verbose = True, path_to_log_file = None, return_bash_command = Fals
   
   if return_bash_command:
     return bash_command
+
+  return result
   
 ## ----------------------------------------
 
-def dice(path_to_reference_img, path_to_test_img, verbose = True):
+def _with_result_cache(cache, metric, backend, input_paths, verbose, compute_result):
+  """
+  Return the cached result of `metric` for the given inputs if there is one,
+  otherwise compute it with `compute_result()` and store it in the cache.
+  """
+
+  # imported here so that the cache is only set up if requested
+  from .utils.cache import get_result_cache
+
+  cache = get_result_cache(cache)
+  cache_key = cache.make_key(metric, backend, input_paths)
+
+  result_dict = cache.get(cache_key)
+
+  if result_dict is not None:
+    if verbose: print("\nUsing the cached '%s' result for the two images."%(metric))
+    return result_dict
+
+  result_dict = compute_result()
+  cache.put(cache_key, result_dict)
+
+  return result_dict
+
+## ----------------------------------------
+
+def dice(path_to_reference_img, path_to_test_img, verbose = True, backend = "cli", cache = None):
   """
   Compute Dice coefficient for binary label images.
   
@@ -143,30 +701,54 @@ def dice(path_to_reference_img, path_to_test_img, verbose = True):
   Args:
       path_to_reference_img:
       path_to_test_img:
+      backend: "cli" to run 'plastimatch dice', "native" to compute the metrics in-process
+               with NumPy/SimpleITK (see `utils.metrics.native_dice`)
+      cache: if set (a `utils.cache.ResultCache`, a cache directory, or True for the default cache),
+             return the cached result when the content of both images did not change
       
   Returns:
       dice_summary_dict:
      
   """
   
-  bash_command = list()
-  bash_command += ["plastimatch", "dice", "--dice"]
-  bash_command += [path_to_reference_img, path_to_test_img]
+  if cache:
+    return _with_result_cache(cache, "dice", backend, [path_to_reference_img, path_to_test_img], verbose,
+                              lambda: dice(path_to_reference_img, path_to_test_img, verbose, backend))
+  
+  if backend == "native":
+    # imported here so that the CLI wrappers do not need the numerical stack
+    from .utils.metrics import native_dice
+
+    if verbose: print("\nComputing DC between the two images (native backend)")
+    dice_summary_dict = native_dice(path_to_reference_img, path_to_test_img)
+    if verbose: print("... Done.")
+
+    return dice_summary_dict
+  
+  elif backend != "cli":
+    raise ValueError("Unknown backend '%s' (expected 'cli' or 'native')."%(backend))
+  
+  bash_command = get_bash_command("dice", "--dice", path_to_reference_img, path_to_test_img)
   
   if verbose: print("\nComputing DC between the two images with 'plastimatch dice --dice'")
   
-  try:
-    dice_summary = subprocess.run(bash_command, capture_output = True, check = True)
-    if verbose: print("... Done.")
-  except Exception as e: 
-    # if the process exits with a non-zero exit code, a CalledProcessError exception will be raised
-    # attributes of that exception hold the arguments, the exit code, and stdout and stderr if they were captured
-    # For details, see: https://docs.python.org/3/library/subprocess.html#subprocess.run
-    
-    # FIXME: return exception?
-    print(e)
+  # if the process exits with a non-zero exit code, a CalledProcessError exception is raised
+  # (there would be no output to parse)
+  dice_summary = run_plastimatch_command(bash_command)
+  dice_summary.check_returncode()
+  
+  if verbose: print("... Done.")
      
-  dice_summary = dice_summary.stdout.decode().splitlines()
+  return _parse_dice_output(dice_summary.stdout)
+
+## ----------------------------------------
+
+def _parse_dice_output(dice_output):
+  """
+  Parse the output of 'plastimatch dice --dice' into a dictionary.
+  """
+
+  dice_summary = dice_output.splitlines()
   
   dice_summary_dict = dict()
   dice_summary_dict["com"] = dict()
@@ -186,7 +768,7 @@ def dice(path_to_reference_img, path_to_test_img, verbose = True):
 ## ----------------------------------------
 
 
-def hd(path_to_reference_img, path_to_test_img, verbose = True):
+def hd(path_to_reference_img, path_to_test_img, verbose = True, backend = "cli", cache = None):
   """
   Compute Hausdorff Distance for binary label images.
   
@@ -197,27 +779,51 @@ def hd(path_to_reference_img, path_to_test_img, verbose = True):
       path_to_reference_img:
       path_to_test_img:
       return_bash_command: return the executed command together with the exit status
+      backend: "cli" to run 'plastimatch dice', "native" to compute the metrics in-process
+               with distance transforms (see `utils.metrics.native_hd`)
+      cache: if set (a `utils.cache.ResultCache`, a cache directory, or True for the default cache),
+             return the cached result when the content of both images did not change
      
   """
   
-  bash_command = list()
-  bash_command += ["plastimatch", "dice", "--hausdorff"]
-  bash_command += [path_to_reference_img, path_to_test_img]
+  if cache:
+    return _with_result_cache(cache, "hd", backend, [path_to_reference_img, path_to_test_img], verbose,
+                              lambda: hd(path_to_reference_img, path_to_test_img, verbose, backend))
+  
+  if backend == "native":
+    # imported here so that the CLI wrappers do not need the numerical stack
+    from .utils.metrics import native_hd
+
+    if verbose: print("\nComputing the HD between the two images (native backend)")
+    hausdorff_summary_dict = native_hd(path_to_reference_img, path_to_test_img)
+    if verbose: print("... Done.")
+
+    return hausdorff_summary_dict
+  
+  elif backend != "cli":
+    raise ValueError("Unknown backend '%s' (expected 'cli' or 'native')."%(backend))
+  
+  bash_command = get_bash_command("dice", "--hausdorff", path_to_reference_img, path_to_test_img)
   
   if verbose: print("\nComputing the HD between the two images with 'plastimatch dice --hausdorff'")
   
-  try:
-    hausdorff_summary = subprocess.run(bash_command, capture_output = True, check = True)
-    if verbose: print("... Done.")
-  except Exception as e: 
-    # if the process exits with a non-zero exit code, a CalledProcessError exception will be raised
-    # attributes of that exception hold the arguments, the exit code, and stdout and stderr if they were captured
-    # For details, see: https://docs.python.org/3/library/subprocess.html#subprocess.run
-    
-    # FIXME: return exception?
-    print(e)
+  # if the process exits with a non-zero exit code, a CalledProcessError exception is raised
+  # (there would be no output to parse)
+  hausdorff_summary = run_plastimatch_command(bash_command)
+  hausdorff_summary.check_returncode()
   
-  hausdorff_summary = hausdorff_summary.stdout.decode().splitlines()
+  if verbose: print("... Done.")
+  
+  return _parse_hd_output(hausdorff_summary.stdout)
+
+## ----------------------------------------
+
+def _parse_hd_output(hausdorff_output):
+  """
+  Parse the output of 'plastimatch dice --hausdorff' into a dictionary.
+  """
+
+  hausdorff_summary = hausdorff_output.splitlines()
   
   hausdorff_summary_dict = dict()
 
@@ -231,7 +837,8 @@ def hd(path_to_reference_img, path_to_test_img, verbose = True):
 
 ## ----------------------------------------
 
-def compare(path_to_reference_img, path_to_test_img, verbose = True) -> Dict[str, float]:
+def compare(path_to_reference_img, path_to_test_img, verbose = True, backend = "cli",
+            cache = None) -> Dict[str, float]:
   """
   The compare command compares two files by subtracting one file from the other, and reporting statistics of the difference image. 
   The two input files must have the same geometry (origin, dimensions, and voxel spacing). The command line usage is given as follows:
@@ -242,6 +849,10 @@ def compare(path_to_reference_img, path_to_test_img, verbose = True) -> Dict[str
   Args:
       path_to_reference_img:
       path_to_test_img:
+      backend: "cli" to run 'plastimatch compare', "native" to compute the statistics in-process,
+               streaming both volumes in slabs (see `utils.metrics.native_compare`)
+      cache: if set (a `utils.cache.ResultCache`, a cache directory, or True for the default cache),
+             return the cached result when the content of both images did not change
       
   Returns:
       dictionary:
@@ -255,24 +866,46 @@ def compare(path_to_reference_img, path_to_test_img, verbose = True) -> Dict[str
      
   """
   
+  if cache:
+    return _with_result_cache(cache, "compare", backend, [path_to_reference_img, path_to_test_img], verbose,
+                              lambda: compare(path_to_reference_img, path_to_test_img, verbose, backend))
+  
+  if backend == "native":
+    # imported here so that the CLI wrappers do not need the numerical stack
+    from .utils.metrics import native_compare
+
+    if verbose: print("\n Comparing two images (native backend)")
+    compare_dict = native_compare(path_to_reference_img, path_to_test_img)
+    if verbose: print("... Done.")
+
+    return compare_dict
+  
+  elif backend != "cli":
+    raise ValueError("Unknown backend '%s' (expected 'cli' or 'native')."%(backend))
+  
   # print
   if verbose: 
     print("\n Comparing two images with 'plastimatch compare'")
 
   # build command
-  bash_command = []
-  bash_command += ["plastimatch", "compare"]
-  bash_command += [path_to_reference_img, path_to_test_img]
+  bash_command = get_bash_command("compare", path_to_reference_img, path_to_test_img)
   
   # run command
-  dice_summary = subprocess.run(bash_command, capture_output = True, check = True)
+  compare_summary = run_plastimatch_command(bash_command)
+  compare_summary.check_returncode()
   
   # print
   if verbose: 
     print("... Done.")
 
-  # combine output
-  comparison_raw = dice_summary.stdout.decode('utf-8')
+  return _parse_compare_output(compare_summary.stdout)
+
+## ----------------------------------------
+
+def _parse_compare_output(comparison_raw) -> Dict[str, float]:
+  """
+  Parse the output of 'plastimatch compare' into a dictionary.
+  """
 
   # flaten output
   comparison_flat = " ".join(comparison_raw.splitlines()).split()
@@ -1,5 +1,53 @@
-from .data import *
-from .eval import *
-from .install import install_precompiled_binaries
-#from .widgets import *
+import importlib
 
+# the utility modules depend on heavy packages (numpy, pandas, SimpleITK, requests, ...):
+# they are only imported the first time one of their functions is accessed
+_LAZY_ATTRIBUTES = {
+  "save_binary_segmask" : "data",
+  "save_binary_segmasks" : "data",
+  "dc_dict_to_df" : "eval",
+  "hd_dict_to_df" : "eval",
+  "iter_cohort" : "eval",
+  "evaluate_cohort" : "eval",
+  "evaluate_candidates" : "eval",
+  "cohort_dict_to_long_df" : "eval",
+  "write_long_parquet" : "eval",
+  "convert_image" : "images",
+  "resample_image" : "images",
+  "sitk_resample" : "images",
+  "multilabel_dice" : "metrics",
+  "native_dice" : "metrics",
+  "native_hd" : "metrics",
+  "native_compare" : "metrics",
+  "memmap_volume" : "volume",
+  "open_volume" : "volume",
+  "lazy_volume" : "volume",
+  "SlabVolume" : "volume",
+  "PackedSegmasks" : "volume",
+  "decimate_volume" : "volume",
+  "install_precompiled_binaries" : "install",
+  "fetch_release_asset" : "install",
+  "native_convert" : "rtstruct",
+  "read_ct_geometry" : "rtstruct",
+}
+
+_LAZY_SUBMODULES = ["cache", "data", "eval", "images", "install", "manifest", "metrics", "rtstruct", "volume", "widgets"]
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+
+  if name in _LAZY_SUBMODULES:
+    return importlib.import_module("." + name, __name__)
+
+  if name in _LAZY_ATTRIBUTES:
+    module = importlib.import_module("." + _LAZY_ATTRIBUTES[name], __name__)
+    return getattr(module, name)
+
+  raise AttributeError("module %r has no attribute %r"%(__name__, name))
+
+
+def __dir__():
+
+  return sorted(list(globals()) + __all__ + _LAZY_SUBMODULES)
@@ -0,0 +1,249 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Persistent result cache
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import functools
+import contextlib
+import subprocess
+
+# version of the native (in-process) metrics, part of the key of the results they produce:
+# bump it every time a change in `utils.metrics` can alter the results
+NATIVE_METRICS_VERSION = "2"
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pyplastimatch")
+DEFAULT_MAX_SIZE = 64*2**20
+
+HASH_CHUNK_SIZE = 2**20
+
+## ----------------------------------------
+
+@functools.lru_cache(maxsize = None)
+def get_tool_version(backend = "cli"):
+
+    """
+    Get a string identifying the tool computing the results for the given backend
+    (i.e., the output of 'plastimatch --version' for the CLI backend).
+    """
+
+    if backend == "native":
+        return "native-%s"%(NATIVE_METRICS_VERSION)
+
+    try:
+        version = subprocess.run(["plastimatch", "--version"], capture_output = True, check = True)
+        return version.stdout.decode().strip()
+    except Exception:
+        return "unknown"
+
+## ----------------------------------------
+
+class ResultCache:
+
+    """
+    On-disk (SQLite) cache for the results of the evaluation wrappers.
+
+    Results are keyed on the content hash of the input files, the metric, and the version
+    of the tool computing them, so a cached result is only reused if none of these changed.
+    When the stored results exceed `max_size` bytes, the least recently used ones are evicted.
+
+    Args:
+        cache_dir: directory where the cache database is stored (defaults to the
+                   PYPLASTIMATCH_CACHE_DIR environment variable, or to ~/.cache/pyplastimatch)
+        max_size: maximum size of the stored results, in bytes
+    """
+
+    def __init__(self, cache_dir = None, max_size = DEFAULT_MAX_SIZE):
+
+        if cache_dir is None:
+            cache_dir = os.environ.get("PYPLASTIMATCH_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+        os.makedirs(cache_dir, exist_ok = True)
+
+        self.cache_dir = cache_dir
+        self.path_to_db = os.path.join(cache_dir, "results.sqlite")
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS results ("
+                         "key TEXT PRIMARY KEY, value TEXT, size INTEGER, last_access REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS file_hashes ("
+                         "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT)")
+
+
+    @contextlib.contextmanager
+    def _connect(self):
+
+        """
+        Open a new connection to the cache database (one per operation, so that the cache
+        can be shared by threads and processes), committing on success.
+        """
+
+        conn = sqlite3.connect(self.path_to_db, timeout = 60)
+
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+
+    def file_hash(self, path_to_file):
+
+        """
+        SHA-256 of the content of a file.
+
+        The hash is stored together with the size and modification time of the file,
+        so that unchanged files are not read again.
+        """
+
+        path_to_file = os.path.realpath(path_to_file)
+        file_stat = os.stat(path_to_file)
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT size, mtime_ns, sha256 FROM file_hashes WHERE path = ?",
+                               (path_to_file,)).fetchone()
+
+        if row is not None and row[0] == file_stat.st_size and row[1] == file_stat.st_mtime_ns:
+            return row[2]
+
+        sha256 = hashlib.sha256()
+        with open(path_to_file, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                sha256.update(chunk)
+
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)",
+                         (path_to_file, file_stat.st_size, file_stat.st_mtime_ns, sha256.hexdigest()))
+
+        return sha256.hexdigest()
+
+
+    def make_key(self, metric, backend, input_paths):
+
+        """
+        Build the cache key of the result of `metric`, computed with `backend` on the given input files.
+        """
+
+        key_dict = {"metric" : metric,
+                    "tool_version" : get_tool_version(backend),
+                    "inputs" : [self.file_hash(path) for path in input_paths]}
+
+        return hashlib.sha256(json.dumps(key_dict, sort_keys = True).encode()).hexdigest()
+
+
+    def get(self, key):
+
+        """
+        Return the cached result stored under `key`, or None if there is none.
+        """
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+
+        self.hits += 1
+
+        return json.loads(row[0])
+
+
+    def put(self, key, value):
+
+        """
+        Store a (JSON-serializable) result under `key`, evicting the least recently used
+        results if the cache grows beyond its maximum size.
+        """
+
+        value = json.dumps(value)
+
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                         (key, value, len(value), time.time()))
+
+            total_size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+            if total_size > self.max_size:
+                for old_key, size in conn.execute("SELECT key, size FROM results "
+                                                  "ORDER BY last_access ASC").fetchall():
+                    if total_size <= self.max_size:
+                        break
+
+                    conn.execute("DELETE FROM results WHERE key = ?", (old_key,))
+                    total_size -= size
+                    self.evictions += 1
+
+
+    def stats(self):
+
+        """
+        Hit/miss/eviction counters (for this cache object), and number and size of the stored results.
+        """
+
+        with self._connect() as conn:
+            num_entries, total_size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) "
+                                                   "FROM results").fetchone()
+
+        return {"hits" : self.hits,
+                "misses" : self.misses,
+                "evictions" : self.evictions,
+                "entries" : num_entries,
+                "size" : total_size}
+
+
+    def clear(self):
+
+        """
+        Remove every stored result (and file hash) from the cache.
+        """
+
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results")
+            conn.execute("DELETE FROM file_hashes")
+
+## ----------------------------------------
+
+_default_cache = None
+
+def get_result_cache(cache = True):
+
+    """
+    Resolve the `cache` argument of the evaluation wrappers to a ResultCache object.
+
+    Args:
+        cache: a ResultCache object, a path to the cache directory, or True to use the default cache
+    """
+
+    global _default_cache
+
+    if isinstance(cache, ResultCache):
+        return cache
+
+    if isinstance(cache, (str, os.PathLike)):
+        return ResultCache(cache_dir = cache)
+
+    if _default_cache is None:
+        _default_cache = ResultCache()
+
+    return _default_cache
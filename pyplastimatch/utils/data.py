@@ -14,24 +14,109 @@
 
 
 import os
+import functools
+import concurrent.futures
 import numpy as np
 import SimpleITK as sitk
 
+from .volume import read_image_information
 
-def save_binary_segmask(path_to_header_file, path_to_output, pred_binary_segmask):
+## ----------------------------------------
+
+@functools.lru_cache(maxsize = 256)
+def _read_geometry(path_to_header_file, mtime_ns, file_size):
+
+    """
+    Read the geometry (size, origin, spacing, direction) of an image from its header only.
+
+    Cached per path, modification time and size, so that a header is read once however many
+    masks are saved against it, but read again if the file changes.
+    """
+
+    reader = read_image_information(path_to_header_file)
+
+    return reader.GetSize(), reader.GetOrigin(), reader.GetSpacing(), reader.GetDirection()
+
+
+def get_geometry(path_to_header_file):
+
+    """
+    Get the (cached) geometry of an image, as a (size, origin, spacing, direction) tuple,
+    without reading its voxels.
+    """
+
+    path_to_header_file = os.path.realpath(path_to_header_file)
+    file_stat = os.stat(path_to_header_file)
+
+    return _read_geometry(path_to_header_file, file_stat.st_mtime_ns, file_stat.st_size)
+
+## ----------------------------------------
+
+def save_binary_segmask(path_to_header_file, path_to_output, pred_binary_segmask,
+                        compress = False, pixel_type = None):
     
     """
-    blabla
+    Save a binary segmask (stored as a numpy array) with the geometry of a reference image.
+
+    Only the header of the reference image is read (and cached, see `get_geometry`).
     
     Args:
         path_to_header_file: path to the NRRD file to be read with SITK in order to copy the 
                              header information from it
         path_to_output: location where to save the binary segmask (in one of the ITK supported formats)
         pred_binary_segmask: numpy array storing the binary segmask to save
+        compress: compress the output file (if supported by the format, e.g. NRRD, NIfTI, MHA)
+        pixel_type: numpy type the segmask is saved as (e.g., "uint8"). Defaults to the type of
+                    `pred_binary_segmask` (boolean segmasks are saved as uint8).
     """
     
-    sitk_copy_header = sitk.ReadImage(path_to_header_file)
+    size, origin, spacing, direction = get_geometry(path_to_header_file)
+
+    if pixel_type is None and pred_binary_segmask.dtype == bool:
+        pixel_type = np.uint8
+
+    if pixel_type is not None:
+        pred_binary_segmask = pred_binary_segmask.astype(pixel_type, copy = False)
     
     sitk_pred_binary = sitk.GetImageFromArray(pred_binary_segmask)
-    sitk_pred_binary.CopyInformation(sitk_copy_header)
-    sitk.WriteImage(sitk_pred_binary, path_to_output)
+
+    if sitk_pred_binary.GetSize() != size:
+        raise ValueError("The segmask size %s does not match the size of %s %s."%(sitk_pred_binary.GetSize(),
+                                                                                  path_to_header_file, size))
+
+    sitk_pred_binary.SetOrigin(origin)
+    sitk_pred_binary.SetSpacing(spacing)
+    sitk_pred_binary.SetDirection(direction)
+
+    sitk.WriteImage(sitk_pred_binary, path_to_output, compress)
+
+## ----------------------------------------
+
+def save_binary_segmasks(path_to_header_file, segmask_dict, compress = False, pixel_type = None, max_workers = None):
+
+    """
+    Save many binary segmasks (e.g., all the structures of a patient) with the geometry of the same
+    reference image in one call, reading the header of the reference image once and writing the
+    files in parallel.
+
+    Args:
+        path_to_header_file: path to the image to copy the header information from
+        segmask_dict: dictionary mapping the location where to save each segmask to the numpy array storing it,
+                      e.g. {"/path/to/heart.nrrd": heart_segmask, "/path/to/esophagus.nrrd": esophagus_segmask}
+        compress: compress the output files (see `save_binary_segmask`)
+        pixel_type: numpy type the segmasks are saved as (see `save_binary_segmask`)
+        max_workers: maximum number of files written at the same time (defaults to the number of CPUs)
+    """
+
+    # read the header before spawning the writers, so that they all hit the cache
+    get_geometry(path_to_header_file)
+
+    # SimpleITK releases the GIL while writing (and compressing), so threads are enough
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max_workers or os.cpu_count() or 1) as executor:
+        futures = [executor.submit(save_binary_segmask, path_to_header_file, path_to_output, segmask,
+                                   compress, pixel_type)
+                   for path_to_output, segmask in segmask_dict.items()]
+
+        # raise the first error (if any), after all the writes are done
+        for future in futures:
+            future.result()
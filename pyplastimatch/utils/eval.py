@@ -14,8 +14,24 @@
 
 import os
 import json
+import uuid
+import shutil
+import concurrent.futures
 import numpy as np
 import pandas as pd
+import SimpleITK as sitk
+
+from ..pyplastimatch import dice, hd
+from .metrics import _same_geometry, _multilabel_dice_from_arrays, _hd_from_masks, _compare_arrays
+from .volume import open_volume, read_image_information
+
+# metrics supported by the cohort evaluation driver
+# (names match the wrappers computing them, and the keys of the `evaluate_cohort` output)
+COHORT_METRICS = {"dice" : dice, "hd" : hd}
+
+# result reported for a pair whose evaluation failed (rendered as a row of NaNs by the `*_dict_to_df` functions)
+FAILED_METRIC_DICT = {"dice" : dict(),
+                      "hd" : {key : np.nan for key in ["hd", "hd95", "hd_boundaries", "hd95_boundaries"]}}
 
 def dc_dict_to_df(dc_dict, structure_name):
     
@@ -105,3 +121,421 @@ def hd_dict_to_df(hd_dict, structure_name):
   
 ## ----------------------------------------
 
+def _evaluate_pair(patient, structure, metric, path_to_reference_img, path_to_test_img, backend):
+
+    """
+    Compute a single metric for a single patient/structure pair (run in the worker processes).
+
+    A failure results in FAILED_METRIC_DICT, so that the `*_dict_to_df` functions
+    report the corresponding row as NaN instead of the whole cohort failing.
+    """
+
+    try:
+        metric_dict = COHORT_METRICS[metric](path_to_reference_img, path_to_test_img,
+                                             verbose = False, backend = backend)
+        error = None
+    except Exception as e:
+        metric_dict = dict(FAILED_METRIC_DICT[metric])
+        error = repr(e)
+
+    return patient, structure, metric, metric_dict, error
+
+## ----------------------------------------
+
+def iter_cohort(pairs, metrics = ("dice", "hd"), workers = None, backend = "cli"):
+
+    """
+    Evaluate a cohort, yielding the results of every patient/structure/metric as soon as they are ready.
+
+    Args:
+      pairs: dictionary storing the path to the reference and to the test binary masks
+        of every structure of every patient, formatted like the following:
+
+        {'LUNG1-002': {'heart': ('/path/to/ref/heart.nrrd', '/path/to/pred/heart.nrrd'),
+                       'esophagus': ('/path/to/ref/esophagus.nrrd', '/path/to/pred/esophagus.nrrd')},
+        ...
+        }
+
+      metrics: list of the metrics to compute (any of "dice", "hd")
+      workers: number of worker processes (defaults to the number of CPUs).
+               If 1, everything is computed serially in the calling process.
+      backend: backend used by `dice()` and `hd()` ("cli" or "native")
+
+    Yields:
+      (patient, structure, metric, metric_dict, error) tuples, in order of completion.
+      `error` is None on success, and a description of the exception otherwise.
+    """
+
+    for metric in metrics:
+        if metric not in COHORT_METRICS:
+            raise ValueError("Unknown metric '%s' (expected one of %s)."%(metric, sorted(COHORT_METRICS)))
+
+    tasks = [(patient, structure, metric, path_to_reference_img, path_to_test_img, backend)
+             for patient, structure_dict in pairs.items()
+             for structure, (path_to_reference_img, path_to_test_img) in structure_dict.items()
+             for metric in metrics]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers == 1:
+        for task in tasks:
+            yield _evaluate_pair(*task)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = [executor.submit(_evaluate_pair, *task) for task in tasks]
+
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+## ----------------------------------------
+
+def evaluate_cohort(pairs, metrics = ("dice", "hd"), workers = None, backend = "cli", verbose = True):
+
+    """
+    Evaluate every structure of every patient of a cohort, spreading the computation
+    over a pool of worker processes.
+
+    Args:
+      pairs: dictionary storing the path to the reference and to the test binary masks
+        of every structure of every patient (see `iter_cohort`)
+      metrics: list of the metrics to compute (any of "dice", "hd")
+      workers: number of worker processes (defaults to the number of CPUs)
+      backend: backend used by `dice()` and `hd()` ("cli" or "native")
+
+    Returns:
+      dictionary storing, for every metric, the results formatted like the eval script output
+      (i.e., ready to be passed to `dc_dict_to_df` and `hd_dict_to_df` respectively):
+
+        {'dice': {'LUNG1-002': {'heart': {'com': {...}, 'dc': 0.939273}, ...}, ...},
+         'hd': {'LUNG1-002': {'heart': {'hd': 8.999999, ...}, ...}, ...}}
+    """
+
+    # pre-populate the output so that the order of patients and structures follows `pairs`
+    # (and not the order in which the workers complete)
+    cohort_dict = {metric : {patient : {structure : dict() for structure in structure_dict}
+                             for patient, structure_dict in pairs.items()}
+                   for metric in metrics}
+
+    num_tasks = len(metrics)*sum(len(structure_dict) for structure_dict in pairs.values())
+
+    if verbose:
+        print("\nEvaluating %d patient/structure/metric combinations..."%(num_tasks))
+
+    results = iter_cohort(pairs, metrics, workers, backend)
+
+    for task_idx, (patient, structure, metric, metric_dict, error) in enumerate(results, 1):
+
+        cohort_dict[metric][patient][structure] = metric_dict
+
+        if verbose and error is not None:
+            print("  [%d/%d] %s - %s - %s failed: %s"%(task_idx, num_tasks, patient, structure, metric, error))
+
+    if verbose: print("... Done.")
+
+    return cohort_dict
+
+## ----------------------------------------
+
+# metrics supported by the one-reference-many-candidates driver (computed in-process)
+CANDIDATE_METRICS = ("dice", "hd", "compare")
+
+# reference volume the candidates are evaluated against, in the worker processes of `evaluate_candidates`
+# (attached to the shared memory block by `_init_candidate_worker`)
+_candidate_reference = dict()
+
+def _init_candidate_worker(shm_name, shape, dtype, path_to_reference_img, ref_arr = None):
+
+    """
+    Attach the worker process to the shared memory block storing the reference volume
+    (or, if `shm_name` is None, use the copy of the reference volume passed as `ref_arr`).
+    """
+
+    if shm_name is None:
+        _candidate_reference["array"] = ref_arr
+    else:
+        from multiprocessing import shared_memory
+
+        shm = shared_memory.SharedMemory(name = shm_name)
+
+        _candidate_reference["shm"] = shm
+        _candidate_reference["array"] = np.ndarray(shape, dtype = dtype, buffer = shm.buf)
+
+    _candidate_reference["info"] = read_image_information(path_to_reference_img)
+
+## ----------------------------------------
+
+def _evaluate_candidate(name, path_to_test_img, metrics, reference = None):
+
+    """
+    Compute the requested metrics between the reference volume and a single candidate
+    (run in the worker processes, the candidate being read only once).
+
+    Returns:
+      dictionary storing the row of the candidate, with an "error" entry describing
+      the metrics that failed (NaN in the row), or None if all of them succeeded.
+    """
+
+    if reference is None:
+        reference = _candidate_reference
+
+    ref_arr, ref_info = reference["array"], reference["info"]
+
+    row = dict()
+    errors = list()
+
+    try:
+        sitk_cmp = sitk.ReadImage(path_to_test_img)
+    except Exception as e:
+        row["error"] = "read: %r"%(e)
+        return name, row
+
+    for metric in metrics:
+        try:
+            if metric == "compare":
+                if not _same_geometry(ref_info, sitk_cmp):
+                    raise ValueError("The geometry of the candidate does not match the one of the reference.")
+                row.update(_compare_arrays(ref_arr, sitk.GetArrayViewFromImage(sitk_cmp)))
+                continue
+
+            # masks are resampled on the reference grid (nearest neighbour), as by the native backends
+            sitk_mask = sitk_cmp
+            if not _same_geometry(ref_info, sitk_cmp):
+                sitk_mask = sitk.Resample(sitk_cmp, ref_info.GetSize(), sitk.Transform(), sitk.sitkNearestNeighbor,
+                                          ref_info.GetOrigin(), ref_info.GetSpacing(), ref_info.GetDirection(),
+                                          0, sitk_cmp.GetPixelID())
+
+            # the binarized reference is computed once per process
+            if "mask" not in reference:
+                reference["mask"] = (ref_arr > 0).astype(np.uint8)
+
+            cmp_mask = (sitk.GetArrayViewFromImage(sitk_mask) > 0).astype(np.uint8)
+
+            if metric == "dice":
+                dc_dict = _multilabel_dice_from_arrays(reference["mask"], cmp_mask, ref_info, labels = [1])[1]
+                row["com_ref_x0"], row["com_ref_x1"], row["com_ref_x2"] = dc_dict["com"]["ref"]
+                row["com_cmp_x0"], row["com_cmp_x1"], row["com_cmp_x2"] = dc_dict["com"]["cmp"]
+                row["dc"] = dc_dict["dc"]
+            else:
+                row.update(_hd_from_masks(reference["mask"] > 0, cmp_mask > 0, ref_info.GetSpacing()))
+
+        except Exception as e:
+            errors.append("%s: %r"%(metric, e))
+
+    row["error"] = "; ".join(errors) if errors else None
+
+    return name, row
+
+## ----------------------------------------
+
+def evaluate_candidates(path_to_reference_img, candidates, metrics = ("dice", "hd"), workers = None, verbose = True):
+
+    """
+    Evaluate many candidates (e.g., the outputs of different models) against a single reference,
+    reading the reference only once.
+
+    The reference volume is kept in a shared memory block the worker processes attach to (so it is
+    neither re-read nor copied for every candidate; on Python 3.7, which lacks shared memory, it is
+    copied once to every worker process instead), and the metrics are computed in-process
+    (see `utils.metrics`): binary masks for "dice" and "hd" (every non-zero voxel is foreground,
+    candidates are resampled on the reference grid if needed), any image for "compare".
+
+    Args:
+      path_to_reference_img: path to the reference image (CT or binary mask)
+      candidates: list of paths to the candidate images, or dictionary mapping
+                  the name of each candidate to its path
+      metrics: list of the metrics to compute (any of "dice", "hd", "compare")
+      workers: number of worker processes (defaults to the number of CPUs).
+               If 1, everything is computed serially in the calling process.
+
+    Returns:
+      Dataframe with one row per candidate (indexed by its name, or by its path), storing the same
+      columns as `dc_dict_to_df` for "dice", the keys of the `hd()` and `compare()` outputs for
+      "hd" and "compare", and an "error" column describing the metrics that failed (missing, i.e. NaN, otherwise).
+    """
+
+    for metric in metrics:
+        if metric not in CANDIDATE_METRICS:
+            raise ValueError("Unknown metric '%s' (expected one of %s)."%(metric, list(CANDIDATE_METRICS)))
+
+    if not isinstance(candidates, dict):
+        candidates = {path_to_test_img : path_to_test_img for path_to_test_img in candidates}
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(candidates)))
+
+    if verbose:
+        print("\nEvaluating %d candidates against %s..."%(len(candidates), path_to_reference_img))
+
+    ref_arr = open_volume(path_to_reference_img)
+
+    rows = {name : dict() for name in candidates}
+
+    if workers == 1:
+        reference = {"array" : ref_arr, "info" : read_image_information(path_to_reference_img)}
+        for name, path_to_test_img in candidates.items():
+            rows[name] = _evaluate_candidate(name, path_to_test_img, metrics, reference)[1]
+
+    else:
+        try:
+            from multiprocessing import shared_memory
+        except ImportError:
+            # Python 3.7: the reference is pickled once per worker process, by the pool initializer
+            shared_memory = None
+
+        shm = None
+
+        try:
+            if shared_memory is not None:
+                shm = shared_memory.SharedMemory(create = True, size = max(1, ref_arr.nbytes))
+
+                shared_arr = np.ndarray(ref_arr.shape, dtype = ref_arr.dtype, buffer = shm.buf)
+                shared_arr[...] = ref_arr
+                del shared_arr
+
+                initargs = (shm.name, ref_arr.shape, ref_arr.dtype.str, path_to_reference_img)
+            else:
+                initargs = (None, ref_arr.shape, ref_arr.dtype.str, path_to_reference_img, np.asarray(ref_arr))
+
+            with concurrent.futures.ProcessPoolExecutor(max_workers = workers, initializer = _init_candidate_worker,
+                                                        initargs = initargs) as executor:
+                futures = [executor.submit(_evaluate_candidate, name, path_to_test_img, metrics)
+                           for name, path_to_test_img in candidates.items()]
+
+                for future in concurrent.futures.as_completed(futures):
+                    name, row = future.result()
+                    rows[name] = row
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+    if verbose:
+        for name, row in rows.items():
+            if row["error"] is not None:
+                print("  %s failed: %s"%(name, row["error"]))
+        print("... Done.")
+
+    return pd.DataFrame.from_dict(rows, orient = "index")
+
+## ----------------------------------------
+
+# names of the values reported for a pair whose results dictionary is empty (i.e., whose evaluation failed),
+# so that failures show up as NaN rows in the long-format table
+LONG_FORMAT_KEYS = {"dice" : ["com_ref_x0", "com_ref_x1", "com_ref_x2", "com_cmp_x0", "com_cmp_x1", "com_cmp_x2", "dc"],
+                    "hd" : ["hd", "hd95", "hd_boundaries", "hd95_boundaries"]}
+
+def _flatten_metric_dict(metric_dict, prefix = ""):
+
+    """
+    Flatten a results dictionary into (name, value) pairs, naming nested values after their keys
+    and list elements after their index (e.g., {'com': {'ref': [x0, x1, x2]}} to 'com_ref_x0', ...),
+    as in the columns of `dc_dict_to_df`.
+    """
+
+    for key, val in metric_dict.items():
+        name = "%s_%s"%(prefix, key) if prefix else str(key)
+
+        if isinstance(val, dict):
+            yield from _flatten_metric_dict(val, name)
+        elif isinstance(val, (list, tuple)):
+            for idx, elem in enumerate(val):
+                yield "%s_x%d"%(name, idx), elem
+        else:
+            yield name, val
+
+## ----------------------------------------
+
+def cohort_dict_to_long_df(cohort_dict):
+
+    """
+    Flatten the results of a whole cohort (all metrics, patients and structures) into a single
+    long-format Dataframe, with one (patient, structure, metric, value) row per value.
+
+    Args:
+      cohort_dict: dictionary formatted like the output of `evaluate_cohort`, i.e. storing
+        the eval script output of every metric (to convert a single one, e.g. a Dice Coefficient
+        results dictionary `dc_dict`, pass {'dice': dc_dict}):
+
+        {'dice': {'LUNG1-002': {'heart': {'com': {...}, 'dc': 0.939273}, ...}, ...},
+         'hd': {'LUNG1-002': {'heart': {'hd': 8.999999, ...}, ...}, ...}}
+
+    Returns:
+      Dataframe with the columns "patient", "structure", "metric" (categorical) and "value" (float).
+      Metrics are named like the columns of `dc_dict_to_df` and `hd_dict_to_df` (e.g., "dc",
+      "com_ref_x0", "hd95"). Failed evaluations (empty results dictionaries) are reported as NaN values.
+    """
+
+    # a single pass over the nested dictionary, building the (integer coded) columns directly
+    patient_codes, structure_codes, metric_codes = dict(), dict(), dict()
+    patient_idx, structure_idx, num_values = list(), list(), list()
+    metric_idx, values = list(), list()
+
+    for metric_group, metric_group_dict in cohort_dict.items():
+        failed_keys = LONG_FORMAT_KEYS.get(metric_group, [])
+
+        for patient, structure_dict in metric_group_dict.items():
+            patient_code = patient_codes.setdefault(patient, len(patient_codes))
+
+            for structure, metric_dict in structure_dict.items():
+                pairs = list(_flatten_metric_dict(metric_dict)) if metric_dict else \
+                        [(key, np.nan) for key in failed_keys]
+
+                patient_idx.append(patient_code)
+                structure_idx.append(structure_codes.setdefault(structure, len(structure_codes)))
+                num_values.append(len(pairs))
+
+                for name, val in pairs:
+                    metric_idx.append(metric_codes.setdefault(name, len(metric_codes)))
+                    values.append(val)
+
+    def _categorical(codes, categories):
+        return pd.Categorical.from_codes(np.asarray(codes, dtype = np.int64), categories = list(categories))
+
+    return pd.DataFrame({"patient" : _categorical(np.repeat(patient_idx, num_values), patient_codes),
+                         "structure" : _categorical(np.repeat(structure_idx, num_values), structure_codes),
+                         "metric" : _categorical(metric_idx, metric_codes),
+                         "value" : np.array(values, dtype = np.float64)})
+
+## ----------------------------------------
+
+def write_long_parquet(long_df, path_to_dataset, partition_cols = ("structure",), overwrite = False):
+
+    """
+    Write (or append) a long-format results table to a Parquet dataset partitioned by structure
+    (i.e., stored as "<path_to_dataset>/structure=<name>/part-<uuid>-<n>.parquet"), so that readers
+    only load the partitions they need, e.g.:
+
+        pd.read_parquet(path_to_dataset, filters = [("structure", "in", ["heart", "esophagus"])])
+
+    Requires pyarrow.
+
+    Args:
+      long_df: Dataframe formatted like the output of `cohort_dict_to_long_df`
+               (any additional column, e.g. a "run" identifier, is written as well)
+      path_to_dataset: path to the root directory of the dataset
+      partition_cols: columns the dataset is partitioned by
+      overwrite: remove the existing dataset first, instead of appending to it
+    """
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Writing Parquet datasets requires pyarrow (pip install pyarrow).")
+
+    if overwrite and os.path.isdir(path_to_dataset):
+        shutil.rmtree(path_to_dataset)
+
+    # partition values are stored in the directory names: write them as plain strings
+    long_df = long_df.astype({col : str for col in partition_cols})
+
+    table = pa.Table.from_pandas(long_df, preserve_index = False)
+
+    # a unique file name per write, so that appending never replaces the files of a previous write
+    pq.write_to_dataset(table, root_path = path_to_dataset, partition_cols = list(partition_cols),
+                        basename_template = "part-%s-{i}.parquet"%(uuid.uuid4().hex),
+                        existing_data_behavior = "overwrite_or_ignore")
+
@@ -0,0 +1,326 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    In-memory (SimpleITK/NumPy) wrappers
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import tempfile
+import contextlib
+import numpy as np
+import SimpleITK as sitk
+
+from ..pyplastimatch import get_bash_command, run_plastimatch_command
+
+# RAM-backed filesystem used to stage the images exchanged with plastimatch (when available)
+TMPFS_DIR = "/dev/shm"
+
+# uncompressed, single file format: cheap to write and to read, and supported by plastimatch
+STAGING_EXTENSION = ".mha"
+
+# 'plastimatch resample' options the SimpleITK backend of `resample()` can translate
+SITK_RESAMPLE_OPTIONS = ["input", "output", "fixed", "spacing", "dim", "origin", "direction",
+                         "interpolation", "default-value", "output-type"]
+
+# extensions of the outputs `sitk_resample` compresses unless told otherwise
+# (plastimatch writes gzip-encoded NRRD files; MetaImage files, e.g., are written uncompressed)
+COMPRESSED_EXTENSIONS = (".nrrd", ".nii.gz")
+
+SITK_INTERPOLATORS = {"nn" : sitk.sitkNearestNeighbor, "linear" : sitk.sitkLinear}
+
+# values of the plastimatch "--output-type" option
+SITK_PIXEL_TYPES = {"char" : sitk.sitkInt8, "uchar" : sitk.sitkUInt8,
+                    "short" : sitk.sitkInt16, "ushort" : sitk.sitkUInt16,
+                    "int" : sitk.sitkInt32, "uint" : sitk.sitkUInt32,
+                    "long" : sitk.sitkInt32, "ulong" : sitk.sitkUInt32,
+                    "float" : sitk.sitkFloat32, "double" : sitk.sitkFloat64}
+
+## ----------------------------------------
+
+def get_scratch_dir():
+
+    """
+    Directory the in-memory wrappers stage their files in: the PYPLASTIMATCH_SCRATCH_DIR
+    environment variable if set, otherwise /dev/shm (tmpfs) if writable, otherwise the default
+    temporary directory.
+    """
+
+    scratch_dir = os.environ.get("PYPLASTIMATCH_SCRATCH_DIR")
+
+    if scratch_dir:
+        return scratch_dir
+
+    if os.path.isdir(TMPFS_DIR) and os.access(TMPFS_DIR, os.W_OK | os.X_OK):
+        return TMPFS_DIR
+
+    return tempfile.gettempdir()
+
+## ----------------------------------------
+
+@contextlib.contextmanager
+def scratch_directory():
+
+    """
+    Create a private staging directory in the scratch area, removed (with its content) on exit.
+    """
+
+    with tempfile.TemporaryDirectory(prefix = "pyplastimatch_", dir = get_scratch_dir()) as path_to_dir:
+        yield path_to_dir
+
+## ----------------------------------------
+
+def to_sitk_image(image, spacing = None, origin = None, direction = None):
+
+    """
+    Get a SimpleITK image from a SimpleITK image or from a NumPy array (in numpy (z, y, x) order)
+    and its geometry.
+
+    Args:
+      image: sitk.Image or numpy.ndarray
+      spacing, origin, direction: geometry of the image (x, y, z order, as in SimpleITK).
+                                  If `image` is a sitk.Image, the ones provided override its own.
+    """
+
+    if isinstance(image, np.ndarray):
+        image = sitk.GetImageFromArray(image)
+    elif not isinstance(image, sitk.Image):
+        raise TypeError("Expected a SimpleITK image or a NumPy array (got %s)."%(type(image).__name__))
+    elif spacing is not None or origin is not None or direction is not None:
+        # do not alter the image of the caller
+        image = sitk.Image(image)
+
+    if spacing is not None:
+        image.SetSpacing([float(s) for s in spacing])
+    if origin is not None:
+        image.SetOrigin([float(o) for o in origin])
+    if direction is not None:
+        image.SetDirection([float(d) for d in np.ravel(direction)])
+
+    return image
+
+## ----------------------------------------
+
+def _run_in_memory(command, output_key, image, path_to_log_file, verbose, geometry, **kwargs):
+
+    """
+    Stage the input image (and any other image passed as argument, e.g. "fixed") in a scratch
+    directory, run the plastimatch command, and read its output back in memory.
+    """
+
+    with scratch_directory() as path_to_dir:
+
+        def _stage(name, img):
+            path_to_file = os.path.join(path_to_dir, name + STAGING_EXTENSION)
+            sitk.WriteImage(img, path_to_file, False)
+            return path_to_file
+
+        kwargs["input"] = _stage("input", to_sitk_image(image, **geometry))
+
+        for key, val in kwargs.items():
+            if isinstance(val, (sitk.Image, np.ndarray)):
+                kwargs[key] = _stage(key, to_sitk_image(val))
+
+        path_to_output = os.path.join(path_to_dir, "output" + STAGING_EXTENSION)
+        kwargs[output_key] = path_to_output
+
+        bash_command = get_bash_command(command, **kwargs)
+
+        if verbose: print("\nRunning '%s'"%(" ".join(bash_command)))
+
+        result = run_plastimatch_command(bash_command, path_to_log_file = path_to_log_file)
+        result.check_returncode()
+
+        # read in memory before the scratch directory is removed
+        output_image = sitk.ReadImage(path_to_output)
+
+    if verbose: print("... Done.")
+
+    return output_image
+
+## ----------------------------------------
+
+def convert_image(image, input_spacing = None, input_origin = None, input_direction = None,
+                  return_array = False, path_to_log_file = None, verbose = False, **kwargs):
+
+    """
+    Run 'plastimatch convert' on an in-memory image, and return the converted image.
+
+    The images are exchanged with plastimatch through uncompressed files staged in a scratch
+    directory on tmpfs (see `get_scratch_dir`), removed as soon as the output is read back.
+    Unlike `pyplastimatch.convert`, failures are raised (CalledProcessError).
+
+    Args:
+      image: sitk.Image, or numpy.ndarray (in numpy (z, y, x) order) together with its geometry
+      input_spacing, input_origin, input_direction: geometry of `image` (see `to_sitk_image`)
+      return_array: return a NumPy array instead of a SimpleITK image
+      path_to_log_file: path to file where stdout and stderr from the processing should be logged
+
+      **kwargs: all the arguments parsable by 'plastimatch convert', except "input" and "output-img".
+                Images (sitk.Image or numpy.ndarray) can be passed in place of paths.
+
+    Returns:
+      the converted image (sitk.Image, or numpy.ndarray if `return_array` is set)
+    """
+
+    geometry = {"spacing" : input_spacing, "origin" : input_origin, "direction" : input_direction}
+
+    output_image = _run_in_memory("convert", "output-img", image, path_to_log_file, verbose, geometry, **kwargs)
+
+    return sitk.GetArrayFromImage(output_image) if return_array else output_image
+
+## ----------------------------------------
+
+def resample_image(image, input_spacing = None, input_origin = None, input_direction = None,
+                   return_array = False, path_to_log_file = None, verbose = False, **kwargs):
+
+    """
+    Run 'plastimatch resample' on an in-memory image, and return the resampled image.
+
+    See `convert_image` for details on how the images are exchanged with plastimatch.
+
+    Args:
+      image: sitk.Image, or numpy.ndarray (in numpy (z, y, x) order) together with its geometry
+      input_spacing, input_origin, input_direction: geometry of `image` (see `to_sitk_image`).
+                                                    The geometry of the output is set by the "spacing",
+                                                    "origin", "dim" (...) or "fixed" arguments below.
+      return_array: return a NumPy array instead of a SimpleITK image
+      path_to_log_file: path to file where stdout and stderr from the processing should be logged
+
+      **kwargs: all the arguments parsable by 'plastimatch resample', except "input" and "output".
+                Images (sitk.Image or numpy.ndarray) can be passed in place of paths (e.g., "fixed").
+
+    Returns:
+      the resampled image (sitk.Image, or numpy.ndarray if `return_array` is set)
+    """
+
+    geometry = {"spacing" : input_spacing, "origin" : input_origin, "direction" : input_direction}
+
+    output_image = _run_in_memory("resample", "output", image, path_to_log_file, verbose, geometry, **kwargs)
+
+    return sitk.GetArrayFromImage(output_image) if return_array else output_image
+
+## ----------------------------------------
+
+def get_sitk_resample_unsupported(resample_kwargs):
+
+    """
+    List the arguments of a 'plastimatch resample' call the SimpleITK backend can not reproduce
+    (an empty list means the call can be run with `sitk_resample`).
+    """
+
+    unsupported = [key for key in resample_kwargs if key not in SITK_RESAMPLE_OPTIONS]
+
+    if "input" not in resample_kwargs or not os.path.isfile(str(resample_kwargs["input"])):
+        # e.g., DICOM series
+        unsupported.append("input")
+    if "fixed" in resample_kwargs and not os.path.isfile(str(resample_kwargs["fixed"])):
+        # e.g., DICOM series
+        unsupported.append("fixed")
+    if "output" not in resample_kwargs:
+        unsupported.append("output")
+    if str(resample_kwargs.get("interpolation", "linear")) not in SITK_INTERPOLATORS:
+        unsupported.append("interpolation")
+    if "output-type" in resample_kwargs and str(resample_kwargs["output-type"]) not in SITK_PIXEL_TYPES:
+        unsupported.append("output-type")
+
+    return unsupported
+
+## ----------------------------------------
+
+def _parse_vector(value, length, cast = float):
+
+    """
+    Parse a plastimatch vector argument (e.g., "1 1 2.5", "1,1,2.5", or "2" for all the dimensions).
+    """
+
+    values = str(value).replace(",", " ").split()
+
+    if len(values) == 1:
+        values = values*length
+
+    if len(values) != length:
+        raise ValueError("Expected %d values, got '%s'."%(length, value))
+
+    return [cast(float(val)) for val in values]
+
+## ----------------------------------------
+
+def sitk_resample(compress = None, **kwargs):
+
+    """
+    In-process equivalent of 'plastimatch resample' for plain grid resampling, running a
+    (multi-threaded) SimpleITK ResampleImageFilter.
+
+    As for plastimatch, the output grid is the one of "fixed" (if given) or of the input,
+    overridden by "dim", "origin", "spacing" and "direction". If only the spacing changes,
+    the number of voxels is adapted so that the output covers the same extent as the input.
+
+    Args:
+      compress: compress the output file (if supported by the format). Defaults to compressing
+                the outputs whose extension is in COMPRESSED_EXTENSIONS only.
+      **kwargs: the arguments of the 'plastimatch resample' call, among SITK_RESAMPLE_OPTIONS
+                (see `get_sitk_resample_unsupported`)
+
+    Returns:
+      the resampled image (also written to "output")
+    """
+
+    unsupported = get_sitk_resample_unsupported(kwargs)
+    if unsupported:
+        raise ValueError("Options not supported by the SimpleITK backend: %s."%(", ".join(unsupported)))
+
+    # imported here so that the module does not depend on the volume I/O code unless needed
+    from .volume import read_image_information
+
+    input_image = sitk.ReadImage(str(kwargs["input"]))
+    num_dims = input_image.GetDimension()
+
+    geometry = read_image_information(str(kwargs["fixed"])) if "fixed" in kwargs else input_image
+
+    size = list(geometry.GetSize())
+    spacing = list(geometry.GetSpacing())
+    origin = list(geometry.GetOrigin())
+    direction = list(geometry.GetDirection())
+
+    if "spacing" in kwargs:
+        new_spacing = _parse_vector(kwargs["spacing"], num_dims)
+        if "dim" not in kwargs and "fixed" not in kwargs:
+            size = [max(1, int(round(n*s/ns))) for n, s, ns in zip(size, spacing, new_spacing)]
+        spacing = new_spacing
+
+    if "dim" in kwargs:
+        size = _parse_vector(kwargs["dim"], num_dims, int)
+    if "origin" in kwargs:
+        origin = _parse_vector(kwargs["origin"], num_dims)
+    if "direction" in kwargs:
+        direction = _parse_vector(kwargs["direction"], num_dims*num_dims)
+
+    output_type = kwargs.get("output-type")
+
+    resampler = sitk.ResampleImageFilter()
+    resampler.SetSize(size)
+    resampler.SetOutputSpacing(spacing)
+    resampler.SetOutputOrigin(origin)
+    resampler.SetOutputDirection(direction)
+    resampler.SetInterpolator(SITK_INTERPOLATORS[str(kwargs.get("interpolation", "linear"))])
+    resampler.SetDefaultPixelValue(float(kwargs.get("default-value", 0)))
+    resampler.SetOutputPixelType(SITK_PIXEL_TYPES[str(output_type)] if output_type else input_image.GetPixelID())
+    resampler.SetNumberOfThreads(os.cpu_count() or 1)
+
+    output_image = resampler.Execute(input_image)
+
+    if compress is None:
+        compress = str(kwargs["output"]).lower().endswith(COMPRESSED_EXTENSIONS)
+
+    sitk.WriteImage(output_image, str(kwargs["output"]), compress)
+
+    return output_image
+
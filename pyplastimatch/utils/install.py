@@ -17,12 +17,27 @@ import sys
 import shutil
 
 import json
+import time
+import hashlib
 import requests
+import urllib.parse
 import urllib.request
 
 import subprocess
 
-import tempfile
+RELEASES_URL = "https://api.github.com/repos/AIM-Harvard/pyplastimatch/releases"
+
+# the assets of a release are downloaded from "<base URL>/<tag>/<asset name>"
+RELEASE_DOWNLOAD_URL = "https://github.com/AIM-Harvard/pyplastimatch/releases/download"
+
+DEFAULT_DOWNLOAD_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pyplastimatch", "downloads")
+
+DEPENDENCY_LIST = ["libinsighttoolkit4-dev", "libdcmtk16", "libdlib19", "libfftw3-dev"]
+
+DOWNLOAD_CHUNK_SIZE = 2**20
+
+# seconds after which the cached information on the latest release is fetched from GitHub again
+RELEASE_INFO_MAX_AGE = 24*60*60
 
 def get_distro_info():
   """
@@ -56,15 +71,18 @@ def get_distro_info():
 
 ## --------------------------------
 
-def move_binaries(binaries_path: str, verbose: bool) -> None:
+def move_binaries(binaries_path: str, verbose: bool, install_path: str = "/usr/local/bin/plastimatch") -> None:
+
+  # copy the binaries to the right folder (unless the very same binaries are already installed)
+  if os.path.isfile(install_path) and _file_sha256(install_path) == _file_sha256(binaries_path):
+    print("\nBinaries already installed at %s."%(install_path))
+  else:
+    print("\nInstalling binaries...", end="")
+    shutil.copy(binaries_path, install_path)
+    print(" Done.")
 
-  # copy the binaries to the right folder
-  print("\nInstalling binaries...", end="")
-  shutil.copy(binaries_path, "/usr/local/bin/plastimatch")
-  
   # make the file executable
-  subprocess.run(["chmod", "+x", "/usr/local/bin/plastimatch"])
-  print(" Done.")
+  subprocess.run(["chmod", "+x", install_path])
 
   # install dependencies
   print("Installing dependencies...", end="")
@@ -74,8 +92,30 @@ def move_binaries(binaries_path: str, verbose: bool) -> None:
   
 ## --------------------------------
 
+def get_missing_dependencies() -> list:
+  """
+  List the packages of DEPENDENCY_LIST that are not installed yet (according to dpkg).
+  """
+
+  missing_list = list()
+
+  for package in DEPENDENCY_LIST:
+    dpkg_status = subprocess.run(["dpkg-query", "-W", "-f=${Status}", package], capture_output=True)
+    if b"install ok installed" not in dpkg_status.stdout:
+      missing_list.append(package)
+
+  return missing_list
+
+## --------------------------------
+
 def install_dependencies(verbose: bool) -> None:
 
+  # 'apt-get update' alone can take minutes: skip everything if the dependencies are already there
+  dependency_list = get_missing_dependencies()
+
+  if not dependency_list:
+    return
+
   apt_update = ["apt-get", "update"]
   
   if verbose:
@@ -88,7 +128,6 @@ def install_dependencies(verbose: bool) -> None:
       )
     
 
-  dependency_list = ["libinsighttoolkit4-dev", "libdcmtk16", "libdlib19", "libfftw3-dev"]
   apt_install = ["apt-get", "install", "-y"] + dependency_list
   
   if verbose:
@@ -102,13 +141,269 @@ def install_dependencies(verbose: bool) -> None:
 
 ## --------------------------------
 
-def install_precompiled_binaries(verbose: bool=False) -> None:
+def _file_sha256(path_to_file: str) -> str:
+
+  sha256 = hashlib.sha256()
+
+  with open(path_to_file, "rb") as f:
+    for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+      sha256.update(chunk)
+
+  return sha256.hexdigest()
+
+## --------------------------------
+
+def _is_url(location: str) -> bool:
+  return location.startswith(("http://", "https://"))
+
+## --------------------------------
+
+def _to_local_path(location: str) -> str:
+  """
+  Turn a "file://" URL into the local path it points to (other locations are returned unchanged).
+  """
+
+  if not location.startswith("file://"):
+    return location
+
+  return urllib.request.url2pathname(urllib.parse.urlparse(location).path)
+
+## --------------------------------
+
+def _download(url: str, path_to_file: str, verbose: bool = False) -> None:
+  """
+  Download a file, resuming a previous partial download (stored as "<path_to_file>.part")
+  with an HTTP range request if the server supports it.
+  """
+
+  path_to_part = path_to_file + ".part"
+  resume_from = os.path.getsize(path_to_part) if os.path.isfile(path_to_part) else 0
+
+  headers = {"Range" : "bytes=%d-"%(resume_from)} if resume_from else dict()
+
+  with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+    if resume_from and response.status_code == 416:
+      # nothing left to download
+      os.replace(path_to_part, path_to_file)
+      return
+
+    response.raise_for_status()
+
+    # the server may ignore the range request, and send the whole file
+    mode = "ab" if resume_from and response.status_code == 206 else "wb"
+
+    if verbose and mode == "ab":
+      print(" (resuming from byte %d)"%(resume_from), end="")
+
+    with open(path_to_part, mode) as f:
+      for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+        f.write(chunk)
+
+  os.replace(path_to_part, path_to_file)
+
+## --------------------------------
+
+def _read_text(location: str) -> str:
+  """
+  Read a (small) text file from a URL or a local path, returning None if it does not exist.
+  """
+
+  if _is_url(location):
+    response = requests.get(location, timeout=60)
+    return response.text if response.ok else None
+
+  if os.path.isfile(location):
+    with open(location, "r") as f:
+      return f.read()
+
+  return None
+
+## --------------------------------
+
+def get_download_cache_dir(cache_dir: str = None) -> str:
+  """
+  Directory where the downloaded release assets are cached: `cache_dir` if set, otherwise the
+  PYPLASTIMATCH_DOWNLOAD_CACHE environment variable, or ~/.cache/pyplastimatch/downloads.
+  """
+
+  return cache_dir or os.environ.get("PYPLASTIMATCH_DOWNLOAD_CACHE", DEFAULT_DOWNLOAD_CACHE_DIR)
+
+## --------------------------------
+
+def get_release_info(tag: str = None, cache_dir: str = None, refresh: bool = False,
+                     max_age: float = RELEASE_INFO_MAX_AGE) -> dict:
+  """
+  Get the tag and the assets (download URL, size, SHA-256 digest) of a PyPlastimatch release.
+
+  The information is cached, so that the GitHub releases API is only queried the first time,
+  if `refresh` is set, or (for the latest release, which can change) once the cached information
+  is older than `max_age`. If GitHub can not be reached, outdated information is used.
+
+  Args:
+      tag: tag of the release (defaults to the latest release)
+      cache_dir: download cache directory (see `get_download_cache_dir`)
+      refresh: query the GitHub releases API even if the information is cached
+      max_age: seconds after which the cached information on the latest release expires
+               (None: never, as for tagged releases)
+  """
+
+  cache_dir = get_download_cache_dir(cache_dir)
+  path_to_release_json = os.path.join(cache_dir, "release_%s.json"%(tag or "latest"))
+
+  is_cached = os.path.isfile(path_to_release_json)
+  is_expired = is_cached and tag is None and max_age is not None and \
+               time.time() - os.path.getmtime(path_to_release_json) > max_age
+
+  if is_cached and not refresh and not is_expired:
+    with open(path_to_release_json, "r") as f:
+      return json.load(f)
+
+  try:
+    releases_list = requests.get(RELEASES_URL, timeout=60).json()
+  except requests.RequestException:
+    if not is_expired:
+      raise
+
+    # offline: keep using the outdated information
+    with open(path_to_release_json, "r") as f:
+      return json.load(f)
+
+  if tag is None:
+    # a release tagged "latest" if there is one, otherwise the most recent one (listed first)
+    release_dict = next((release for release in releases_list if release["tag_name"] == "latest"),
+                        releases_list[0])
+  else:
+    release_dict = next(release for release in releases_list if release["tag_name"] == tag)
+
+  release_info = {"tag_name" : release_dict["tag_name"], "assets" : dict()}
+
+  for asset in release_dict["assets"]:
+    digest = asset.get("digest") or ""
+    release_info["assets"][asset["name"]] = {"url" : asset["browser_download_url"],
+                                             "size" : asset.get("size"),
+                                             "sha256" : digest[len("sha256:"):] if digest.startswith("sha256:") else None}
+
+  os.makedirs(cache_dir, exist_ok=True)
+  with open(path_to_release_json, "w") as f:
+    json.dump(release_info, f, indent=2)
+
+  return release_info
+
+## --------------------------------
+
+def fetch_release_asset(asset_name: str, tag: str = None, mirror: str = None,
+                        cache_dir: str = None, refresh: bool = False, verbose: bool = False) -> str:
+  """
+  Get a release asset, downloading it only if it is not in the download cache already.
+
+  Assets are cached under "<cache_dir>/<tag>/<asset_name>", together with their SHA-256, which
+  is checked against the digest published with the release (or against a "<asset_name>.sha256"
+  file next to the asset) when downloading, and against the cached file when reusing it.
+
+  Args:
+      asset_name: name of the asset (e.g., "release_meta.json")
+      tag: tag of the release (defaults to the latest release, which requires querying GitHub
+           unless it was cached before)
+      mirror: local directory (or "file://" URL) or base URL the assets are fetched from, laid out
+              like the GitHub release downloads (i.e., "<mirror>/<tag>/<asset_name>"). Defaults to the
+              PYPLASTIMATCH_MIRROR environment variable, or to GitHub.
+      cache_dir: download cache directory (see `get_download_cache_dir`)
+      refresh: download the asset even if it is cached
+
+  Returns:
+      path to the cached asset
+  """
+
+  cache_dir = get_download_cache_dir(cache_dir)
+  mirror = mirror or os.environ.get("PYPLASTIMATCH_MIRROR")
+
+  if mirror is not None:
+    mirror = _to_local_path(mirror)
+
+  asset_info = dict()
+
+  if mirror is None or tag is None:
+    if mirror is not None and not os.path.isfile(os.path.join(cache_dir, "release_latest.json")):
+      raise ValueError("A release tag must be specified to fetch assets from a mirror.")
+
+    # with a mirror, GitHub may not be reachable: the cached information never expires
+    release_info = get_release_info(tag, cache_dir, refresh=refresh and mirror is None,
+                                    max_age=RELEASE_INFO_MAX_AGE if mirror is None else None)
+    tag = release_info["tag_name"]
+    asset_info = release_info["assets"].get(asset_name, dict())
+
+    if mirror is None and not asset_info:
+      raise FileNotFoundError("No asset named '%s' in the release '%s'."%(asset_name, tag))
+
+  if mirror is None:
+    source = asset_info["url"]
+  elif _is_url(mirror):
+    source = "%s/%s/%s"%(mirror.rstrip("/"), tag, asset_name)
+  else:
+    source = os.path.join(mirror, tag, asset_name)
+
+  path_to_asset = os.path.join(cache_dir, tag, asset_name)
+  path_to_sha256 = path_to_asset + ".sha256"
+
+  expected_sha256 = asset_info.get("sha256")
+  if expected_sha256 is None and mirror is not None:
+    checksum_text = _read_text(source + ".sha256")
+    expected_sha256 = checksum_text.split()[0] if checksum_text else None
+
+  # reuse the cached asset if it is intact (and matches the published digest, if any)
+  if not refresh and os.path.isfile(path_to_asset) and os.path.isfile(path_to_sha256):
+    with open(path_to_sha256, "r") as f:
+      cached_sha256 = f.read().strip()
+
+    if expected_sha256 in (None, cached_sha256) and _file_sha256(path_to_asset) == cached_sha256:
+      if verbose: print("Using the cached %s (%s)."%(asset_name, path_to_asset))
+      return path_to_asset
+
+  os.makedirs(os.path.dirname(path_to_asset), exist_ok=True)
+
+  print("\nFetching %s from %s..."%(asset_name, source), end="")
+  sys.stdout.flush()
+
+  if _is_url(source):
+    _download(source, path_to_asset, verbose=verbose)
+  else:
+    shutil.copyfile(source, path_to_asset)
+
+  sha256 = _file_sha256(path_to_asset)
+
+  if expected_sha256 is not None and sha256 != expected_sha256:
+    os.remove(path_to_asset)
+    raise ValueError("Checksum mismatch for %s (expected %s, got %s)."%(asset_name, expected_sha256, sha256))
+
+  with open(path_to_sha256, "w") as f:
+    f.write(sha256 + "\n")
+
+  print(" Done.")
+
+  return path_to_asset
+
+## --------------------------------
+
+def install_precompiled_binaries(verbose: bool=False, tag: str = None, mirror: str = None, cache_dir: str = None,
+                                 refresh: bool = False, install_path: str = "/usr/local/bin/plastimatch") -> str:
   """
   Download the plastimatch binaries compiled for the specified distribution (if found).
   
   The information regarding the distribution is automatically parsed from "/etc/os-release"
   as a dictionary by the get_distro_info() function.
 
+  The release information and the binaries are kept in a persistent download cache (see
+  `fetch_release_asset`), so that a repeated install only copies the cached binaries, and
+  the dependencies are only installed via apt if they are missing.
+
+  Args:
+      tag: tag of the PyPlastimatch release to install the binaries from (defaults to the latest)
+      mirror: local directory or base URL to fetch the release assets from, for clusters without
+              access to GitHub (see `fetch_release_asset`)
+      cache_dir: download cache directory (see `get_download_cache_dir`)
+      refresh: query GitHub and download the assets again, even if they are cached
+      install_path: where the plastimatch executable is installed
+
   Returns:
       str: path to the downloaded binaries, and info on the download status
   """
@@ -124,38 +419,8 @@ def install_precompiled_binaries(verbose: bool=False) -> None:
   print("Rather, it is meant to be used in case a Plastimatch binary is not available for a specific distribution.")
   print("\nSystem distribution: %s %s"%(distro_name, distro_version_id))
 
-  releases_url = "https://api.github.com/repos/AIM-Harvard/pyplastimatch/releases"
-  releases_dict = requests.get(releases_url).json()
-
-  # request temp dir for the pull of the github release
-  # (the directory will be deleted at upon exit from the function)
-  temp_dir = tempfile.TemporaryDirectory()
-
-  # get the latest release
-  for release in releases_dict:
-    release["tag_name"] == "latest"
-    latest_release_dict = release
-
-  # get the list of files in the release
-  assets_list = latest_release_dict["assets"]
-
   # to check if the distribution is supported, check the release_meta.json file in the release
-  meta_asset_name = "release_meta.json"
-
-  # look for the release_meta.json file
-  for asset in assets_list:
-    if asset["name"] == meta_asset_name:
-      meta_asset = asset
-      break
-
-  # download the file
-  meta_browser_download_url = meta_asset["browser_download_url"]
-  path_to_meta_json = os.path.join(temp_dir.name, meta_asset_name)
-
-  print("\nDownloading meta JSON in the temp directory %s..."%path_to_meta_json, end="")
-  print(" Done.")
-  
-  urllib.request.urlretrieve(meta_browser_download_url, path_to_meta_json)
+  path_to_meta_json = fetch_release_asset("release_meta.json", tag, mirror, cache_dir, refresh, verbose)
 
   with open(path_to_meta_json, "r") as f:
     build_release_dict = json.load(f)
@@ -172,9 +437,9 @@ def install_precompiled_binaries(verbose: bool=False) -> None:
       break
 
   if supported:
-    print("Matching distribution found in the latest PyPlastimatch release.")
+    print("Matching distribution found in the PyPlastimatch release.")
   else:
-    print("You system does not have a compiled binary in the latest PyPlastimatch release.")
+    print("You system does not have a compiled binary in the PyPlastimatch release.")
 
   # the asset name is always going to be formatted as "plastimatch-$OS_${MAJOR_VERSION}_${MINOR_VERSION}"
   distro_asset_name = "plastimatch-%s_%s_%s"%(
@@ -183,20 +448,8 @@ def install_precompiled_binaries(verbose: bool=False) -> None:
     distro_version_id.split(".")[1]
     )
 
-  for asset in assets_list:
-    if asset["name"] == distro_asset_name:
-      distro_asset = asset
-      break
-  
-  # download the asset
-  browser_download_url = distro_asset["browser_download_url"]
-  path_to_binaries = os.path.join(temp_dir.name, distro_asset_name)
-  
-  print("\nDownloading binary in the temp directory %s..."%path_to_binaries, end="")
-  print(" Done.")
-  
-  urllib.request.urlretrieve(browser_download_url, path_to_binaries)
+  path_to_binaries = fetch_release_asset(distro_asset_name, tag, mirror, cache_dir, refresh, verbose)
   
-  move_binaries(path_to_binaries, verbose=verbose)
+  move_binaries(path_to_binaries, verbose=verbose, install_path=install_path)
 
-  temp_dir.cleanup()
\ No newline at end of file
+  return path_to_binaries
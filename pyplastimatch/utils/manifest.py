@@ -0,0 +1,188 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Conversion manifest utility functions
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import json
+import hashlib
+
+HASH_CHUNK_SIZE = 2**20
+
+## ----------------------------------------
+
+def _list_files(path):
+
+    """
+    List the files found at `path` (the path itself if it is a file, all the files under it if it is a directory).
+    """
+
+    if os.path.isfile(path):
+        return [path]
+
+    file_list = list()
+
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file_name in sorted(files):
+            file_list.append(os.path.join(root, file_name))
+
+    return file_list
+
+## ----------------------------------------
+
+def _file_sha256(path_to_file):
+
+    sha256 = hashlib.sha256()
+
+    with open(path_to_file, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+## ----------------------------------------
+
+def _get_output_paths(convert_kwargs):
+
+    """
+    Paths of the outputs of a 'plastimatch convert' call (arguments such as "output-img", "output-prefix").
+    """
+
+    return [str(val) for key, val in convert_kwargs.items() if key.startswith("output")]
+
+## ----------------------------------------
+
+def get_manifest_path(convert_kwargs):
+
+    """
+    Path to the manifest of a 'plastimatch convert' call, stored as a hidden JSON file next to its
+    first output (e.g., "data/.image.nrrd.convert.json" for "output-img" = "data/image.nrrd").
+
+    Returns None if the call has no output to store the manifest next to.
+    """
+
+    output_paths = _get_output_paths(convert_kwargs)
+
+    if not output_paths:
+        return None
+
+    output_path = os.path.normpath(output_paths[0])
+
+    return os.path.join(os.path.dirname(output_path), ".%s.convert.json"%(os.path.basename(output_path)))
+
+## ----------------------------------------
+
+def get_input_identities(convert_kwargs, hash_inputs = False):
+
+    """
+    Identify every input file of a 'plastimatch convert' call by its size and modification time
+    (and, optionally, by the SHA-256 of its content).
+
+    Every argument not starting with "output" whose value is an existing file or directory
+    is considered an input (e.g., "input", "referenced-ct", "fixed").
+    """
+
+    input_identities = dict()
+
+    for key, val in convert_kwargs.items():
+        if key.startswith("output") or not isinstance(val, (str, os.PathLike)) or not os.path.exists(val):
+            continue
+
+        for path_to_file in _list_files(val):
+            file_stat = os.stat(path_to_file)
+
+            file_identity = {"size" : file_stat.st_size, "mtime_ns" : file_stat.st_mtime_ns}
+            if hash_inputs:
+                file_identity["sha256"] = _file_sha256(path_to_file)
+
+            input_identities[os.path.abspath(path_to_file)] = file_identity
+
+    return input_identities
+
+## ----------------------------------------
+
+def _serialize_kwargs(convert_kwargs):
+
+    return {key : [str(v) for v in val] if isinstance(val, list) else str(val)
+            for key, val in convert_kwargs.items()}
+
+## ----------------------------------------
+
+def write_manifest(convert_kwargs, hash_inputs = False):
+
+    """
+    Record the inputs, the arguments and the outputs of a successful 'plastimatch convert' call.
+
+    Returns:
+        path to the manifest (None if the call has no output)
+    """
+
+    path_to_manifest = get_manifest_path(convert_kwargs)
+
+    if path_to_manifest is None:
+        return None
+
+    output_files = list()
+    for output_path in _get_output_paths(convert_kwargs):
+        output_files += [os.path.abspath(path) for path in _list_files(output_path)]
+
+    manifest_dict = {"kwargs" : _serialize_kwargs(convert_kwargs),
+                     "inputs" : get_input_identities(convert_kwargs, hash_inputs),
+                     "outputs" : output_files}
+
+    with open(path_to_manifest, "w") as f:
+        json.dump(manifest_dict, f, indent = 2)
+
+    return path_to_manifest
+
+## ----------------------------------------
+
+def is_up_to_date(convert_kwargs, hash_inputs = False):
+
+    """
+    Check whether a 'plastimatch convert' call can be skipped, i.e., whether it was already run
+    with the same arguments on the same inputs, and all the outputs it produced still exist.
+    """
+
+    path_to_manifest = get_manifest_path(convert_kwargs)
+
+    if path_to_manifest is None or not os.path.isfile(path_to_manifest):
+        return False
+
+    try:
+        with open(path_to_manifest, "r") as f:
+            manifest_dict = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    if manifest_dict.get("kwargs") != _serialize_kwargs(convert_kwargs):
+        return False
+
+    output_files = manifest_dict.get("outputs", [])
+    if not output_files or not all(os.path.exists(path) for path in output_files):
+        return False
+
+    # only compare the hashes if they were recorded in the manifest (and requested now)
+    recorded_inputs = manifest_dict.get("inputs", {})
+    hash_inputs = hash_inputs and all("sha256" in identity for identity in recorded_inputs.values())
+
+    current_inputs = get_input_identities(convert_kwargs, hash_inputs)
+
+    # when hashing, a file that was touched but not modified is still considered unchanged
+    identity_keys = ["size", "sha256"] if hash_inputs else ["size", "mtime_ns"]
+
+    def _select(input_identities):
+        return {path : [identity.get(key) for key in identity_keys]
+                for path, identity in input_identities.items()}
+
+    return _select(current_inputs) == _select(recorded_inputs)
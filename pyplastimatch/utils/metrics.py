@@ -0,0 +1,464 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Native (in-process) evaluation metrics
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import numpy as np
+import SimpleITK as sitk
+
+# number of voxels processed at once when streaming through a volume
+SLAB_NUM_VOXELS = 2**22
+
+## ----------------------------------------
+
+def _same_geometry(sitk_img_a, sitk_img_b):
+
+    """
+    Check whether two SimpleITK images (or image readers, see `volume.read_image_information`)
+    share the same voxel grid.
+    """
+
+    return sitk_img_a.GetSize() == sitk_img_b.GetSize() and \
+           np.allclose(sitk_img_a.GetSpacing(), sitk_img_b.GetSpacing()) and \
+           np.allclose(sitk_img_a.GetOrigin(), sitk_img_b.GetOrigin()) and \
+           np.allclose(sitk_img_a.GetDirection(), sitk_img_b.GetDirection())
+
+## ----------------------------------------
+
+def _read_label_maps(path_to_reference_img, path_to_test_img):
+
+    """
+    Read the reference and the test label maps, resampling the latter on the grid of
+    the former (nearest neighbour) if the geometry of the two images does not match.
+    """
+
+    sitk_ref = sitk.ReadImage(path_to_reference_img)
+    sitk_cmp = sitk.ReadImage(path_to_test_img)
+
+    if not _same_geometry(sitk_ref, sitk_cmp):
+        sitk_cmp = sitk.Resample(sitk_cmp, sitk_ref, sitk.Transform(),
+                                 sitk.sitkNearestNeighbor, 0, sitk_cmp.GetPixelID())
+
+    return sitk_ref, sitk_cmp
+
+## ----------------------------------------
+
+def _index_to_physical(sitk_img, index_zyx):
+
+    """
+    Map (continuous) voxel indices stored as rows of a (N, 3) array in numpy (z, y, x) order
+    to physical coordinates (in mm, x/y/z order as reported by ITK and plastimatch).
+    """
+
+    origin = np.array(sitk_img.GetOrigin())
+    spacing = np.array(sitk_img.GetSpacing())
+    direction = np.array(sitk_img.GetDirection()).reshape(3, 3)
+
+    index_xyz = np.asarray(index_zyx)[:, ::-1]
+
+    return origin + (index_xyz * spacing) @ direction.T
+
+## ----------------------------------------
+
+def _label_confusion_and_com(ref_arr, cmp_arr, label_values):
+
+    """
+    Compute, in a single pass over the two label volumes, the label confusion matrix
+    and the voxel count and sum of voxel indices of every label in both volumes.
+
+    The volumes are processed in axial slabs so that the temporary arrays stay bounded,
+    while every slab is handled with a handful of vectorized np.bincount calls.
+
+    Args:
+        label_values: sorted array of the labels found in either volume. Labels are counted
+                      by their position in this array, so that sparse label values
+                      (e.g., 65535) do not blow up the size of the confusion matrix
+
+    Returns:
+        confusion: (n_labels, n_labels) array, confusion[i, j] = #voxels with
+                   ref == label_values[i] and cmp == label_values[j]
+        index_sum: dictionary with the (n_labels, 3) arrays storing the sum of the (z, y, x)
+                   indices of the voxels of each label, for the "ref" and the "cmp" volume
+    """
+
+    n_labels = len(label_values)
+
+    # no remapping needed when the labels are 0, 1, ..., n_labels - 1
+    remap = not np.array_equal(label_values, np.arange(n_labels))
+
+    nz, ny, nx = ref_arr.shape
+    slice_num_voxels = ny*nx
+    slab_num_slices = max(1, SLAB_NUM_VOXELS // slice_num_voxels)
+
+    # per-voxel y and x indices of a full slab (the last slab uses a prefix of these)
+    y_idx = np.tile(np.repeat(np.arange(ny, dtype = np.float64), nx), slab_num_slices)
+    x_idx = np.tile(np.arange(nx, dtype = np.float64), ny*slab_num_slices)
+
+    confusion = np.zeros(n_labels*n_labels, dtype = np.int64)
+    index_sum = {"ref" : np.zeros((n_labels, 3)), "cmp" : np.zeros((n_labels, 3))}
+
+    for z_start in range(0, nz, slab_num_slices):
+        z_end = min(z_start + slab_num_slices, nz)
+        slab_size = (z_end - z_start)*slice_num_voxels
+
+        z_idx = np.repeat(np.arange(z_start, z_end, dtype = np.float64), slice_num_voxels)
+
+        ref_slab = ref_arr[z_start:z_end].ravel().astype(np.int64)
+        cmp_slab = cmp_arr[z_start:z_end].ravel().astype(np.int64)
+
+        if remap:
+            ref_slab = np.searchsorted(label_values, ref_slab)
+            cmp_slab = np.searchsorted(label_values, cmp_slab)
+
+        confusion += np.bincount(ref_slab*n_labels + cmp_slab, minlength = n_labels*n_labels)
+
+        for key, slab in (("ref", ref_slab), ("cmp", cmp_slab)):
+            index_sum[key][:, 0] += np.bincount(slab, weights = z_idx, minlength = n_labels)
+            index_sum[key][:, 1] += np.bincount(slab, weights = y_idx[:slab_size], minlength = n_labels)
+            index_sum[key][:, 2] += np.bincount(slab, weights = x_idx[:slab_size], minlength = n_labels)
+
+    return confusion.reshape(n_labels, n_labels), index_sum
+
+## ----------------------------------------
+
+def _check_label_array(label_arr):
+
+    """
+    Make sure the label map can be used to index the confusion matrix.
+    """
+
+    if not np.issubdtype(label_arr.dtype, np.integer):
+        raise ValueError("Label maps must have an integer pixel type (found %s)."%(label_arr.dtype))
+
+    if label_arr.size and label_arr.min() < 0:
+        raise ValueError("Label maps cannot store negative labels.")
+
+## ----------------------------------------
+
+def _present_labels(label_arr):
+
+    """
+    Sorted array of the labels found in a label map.
+    """
+
+    if label_arr.dtype.itemsize <= 2:
+        # (u)int8/(u)int16 labels are counted directly, without sorting the volume
+        return np.flatnonzero(np.bincount(label_arr.ravel(), minlength = 1))
+
+    return np.unique(label_arr)
+
+## ----------------------------------------
+
+def multilabel_dice(path_to_reference_img, path_to_test_img, labels = None):
+
+    """
+    Compute Dice Coefficient and centre of mass for every label of two label maps,
+    reading each image only once.
+
+    Args:
+      path_to_reference_img: path to the reference label map (in one of the ITK supported formats)
+      path_to_test_img: path to the test label map. If its geometry does not match the one of
+                        the reference, it is resampled on the reference grid (nearest neighbour)
+      labels: list of the labels to evaluate (defaults to all the non-zero labels found in either image)
+
+    Returns:
+      dictionary mapping each label to a dictionary formatted like the output of `dice()`:
+
+        {1: {'com': {'ref': [35.0662, -47.6561, -34.145],
+                     'cmp': [35.0477, -49.1853, -34.787]},
+             'dc': 0.939273},
+         ...
+        }
+
+      The centre of mass of a label missing from an image, and the Dice Coefficient
+      of a label missing from both images, are NaN.
+    """
+
+    sitk_ref, sitk_cmp = _read_label_maps(path_to_reference_img, path_to_test_img)
+
+    ref_arr = sitk.GetArrayViewFromImage(sitk_ref)
+    cmp_arr = sitk.GetArrayViewFromImage(sitk_cmp)
+
+    return _multilabel_dice_from_arrays(ref_arr, cmp_arr, sitk_ref, labels)
+
+## ----------------------------------------
+
+def _multilabel_dice_from_arrays(ref_arr, cmp_arr, sitk_ref, labels = None):
+
+    """
+    Core of `multilabel_dice()`, working on label arrays sharing the grid of `sitk_ref`.
+    """
+
+    _check_label_array(ref_arr)
+    _check_label_array(cmp_arr)
+
+    label_values = np.union1d(_present_labels(ref_arr), _present_labels(cmp_arr)).astype(np.int64)
+    label_idx = {int(label) : idx for idx, label in enumerate(label_values)}
+
+    confusion, index_sum = _label_confusion_and_com(ref_arr, cmp_arr, label_values)
+
+    ref_count = confusion.sum(axis = 1)
+    cmp_count = confusion.sum(axis = 0)
+    overlap = np.diag(confusion)
+
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        dc = 2*overlap / (ref_count + cmp_count)
+        com = {key : _index_to_physical(sitk_ref, index_sum[key] / count[:, None])
+               for key, count in (("ref", ref_count), ("cmp", cmp_count))}
+
+    if labels is None:
+        labels = [int(label) for label in label_values if label != 0]
+
+    dice_dict = dict()
+
+    for label in labels:
+        label_dict = dict()
+
+        if label in label_idx:
+            idx = label_idx[label]
+            label_dict["com"] = {"ref" : com["ref"][idx].tolist(),
+                                 "cmp" : com["cmp"][idx].tolist()}
+            label_dict["dc"] = float(dc[idx])
+        else:
+            # label not present in any of the two images
+            label_dict["com"] = {"ref" : np.full([3], np.nan).tolist(),
+                                 "cmp" : np.full([3], np.nan).tolist()}
+            label_dict["dc"] = np.nan
+
+        dice_dict[label] = label_dict
+
+    return dice_dict
+
+## ----------------------------------------
+
+def native_dice(path_to_reference_img, path_to_test_img):
+
+    """
+    In-process equivalent of `plastimatch dice --dice` for binary label images
+    (every non-zero voxel is considered foreground).
+
+    Args:
+      path_to_reference_img: path to the reference binary mask
+      path_to_test_img: path to the test binary mask
+
+    Returns:
+      dictionary formatted like the output of `dice()`:
+        {'com': {'ref': [x, y, z], 'cmp': [x, y, z]}, 'dc': float}
+    """
+
+    sitk_ref, sitk_cmp = _read_label_maps(path_to_reference_img, path_to_test_img)
+
+    ref_arr = (sitk.GetArrayViewFromImage(sitk_ref) > 0).astype(np.uint8)
+    cmp_arr = (sitk.GetArrayViewFromImage(sitk_cmp) > 0).astype(np.uint8)
+
+    return _multilabel_dice_from_arrays(ref_arr, cmp_arr, sitk_ref, labels = [1])[1]
+
+## ----------------------------------------
+
+def _crop_to_union_bbox(ref_mask, cmp_mask):
+
+    """
+    Crop two binary masks to the bounding box of their union, padded with one voxel of
+    background on every side (so that voxels at the border of the box are boundary voxels).
+    """
+
+    union = ref_mask | cmp_mask
+
+    bbox = list()
+    for axis in range(union.ndim):
+        other_axes = tuple(ax for ax in range(union.ndim) if ax != axis)
+        nonzero_idx = np.flatnonzero(union.any(axis = other_axes))
+        bbox.append(slice(nonzero_idx[0], nonzero_idx[-1] + 1))
+
+    bbox = tuple(bbox)
+
+    return np.pad(ref_mask[bbox], 1), np.pad(cmp_mask[bbox], 1)
+
+## ----------------------------------------
+
+def _boundary(mask):
+
+    """
+    Boundary of a (zero-padded) binary mask: the foreground voxels having at least
+    one background voxel among their 6-connected neighbours.
+    """
+
+    eroded = np.zeros_like(mask)
+    eroded[1:-1, 1:-1, 1:-1] = mask[1:-1, 1:-1, 1:-1] & \
+                               mask[:-2, 1:-1, 1:-1] & mask[2:, 1:-1, 1:-1] & \
+                               mask[1:-1, :-2, 1:-1] & mask[1:-1, 2:, 1:-1] & \
+                               mask[1:-1, 1:-1, :-2] & mask[1:-1, 1:-1, 2:]
+
+    return mask & ~eroded
+
+## ----------------------------------------
+
+def _distance_to(mask, spacing):
+
+    """
+    Euclidean distance (in mm, respecting the voxel spacing) from every voxel
+    to the closest foreground voxel of `mask` (zero inside the mask).
+    """
+
+    sitk_mask = sitk.GetImageFromArray(mask.astype(np.uint8))
+    sitk_mask.SetSpacing(spacing)
+
+    sitk_dist = sitk.SignedMaurerDistanceMap(sitk_mask, insideIsPositive = False,
+                                             squaredDistance = False, useImageSpacing = True)
+
+    return np.clip(sitk.GetArrayFromImage(sitk_dist), 0, None)
+
+## ----------------------------------------
+
+def _hausdorff(ref_mask, cmp_mask, spacing, percentile = 95):
+
+    """
+    Maximum and percentile symmetric Hausdorff distance between two (cropped) binary masks.
+    """
+
+    dist_ab = _distance_to(cmp_mask, spacing)[ref_mask]
+    dist_ba = _distance_to(ref_mask, spacing)[cmp_mask]
+
+    hd = max(dist_ab.max(), dist_ba.max())
+    hd_pct = max(np.percentile(dist_ab, percentile), np.percentile(dist_ba, percentile))
+
+    return float(hd), float(hd_pct)
+
+## ----------------------------------------
+
+def native_hd(path_to_reference_img, path_to_test_img):
+
+    """
+    In-process equivalent of `plastimatch dice --hausdorff` for binary label images
+    (every non-zero voxel is considered foreground).
+
+    Distances are computed with Euclidean distance transforms that take the voxel spacing
+    into account, on the bounding box of the union of the two masks only.
+
+    Args:
+      path_to_reference_img: path to the reference binary mask
+      path_to_test_img: path to the test binary mask. If its geometry does not match the one of
+                        the reference, it is resampled on the reference grid (nearest neighbour)
+
+    Returns:
+      dictionary formatted like the output of `hd()` (all values in mm, NaN if a mask is empty):
+        hd                maximum Hausdorff distance between the two masks
+        hd95              95th percentile Hausdorff distance between the two masks
+        hd_boundaries     maximum Hausdorff distance between the boundaries of the two masks
+        hd95_boundaries   95th percentile Hausdorff distance between the boundaries of the two masks
+    """
+
+    sitk_ref, sitk_cmp = _read_label_maps(path_to_reference_img, path_to_test_img)
+
+    ref_mask = sitk.GetArrayViewFromImage(sitk_ref) > 0
+    cmp_mask = sitk.GetArrayViewFromImage(sitk_cmp) > 0
+
+    return _hd_from_masks(ref_mask, cmp_mask, sitk_ref.GetSpacing())
+
+## ----------------------------------------
+
+def _hd_from_masks(ref_mask, cmp_mask, spacing):
+
+    """
+    Core of `native_hd()`, working on boolean masks sharing the same grid.
+    """
+
+    hd_dict = dict()
+
+    if not ref_mask.any() or not cmp_mask.any():
+        for key in ["hd", "hd95", "hd_boundaries", "hd95_boundaries"]:
+            hd_dict[key] = np.nan
+        return hd_dict
+
+    ref_mask, cmp_mask = _crop_to_union_bbox(ref_mask, cmp_mask)
+
+    hd_dict["hd"], hd_dict["hd95"] = _hausdorff(ref_mask, cmp_mask, spacing)
+    hd_dict["hd_boundaries"], hd_dict["hd95_boundaries"] = _hausdorff(_boundary(ref_mask),
+                                                                      _boundary(cmp_mask),
+                                                                      spacing)
+
+    return hd_dict
+
+## ----------------------------------------
+
+def native_compare(path_to_reference_img, path_to_test_img):
+
+    """
+    In-process equivalent of `plastimatch compare`: statistics of the difference image
+    (reference minus test, computed in single precision as plastimatch does).
+
+    Both volumes are streamed in slabs of about SLAB_NUM_VOXELS voxels, memory-mapped when stored
+    as uncompressed NRRD or MetaImage (MHA/MHD) files, so memory usage does not grow with the size
+    of the volumes in that case (other formats are read with SimpleITK first).
+
+    Args:
+      path_to_reference_img: path to the reference image
+      path_to_test_img: path to the test image (must have the same geometry as the reference)
+
+    Returns:
+      dictionary formatted like the output of `compare()`, with values rounded like the
+      ones printed by plastimatch (six decimal places):
+        MIN, AVE, MAX   minimum, average and maximum value of the difference image
+        MAE, MSE        mean absolute and mean squared difference between images
+        DIF, NUM        number of voxels with different intensities, total number of voxels
+    """
+
+    # imported here so that `utils.metrics` can be used without touching the volume I/O code
+    from .volume import open_volume, read_image_information
+
+    ref_info = read_image_information(path_to_reference_img)
+    cmp_info = read_image_information(path_to_test_img)
+
+    if not _same_geometry(ref_info, cmp_info):
+        raise ValueError("The geometry of %s and %s does not match."%(path_to_reference_img, path_to_test_img))
+
+    return _compare_arrays(open_volume(path_to_reference_img), open_volume(path_to_test_img))
+
+## ----------------------------------------
+
+def _compare_arrays(ref_arr, cmp_arr):
+
+    """
+    Core of `native_compare()`, streaming through two (array-like) volumes of the same shape.
+    """
+
+    num_vox = int(np.prod(ref_arr.shape))
+    slab_depth = max(1, SLAB_NUM_VOXELS // max(1, int(np.prod(ref_arr.shape[1:]))))
+
+    min_val, max_val = np.inf, -np.inf
+    diff_sum, abs_sum, sq_sum = 0.0, 0.0, 0.0
+    num_diff = 0
+
+    for z_start in range(0, ref_arr.shape[0], slab_depth):
+        # difference in float32 (like plastimatch), statistics accumulated in float64
+        diff = np.subtract(np.asarray(ref_arr[z_start:z_start + slab_depth], dtype = np.float32),
+                           np.asarray(cmp_arr[z_start:z_start + slab_depth], dtype = np.float32))
+
+        min_val = min(min_val, float(diff.min()))
+        max_val = max(max_val, float(diff.max()))
+
+        diff = diff.astype(np.float64)
+        diff_sum += float(diff.sum())
+        abs_sum += float(np.abs(diff).sum())
+        sq_sum += float(np.square(diff).sum())
+        num_diff += int(np.count_nonzero(diff))
+
+    compare_dict = {"MIN" : min_val,
+                    "AVE" : diff_sum / num_vox,
+                    "MAX" : max_val,
+                    "MAE" : abs_sum / num_vox,
+                    "MSE" : sq_sum / num_vox,
+                    "DIF" : num_diff,
+                    "NUM" : num_vox}
+
+    # plastimatch prints the statistics with "%f"
+    return {key : float("%f"%(val)) for key, val in compare_dict.items()}
@@ -0,0 +1,344 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Native (in-process) RTSTRUCT rasterization
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import re
+import concurrent.futures
+import numpy as np
+import pydicom
+import SimpleITK as sitk
+
+# 'plastimatch convert' options the native backend of `convert()` can reproduce
+NATIVE_CONVERT_OPTIONS = ["input", "referenced-ct", "output-prefix", "prefix-format"]
+
+# header fields of the CT slices needed to compute the geometry (the pixel data is never read)
+CT_GEOMETRY_TAGS = ["SeriesInstanceUID", "ImagePositionPatient", "ImageOrientationPatient",
+                    "PixelSpacing", "Rows", "Columns"]
+
+# (3006,0050) ContourData
+CONTOUR_DATA_TAG = 0x30060050
+
+# relative tolerance on the distance between consecutive slices
+SLICE_SPACING_TOLERANCE = 0.01
+
+## ----------------------------------------
+
+def get_structure_file_name(structure_name):
+
+    """
+    Name of the file a structure is saved to (without extension), as plastimatch names it:
+    every character that is not alphanumeric is replaced by an underscore.
+    """
+
+    return re.sub(r"[^A-Za-z0-9]", "_", structure_name)
+
+## ----------------------------------------
+
+def read_ct_geometry(path_to_ct_dir, series_uid = None):
+
+    """
+    Compute the geometry of a CT series from the headers of its slices only.
+
+    Args:
+        path_to_ct_dir: directory storing the CT series
+        series_uid: SeriesInstanceUID of the series to use, if the directory stores more than one
+
+    Returns:
+        dictionary storing the size, spacing, origin and direction of the series (x, y, z order,
+        as in SimpleITK), and the position of every slice along the slice normal ("positions")
+    """
+
+    slices = list()
+
+    for file_name in sorted(os.listdir(path_to_ct_dir)):
+        path_to_file = os.path.join(path_to_ct_dir, file_name)
+
+        if not os.path.isfile(path_to_file):
+            continue
+
+        try:
+            ds = pydicom.dcmread(path_to_file, stop_before_pixels = True, specific_tags = CT_GEOMETRY_TAGS)
+        except (pydicom.errors.InvalidDicomError, OSError, ValueError, EOFError):
+            continue
+
+        if "ImagePositionPatient" in ds and "ImageOrientationPatient" in ds:
+            slices.append(ds)
+
+    series_uids = {str(ds.SeriesInstanceUID) for ds in slices}
+
+    if series_uid is not None and series_uid in series_uids:
+        slices = [ds for ds in slices if str(ds.SeriesInstanceUID) == series_uid]
+    elif len(series_uids) > 1:
+        raise ValueError("%s stores %d image series (specify the one to use)."%(path_to_ct_dir, len(series_uids)))
+
+    if not slices:
+        raise ValueError("No image slices found in %s."%(path_to_ct_dir))
+
+    orientation = np.array(slices[0].ImageOrientationPatient, dtype = np.float64)
+    row_dir, col_dir = orientation[:3], orientation[3:]
+    normal = np.cross(row_dir, col_dir)
+
+    slices.sort(key = lambda ds: np.dot(np.array(ds.ImagePositionPatient, dtype = np.float64), normal))
+    positions = np.array([np.dot(np.array(ds.ImagePositionPatient, dtype = np.float64), normal) for ds in slices])
+
+    if len(slices) > 1:
+        gaps = np.diff(positions)
+        slice_spacing = float(np.median(gaps))
+        if slice_spacing <= 0 or np.max(np.abs(gaps - slice_spacing)) > SLICE_SPACING_TOLERANCE * slice_spacing:
+            raise ValueError("The slices of %s are not evenly spaced."%(path_to_ct_dir))
+    else:
+        slice_spacing = float(slices[0].get("SliceThickness", 1.0) or 1.0)
+
+    # PixelSpacing is (distance between rows, distance between columns)
+    pixel_spacing = [float(val) for val in slices[0].PixelSpacing]
+
+    geometry = dict()
+    geometry["size"] = (int(slices[0].Columns), int(slices[0].Rows), len(slices))
+    geometry["spacing"] = (pixel_spacing[1], pixel_spacing[0], slice_spacing)
+    geometry["origin"] = tuple(float(val) for val in slices[0].ImagePositionPatient)
+    geometry["direction"] = tuple(np.stack([row_dir, col_dir, normal], axis = 1).ravel().tolist())
+    geometry["positions"] = positions
+
+    return geometry
+
+## ----------------------------------------
+
+def _rtstruct_referenced_series_uid(ds):
+
+    for frame_of_reference in ds.get("ReferencedFrameOfReferenceSequence", []):
+        for study in frame_of_reference.get("RTReferencedStudySequence", []):
+            for series in study.get("RTReferencedSeriesSequence", []):
+                if "SeriesInstanceUID" in series:
+                    return str(series.SeriesInstanceUID)
+
+    return None
+
+## ----------------------------------------
+
+def _fill_slice(polygons, num_rows, num_cols):
+
+    """
+    Fill the (even-odd) interior of the polygons drawn on a slice, scanline by scanline, all the
+    scanlines at once: a voxel is inside if an odd number of polygon edges cross its row on its left.
+
+    Args:
+        polygons: list of (N, 2) arrays storing the (column, row) continuous indices of each polygon
+
+    Returns:
+        index of the first row of the filled region, and the uint8 mask of the rows it spans
+        (None if no voxel center is inside)
+    """
+
+    starts = np.concatenate(polygons)
+    ends = np.concatenate([np.roll(points, -1, axis = 0) for points in polygons])
+
+    first_row = max(0, int(np.ceil(starts[:, 1].min())))
+    last_row = min(num_rows - 1, int(np.floor(starts[:, 1].max())))
+
+    if first_row > last_row:
+        return first_row, None
+
+    rows = np.arange(first_row, last_row + 1)
+
+    # edges crossing the row (half-open, so that vertices are not counted twice)
+    row_idx, edge_idx = np.nonzero((starts[:, 1] <= rows[:, None]) != (ends[:, 1] <= rows[:, None]))
+
+    x0, y0 = starts[edge_idx, 0], starts[edge_idx, 1]
+    x1, y1 = ends[edge_idx, 0], ends[edge_idx, 1]
+    x_cross = x0 + (rows[row_idx] - y0) * (x1 - x0) / (y1 - y0)
+
+    # every crossing toggles the voxels whose center is on its right
+    toggles = np.zeros((len(rows), num_cols + 1), dtype = np.uint8)
+    np.add.at(toggles, (row_idx, np.clip(np.ceil(x_cross), 0, num_cols).astype(np.int64)), 1)
+
+    return first_row, (np.cumsum(toggles, axis = 1, dtype = np.uint8)[:, :num_cols] & 1)
+
+## ----------------------------------------
+
+def rasterize_contours(contours, geometry):
+
+    """
+    Rasterize the (closed planar) contours of a structure on the grid of a CT series.
+
+    As for plastimatch, a voxel belongs to the structure if its center is inside an odd number
+    of the contours drawn on its slice (so that inner contours carve holes).
+
+    Args:
+        contours: list of (N, 3) arrays storing the points of each contour, in patient coordinates (mm)
+        geometry: geometry of the grid (see `read_ct_geometry`)
+
+    Returns:
+        uint8 numpy array in numpy (z, y, x) order
+    """
+
+    num_cols, num_rows, num_slices = geometry["size"]
+    mask = np.zeros((num_slices, num_rows, num_cols), dtype = np.uint8)
+
+    # patient coordinates to (continuous) voxel indices
+    direction = np.array(geometry["direction"]).reshape(3, 3)
+    to_index = np.linalg.inv(direction * np.array(geometry["spacing"]))
+    origin = np.array(geometry["origin"])
+
+    slice_polygons = dict()
+
+    for points in contours:
+        if len(points) < 3:
+            continue
+
+        index = (np.asarray(points, dtype = np.float64) - origin) @ to_index.T
+        slice_idx = int(np.round(np.mean(index[:, 2])))
+
+        if 0 <= slice_idx < num_slices:
+            slice_polygons.setdefault(slice_idx, list()).append(index[:, :2])
+
+    for slice_idx, polygons in slice_polygons.items():
+        first_row, filled = _fill_slice(polygons, num_rows, num_cols)
+        if filled is not None:
+            mask[slice_idx, first_row:first_row + len(filled)] = filled
+
+    return mask
+
+## ----------------------------------------
+
+def _read_contour_data(contour):
+
+    """
+    Read the ContourData of a contour as a (N, 3) array, parsing the raw "\\"-separated values
+    directly (converting them to pydicom DS objects first is far slower, for large structure sets).
+    """
+
+    element = contour.get_item(CONTOUR_DATA_TAG)
+    value = element.value
+
+    if isinstance(value, bytes):
+        return np.array(value.decode("ascii").replace("\\", " ").split(), dtype = np.float64).reshape(-1, 3)
+
+    return np.array(value, dtype = np.float64).reshape(-1, 3)
+
+## ----------------------------------------
+
+def read_rtstruct_contours(path_to_rtstruct):
+
+    """
+    Read the contours of every structure of an RTSTRUCT.
+
+    Returns:
+        the RTSTRUCT dataset, and a dictionary mapping the name of every structure
+        (in the order of the StructureSetROISequence) to the list of its contours ((N, 3) arrays)
+    """
+
+    ds = pydicom.dcmread(path_to_rtstruct)
+
+    roi_names = {int(roi.ROINumber) : str(roi.ROIName) for roi in ds.get("StructureSetROISequence", [])}
+    contours = {name : list() for name in roi_names.values()}
+
+    for roi_contour in ds.get("ROIContourSequence", []):
+        name = roi_names.get(int(roi_contour.ReferencedROINumber))
+
+        if name is None:
+            continue
+
+        for contour in roi_contour.get("ContourSequence", []):
+            if str(contour.get("ContourGeometricType", "CLOSED_PLANAR")) not in ("CLOSED_PLANAR", ""):
+                continue
+            contours[name].append(_read_contour_data(contour))
+
+    return ds, contours
+
+## ----------------------------------------
+
+def get_native_convert_unsupported(convert_kwargs):
+
+    """
+    List the arguments of a 'plastimatch convert' call the native backend can not reproduce
+    (an empty list means the call can be run with `native_convert`).
+    """
+
+    unsupported = [key for key in convert_kwargs if key not in NATIVE_CONVERT_OPTIONS]
+
+    if not os.path.isfile(str(convert_kwargs.get("input", ""))):
+        # the native backend only converts a single RTSTRUCT file
+        unsupported.append("input")
+    if not os.path.isdir(str(convert_kwargs.get("referenced-ct", ""))):
+        unsupported.append("referenced-ct")
+    if "output-prefix" not in convert_kwargs:
+        unsupported.append("output-prefix")
+
+    return unsupported
+
+## ----------------------------------------
+
+def native_convert(max_workers = None, compress = False, pixel_type = None, **kwargs):
+
+    """
+    In-process equivalent of 'plastimatch convert --input <RTSTRUCT> --referenced-ct <CT dir>
+    --output-prefix <dir>': rasterize every structure of the RTSTRUCT on the grid of the CT series
+    (computed from the headers of the CT slices only), and save one binary mask per structure
+    as "<output-prefix>/<structure name>.<prefix-format>" (see `get_structure_file_name`; the format
+    defaults to "mha", as for plastimatch).
+
+    The structures are rasterized and written in parallel.
+
+    Args:
+        max_workers: maximum number of structures processed at the same time (defaults to the number of CPUs)
+        compress: compress the output files (if supported by the format, see `utils.data.save_binary_segmask`)
+        pixel_type: numpy type the masks are saved as (defaults to uint8)
+
+        **kwargs: the arguments of the 'plastimatch convert' call, among NATIVE_CONVERT_OPTIONS
+                  (see `get_native_convert_unsupported`)
+
+    Returns:
+        dictionary mapping the name of every structure to the path of its mask
+    """
+
+    unsupported = get_native_convert_unsupported(kwargs)
+    if unsupported:
+        raise ValueError("Options not supported by the native backend: %s."%(", ".join(unsupported)))
+
+    ds, contours = read_rtstruct_contours(str(kwargs["input"]))
+
+    if str(ds.get("Modality", "")) != "RTSTRUCT":
+        raise ValueError("%s is not an RTSTRUCT."%(kwargs["input"]))
+
+    geometry = read_ct_geometry(str(kwargs["referenced-ct"]), _rtstruct_referenced_series_uid(ds))
+
+    output_prefix = str(kwargs["output-prefix"])
+    # same default as 'plastimatch convert --prefix-format'
+    prefix_format = str(kwargs.get("prefix-format", "mha")).lstrip(".")
+
+    os.makedirs(output_prefix, exist_ok = True)
+
+    # structures whose names map to the same file overwrite each other, the last one wins
+    file_names = {get_structure_file_name(name) : name for name in contours}
+
+    def _rasterize_and_save(file_name):
+        mask_arr = rasterize_contours(contours[file_names[file_name]], geometry)
+
+        if pixel_type is not None:
+            mask_arr = mask_arr.astype(pixel_type, copy = False)
+
+        mask = sitk.GetImageFromArray(mask_arr)
+        mask.SetSpacing(geometry["spacing"])
+        mask.SetOrigin(geometry["origin"])
+        mask.SetDirection(geometry["direction"])
+
+        path_to_mask = os.path.join(output_prefix, "%s.%s"%(file_name, prefix_format))
+        sitk.WriteImage(mask, path_to_mask, compress)
+
+        return path_to_mask
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max_workers or os.cpu_count() or 1) as executor:
+        paths = dict(zip(file_names.values(), executor.map(_rasterize_and_save, file_names)))
+
+    return {name : paths[name] for name in contours if name in paths}
@@ -0,0 +1,515 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Volume I/O utility functions
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import collections.abc
+import numpy as np
+import SimpleITK as sitk
+
+# NRRD "type" field values (and their aliases), see http://teem.sourceforge.net/nrrd/format.html#type
+NRRD_DTYPES = {
+    "int8" : np.int8, "signed char" : np.int8, "int8_t" : np.int8,
+    "uint8" : np.uint8, "uchar" : np.uint8, "unsigned char" : np.uint8, "uint8_t" : np.uint8,
+    "int16" : np.int16, "short" : np.int16, "short int" : np.int16, "signed short" : np.int16,
+    "signed short int" : np.int16, "int16_t" : np.int16,
+    "uint16" : np.uint16, "ushort" : np.uint16, "unsigned short" : np.uint16,
+    "unsigned short int" : np.uint16, "uint16_t" : np.uint16,
+    "int32" : np.int32, "int" : np.int32, "signed int" : np.int32, "int32_t" : np.int32,
+    "uint32" : np.uint32, "uint" : np.uint32, "unsigned int" : np.uint32, "uint32_t" : np.uint32,
+    "int64" : np.int64, "longlong" : np.int64, "long long" : np.int64, "long long int" : np.int64,
+    "signed long long" : np.int64, "signed long long int" : np.int64, "int64_t" : np.int64,
+    "uint64" : np.uint64, "ulonglong" : np.uint64, "unsigned long long" : np.uint64,
+    "unsigned long long int" : np.uint64, "uint64_t" : np.uint64,
+    "float" : np.float32, "double" : np.float64,
+}
+
+# MetaImage "ElementType" field values
+META_DTYPES = {
+    "MET_CHAR" : np.int8, "MET_UCHAR" : np.uint8,
+    "MET_SHORT" : np.int16, "MET_USHORT" : np.uint16,
+    "MET_INT" : np.int32, "MET_UINT" : np.uint32,
+    "MET_LONG_LONG" : np.int64, "MET_ULONG_LONG" : np.uint64,
+    "MET_FLOAT" : np.float32, "MET_DOUBLE" : np.float64,
+}
+
+# formats SimpleITK reads only the requested region of (when uncompressed): for any other file,
+# the whole file is read (and decompressed) whatever the region
+STREAMABLE_EXTENSIONS = (".mha", ".mhd", ".nii")
+
+## ----------------------------------------
+
+def _read_header_lines(path_to_file, is_last_line):
+
+    """
+    Read the lines of a text header, up to (and including) the one `is_last_line` returns True for.
+
+    Returns:
+        list of the header lines, and the offset of the first byte following the header
+    """
+
+    header_lines = list()
+
+    with open(path_to_file, "rb") as f:
+        for raw_line in f:
+            line = raw_line.decode("latin-1").rstrip("\r\n")
+            header_lines.append(line)
+
+            if is_last_line(line):
+                return header_lines, f.tell()
+
+            # give up on files whose header is not text (or is unreasonably long)
+            if len(header_lines) > 1024:
+                break
+
+    return None, None
+
+## ----------------------------------------
+
+def _nrrd_memmap(path_to_file):
+
+    """
+    Memory-map the voxel data of an uncompressed (raw encoding) NRRD file.
+    """
+
+    header_lines, data_offset = _read_header_lines(path_to_file, lambda line: line == "")
+
+    if header_lines is None or not header_lines[0].startswith("NRRD"):
+        return None
+
+    fields = dict()
+    for line in header_lines[1:]:
+        if line.startswith("#") or ":" not in line:
+            continue
+        key, val = line.split(":", 1)
+        fields[key.strip().lower()] = val.lstrip("=").strip()
+
+    if fields.get("encoding") != "raw" or fields.get("type") not in NRRD_DTYPES:
+        return None
+
+    if int(fields.get("byte skip", fields.get("byteskip", 0))) != 0 or \
+       int(fields.get("line skip", fields.get("lineskip", 0))) != 0:
+        return None
+
+    # detached data file (a single one, relative to the header)
+    data_file = fields.get("data file", fields.get("datafile"))
+    if data_file is not None:
+        if data_file.startswith("LIST") or " " in data_file:
+            return None
+        path_to_file = os.path.join(os.path.dirname(path_to_file), data_file)
+        data_offset = 0
+
+    dtype = np.dtype(NRRD_DTYPES[fields["type"]])
+    if dtype.itemsize > 1:
+        dtype = dtype.newbyteorder("<" if fields.get("endian", "little") == "little" else ">")
+
+    sizes = [int(size) for size in fields["sizes"].split()]
+
+    # NRRD lists the fastest axis first, numpy the slowest
+    return np.memmap(path_to_file, dtype = dtype, mode = "r", offset = data_offset, shape = tuple(sizes[::-1]))
+
+## ----------------------------------------
+
+def _meta_memmap(path_to_file):
+
+    """
+    Memory-map the voxel data of an uncompressed MetaImage (MHA/MHD) file.
+    """
+
+    header_lines, data_offset = _read_header_lines(path_to_file,
+                                                   lambda line: line.startswith("ElementDataFile"))
+
+    if header_lines is None:
+        return None
+
+    fields = dict()
+    for line in header_lines:
+        if "=" not in line:
+            return None
+        key, val = line.split("=", 1)
+        fields[key.strip()] = val.strip()
+
+    if fields.get("CompressedData", "False").lower() == "true" or \
+       fields.get("ElementType") not in META_DTYPES or \
+       int(fields.get("ElementNumberOfChannels", 1)) != 1:
+        return None
+
+    data_file = fields["ElementDataFile"]
+    if data_file != "LOCAL":
+        if data_file.startswith("LIST") or "%" in data_file:
+            return None
+        path_to_file = os.path.join(os.path.dirname(path_to_file), data_file)
+        data_offset = 0
+
+    if int(fields.get("HeaderSize", 0)) != 0:
+        return None
+
+    msb = fields.get("BinaryDataByteOrderMSB", fields.get("ElementByteOrderMSB", "False")).lower() == "true"
+
+    dtype = np.dtype(META_DTYPES[fields["ElementType"]])
+    if dtype.itemsize > 1:
+        dtype = dtype.newbyteorder(">" if msb else "<")
+
+    sizes = [int(size) for size in fields["DimSize"].split()]
+
+    return np.memmap(path_to_file, dtype = dtype, mode = "r", offset = data_offset, shape = tuple(sizes[::-1]))
+
+## ----------------------------------------
+
+def memmap_volume(path_to_file):
+
+    """
+    Memory-map the voxel data of an uncompressed NRRD or MetaImage (MHA/MHD) file, so that
+    slabs of the volume can be read without loading the whole volume in memory.
+
+    Args:
+        path_to_file: path to the volume
+
+    Returns:
+        read-only numpy.memmap in numpy (z, y, x) order, or None if the file can not be mapped
+        (other formats, compressed or multi-channel data, unsupported header fields)
+    """
+
+    extension = path_to_file.lower()
+
+    try:
+        if extension.endswith((".nrrd", ".nhdr")):
+            return _nrrd_memmap(path_to_file)
+        if extension.endswith((".mha", ".mhd")):
+            return _meta_memmap(path_to_file)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return None
+
+## ----------------------------------------
+
+def read_image_information(path_to_file):
+
+    """
+    Read the header of an image (size, spacing, origin, direction, pixel type) without reading its voxels.
+
+    Returns:
+        the SimpleITK ImageFileReader the information can be queried from (e.g., `GetSize()`)
+    """
+
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(path_to_file)
+    reader.ReadImageInformation()
+
+    return reader
+
+## ----------------------------------------
+
+def can_stream(path_to_file):
+
+    """
+    Check whether SimpleITK can read a region of a volume without reading the whole file
+    (i.e., whether the file is an uncompressed MetaImage or NIfTI file, see STREAMABLE_EXTENSIONS).
+    """
+
+    extension = path_to_file.lower()
+
+    if not extension.endswith(STREAMABLE_EXTENSIONS):
+        return False
+
+    if extension.endswith(".nii"):
+        return True
+
+    try:
+        header_lines, _ = _read_header_lines(path_to_file, lambda line: line.startswith("ElementDataFile"))
+    except OSError:
+        return False
+
+    if header_lines is None:
+        return False
+
+    return not any(line.replace(" ", "").lower() == "compresseddata=true" for line in header_lines)
+
+## ----------------------------------------
+
+def open_volume(path_to_file):
+
+    """
+    Open a volume for slab-wise reading: memory-mapped where possible (see `memmap_volume`),
+    otherwise read with SimpleITK.
+
+    Returns:
+        array-like in numpy (z, y, x) order
+    """
+
+    volume = memmap_volume(path_to_file)
+
+    if volume is None:
+        volume = sitk.GetArrayFromImage(sitk.ReadImage(path_to_file))
+
+    return volume
+
+## ----------------------------------------
+
+class SlabVolume:
+
+    """
+    Read-only array-like reading the slabs of a volume it is indexed with from the file, with
+    SimpleITK, in numpy (z, y, x) order.
+
+    Only the requested region is read for the formats that support it (uncompressed NIfTI or
+    MetaImage, see `can_stream`). Other files (e.g., compressed ones, that would be decompressed
+    in full on every read) are read once, on first access, and kept in memory.
+
+    Args:
+        path_to_file: path to the volume (any format SimpleITK can read)
+    """
+
+    def __init__(self, path_to_file):
+
+        reader = read_image_information(path_to_file)
+
+        if reader.GetNumberOfComponents() != 1:
+            raise ValueError("Only scalar volumes can be read slab-wise "
+                             "(%s has %d components per voxel)."%(path_to_file, reader.GetNumberOfComponents()))
+
+        self.path_to_file = path_to_file
+        self.shape = tuple(reader.GetSize()[::-1])
+        self.dtype = sitk.GetArrayViewFromImage(sitk.Image([1]*reader.GetDimension(), reader.GetPixelID())).dtype
+
+        self.streaming = can_stream(path_to_file)
+        self._volume = None
+
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+
+    def __len__(self):
+        return self.shape[0]
+
+
+    def _read(self, start, stop):
+
+        """
+        Read the slices [start, stop) of the volume.
+        """
+
+        if not self.streaming:
+            if self._volume is None:
+                self._volume = sitk.GetArrayFromImage(sitk.ReadImage(self.path_to_file))
+                self._volume.flags.writeable = False
+            return self._volume[start:stop]
+
+        reader = sitk.ImageFileReader()
+        reader.SetFileName(self.path_to_file)
+        reader.SetExtractIndex([0]*(self.ndim - 1) + [start])
+        reader.SetExtractSize(list(self.shape[:0:-1]) + [stop - start])
+
+        return sitk.GetArrayFromImage(reader.Execute())
+
+
+    def __getitem__(self, key):
+
+        if not isinstance(key, tuple):
+            key = (key,)
+
+        first, rest = key[0], key[1:]
+
+        if isinstance(first, (int, np.integer)):
+            idx = int(first) + self.shape[0] if first < 0 else int(first)
+            if not 0 <= idx < self.shape[0]:
+                raise IndexError("index %d is out of bounds for axis 0 with size %d"%(first, self.shape[0]))
+            return self._read(idx, idx + 1)[(0,) + rest]
+
+        if isinstance(first, slice):
+            start, stop, step = first.indices(self.shape[0])
+            if step > 0 and start < stop:
+                return self._read(start, stop)[(slice(None, None, step),) + rest]
+
+        # anything else (e.g., negative steps, fancy indexing): read the whole volume
+        return self._read(0, self.shape[0])[key]
+
+
+    def __array__(self, dtype = None, copy = None):
+
+        arr = self._read(0, self.shape[0])
+
+        return arr if dtype is None else arr.astype(dtype, copy = False)
+
+## ----------------------------------------
+
+def lazy_volume(path_to_file):
+
+    """
+    Open a volume without reading its voxels: memory-mapped where possible (see `memmap_volume`),
+    otherwise as a `SlabVolume` (reading the slices from the file when they are indexed).
+
+    Returns:
+        array-like in numpy (z, y, x) order
+    """
+
+    volume = memmap_volume(path_to_file)
+
+    return volume if volume is not None else SlabVolume(path_to_file)
+
+## ----------------------------------------
+
+class _PackedSegmask:
+
+    """
+    Lazy view of a single structure of a `PackedSegmasks` (unpacked when indexed).
+    """
+
+    def __init__(self, packed, index):
+
+        self.packed = packed
+        self.index = index
+        self.shape = packed.shape
+        self.ndim = len(packed.shape)
+        self.dtype = np.dtype(bool)
+
+
+    def __getitem__(self, key):
+
+        if self.packed.mode == "labels":
+            return self.packed.data[key] == self.index + 1
+
+        byte, bit = divmod(self.index, 8)
+
+        return ((self.packed.data[..., byte][key] >> bit) & 1) == 1
+
+
+    def __array__(self, dtype = None, copy = None):
+
+        arr = self[...]
+
+        return arr if dtype is None else arr.astype(dtype, copy = False)
+
+
+class PackedSegmasks(collections.abc.Mapping):
+
+    """
+    Binary segmasks of several structures (on the same grid), packed in a single array: a label
+    map (one byte per voxel, up to 255 structures) if the structures do not overlap, otherwise
+    bit-planes (one bit per structure per voxel, e.g. 5 bytes per voxel for 40 structures).
+
+    Behaves as a read-only dictionary of lazy segmasks: `packed[key][z, :, :]` unpacks the (boolean)
+    slice of a single structure only.
+
+    Args:
+        segmask_dict: dictionary of segmasks, as numpy arrays, array-likes, or paths to the files
+                      (read slab by slab, see `lazy_volume`)
+        mode: "labels" (the last structure wins where structures overlap), "bitplanes",
+              or "auto" (a label map unless the structures overlap)
+        slab_size: number of slices read at a time while packing
+    """
+
+    def __init__(self, segmask_dict, mode = "auto", slab_size = 32):
+
+        if mode not in ("auto", "labels", "bitplanes"):
+            raise ValueError("Unknown mode '%s' (expected 'auto', 'labels' or 'bitplanes')."%(mode))
+
+        sources = {key : lazy_volume(str(val)) if isinstance(val, (str, os.PathLike)) else val
+                   for key, val in segmask_dict.items()}
+
+        shapes = {tuple(source.shape) for source in sources.values()}
+        if len(shapes) > 1:
+            raise ValueError("The segmasks must all have the same shape (got %s)."%(sorted(shapes)))
+
+        self.keys_list = list(sources)
+        self._index = {key : index for index, key in enumerate(self.keys_list)}
+        self.shape = shapes.pop() if shapes else (0, 0, 0)
+
+        self.data = None
+
+        if mode != "bitplanes" and len(sources) < 2**16:
+            self.mode = "labels"
+            self.data = self._pack_labels(sources, slab_size, allow_overlaps = mode == "labels")
+
+        if self.data is None:
+            self.mode = "bitplanes"
+            self.data = self._pack_bitplanes(sources, slab_size)
+
+
+    def _iter_slabs(self, sources, slab_size):
+
+        for index, source in enumerate(sources.values()):
+            for start in range(0, self.shape[0], slab_size):
+                stop = min(start + slab_size, self.shape[0])
+                yield index, start, stop, np.asarray(source[start:stop]) > 0
+
+
+    def _pack_labels(self, sources, slab_size, allow_overlaps):
+
+        """
+        Pack the segmasks in a label map, or return None if they overlap (and `allow_overlaps` is not set).
+        """
+
+        labels = np.zeros(self.shape, dtype = np.uint8 if len(sources) < 2**8 else np.uint16)
+
+        for index, start, stop, mask in self._iter_slabs(sources, slab_size):
+            labels_slab = labels[start:stop]
+
+            if not allow_overlaps and labels_slab[mask].any():
+                return None
+
+            labels_slab[mask] = index + 1
+
+        return labels
+
+
+    def _pack_bitplanes(self, sources, slab_size):
+
+        bitplanes = np.zeros(tuple(self.shape) + ((len(sources) + 7) // 8,), dtype = np.uint8)
+
+        for index, start, stop, mask in self._iter_slabs(sources, slab_size):
+            byte, bit = divmod(index, 8)
+            bitplanes[start:stop, ..., byte] |= mask.astype(np.uint8) << bit
+
+        return bitplanes
+
+
+    def __getitem__(self, key):
+        return _PackedSegmask(self, self._index[key])
+
+
+    def __iter__(self):
+        return iter(self.keys_list)
+
+
+    def __len__(self):
+        return len(self.keys_list)
+
+## ----------------------------------------
+
+def decimate_volume(volume, step, slab_size = 64):
+
+    """
+    Keep one voxel every `step` along each axis of a volume, reading it slab by slab (e.g., to
+    build low-resolution previews of volumes that are too large, or too slow, to be read at once).
+
+    Args:
+        volume: numpy array or array-like (e.g., see `lazy_volume`)
+        step: decimation factor
+        slab_size: number of slices read at a time (rounded to a multiple of `step`)
+
+    Returns:
+        numpy array
+    """
+
+    slab_size = max(step, slab_size // step * step)
+    every = (slice(None, None, step),) * len(volume.shape)
+
+    # copy each decimated slab, so that the full resolution slab can be freed right away
+    slabs = [np.ascontiguousarray(np.asarray(volume[start:min(start + slab_size, volume.shape[0])])[every])
+             for start in range(0, volume.shape[0], slab_size)]
+
+    return np.concatenate(slabs)
@@ -1,39 +1,132 @@
 """
     ----------------------------------------
     PyPlastimatch
-    
+
     Viz tools for notebook testing
     ----------------------------------------
-    
+
     ----------------------------------------
     Author: Dennis Bontempi
     Email:  dbontempi@bwh.harvard.edu
     ----------------------------------------
-    
+
 """
 
+import os
+import abc
+import asyncio
+import collections
 import numpy as np
 import ipywidgets as ipyw
 import matplotlib.pyplot as plt
 
+from IPython.display import display, clear_output
 from matplotlib.colors import ListedColormap
 from matplotlib.patches import Patch
 
-class AxialSliceFigure:
-  """ 
+from .volume import lazy_volume, read_image_information, decimate_volume, PackedSegmasks
+
+# numpy axis (of a (z, y, x) volume) each plane is orthogonal to
+PLANES = {"axial" : 0, "coronal" : 1, "sagittal" : 2}
+
+## ----------------------------------------
+
+def as_volume(volume):
+  """
+  Get the array-like a widget reads its slices from: file paths (e.g., NRRD, MHA, NIfTI) are opened
+  lazily (memory-mapped, or read slab by slab, see `utils.volume.lazy_volume`), while arrays and
+  array-likes (e.g., numpy.memmap, h5py or zarr datasets) are used as they are.
+
+  """
+
+  if isinstance(volume, (str, os.PathLike)):
+    return lazy_volume(str(volume))
+
+  return volume
+
+
+def as_packed_segmasks(segmask_dict):
+  """
+  Pack the segmasks of a widget (arrays, array-likes or file paths) in a single label map or
+  in bit-planes (see `utils.volume.PackedSegmasks`), instead of keeping one array per structure.
+
+  """
+
+  if isinstance(segmask_dict, PackedSegmasks):
+    return segmask_dict
+
+  return PackedSegmasks(segmask_dict)
+
+
+def get_volume_spacing(volume):
+  """
+  Get the spacing (x, y, z order, as in SimpleITK) of a volume given as a file path, from its header
+  (None for arrays and array-likes).
+
+  """
+
+  if isinstance(volume, (str, os.PathLike)):
+    return tuple(read_image_information(str(volume)).GetSpacing())
+
+  return None
+
+
+def get_plane(volume, plane, idx, step = 1):
+  """
+  Extract a plane ("axial", "coronal" or "sagittal") of a volume (in numpy (z, y, x) order),
+  keeping one voxel every `step` in the plane. Coronal and sagittal planes are flipped
+  vertically, so that the last axial slice is at the top.
+
+  """
+
+  every = slice(None, None, step)
+
+  if plane == "axial":
+    return np.asarray(volume[idx, every, every])
+  if plane == "coronal":
+    return np.asarray(volume[every, idx, every])[::-1]
+  if plane == "sagittal":
+    return np.asarray(volume[every, every, idx])[::-1]
+
+  raise ValueError("Unknown plane '%s' (expected one of %s)."%(plane, list(PLANES)))
+
+## ----------------------------------------
+
+class AxialSliceFigure(abc.ABC):
+  """
   Base class for the interactive slice-wise visualisation widgets
-  
+
   Init of all the figure parameters that are always set.
 
+  The figure and its images are created once (the first time a slice is shown), and updated
+  in place when the slider moves. The images of each slice (HU-windowed uint8 CT slices, and
+  a single RGBA overlay compositing all the structures) are computed the first time the slice
+  is shown, and the last `cache_size` ones are kept in memory.
+
+  The CT volumes and the segmasks can be given as numpy arrays, array-likes or file paths
+  (see `as_volume`): only the slices shown are read. The segmasks are packed in a single
+  array (see `as_packed_segmasks`).
+
+  Besides axial slices, coronal and sagittal planes can be shown (with the aspect ratio given
+  by the voxel spacing). For volumes larger than `preview_size` voxels along any axis, a decimated
+  preview of each plane is shown first, and replaced by the full resolution plane as soon as the
+  slider stops moving.
+
   @Params:
-    ct_cmap - required : colormap for the CT viz. 
-    figsize - required : size of the figure (in inches).
-    dpi     - required : DPI of the figure.
-    min_hu  - required : minimum HU to be visualised
-    max_hu  - required : maximum HU to be visualised
+    ct_cmap      - required : colormap for the CT viz.
+    figsize      - required : size of the figure (in inches).
+    dpi          - required : DPI of the figure.
+    min_hu       - required : minimum HU to be visualised
+    max_hu       - required : maximum HU to be visualised
+    cache_size   - optional : number of slices kept in memory, ready to be shown.
+    preview_size - optional : largest number of voxels along an axis shown without a preview
+                              (None to always show the full resolution planes).
   """
-  
-  def __init__(self, ct_cmap, figsize, dpi, min_hu, max_hu):
+
+  # seconds the slider has to stay still before the full resolution plane replaces the preview
+  refine_delay = 0.25
+
+  def __init__(self, ct_cmap, figsize, dpi, min_hu, max_hu, cache_size = 32, preview_size = 512):
 
     self.ct_cmap = ct_cmap
     self.figsize = figsize
@@ -42,180 +135,480 @@ class AxialSliceFigure:
     self.min_hu = min_hu
     self.max_hu = max_hu
 
+    self.cache_size = cache_size
+    self.preview_size = preview_size
+
+    self.fig = None
+    self.images = list()
+    self.output = None
+    self._canvas_displayed = False
+
+    # planes the widget can show, and the (shape, spacing) of the volume shown by each image
+    # (None if all the images show volumes on the grid set by `set_geometry`)
+    self.planes = list(PLANES)
+    self.image_grids = None
+
+    self.view_plane = "axial"
+    self._shown_plane = None
+    self._shown = None
+    self._refine_handle = None
+
+    self._cache = collections.OrderedDict()
+    self._decimated = dict()
+
+
+  def set_geometry(self, shape, spacing = None):
+    """
+    Set the shape (numpy (z, y, x) order) and the spacing (x, y, z order, defaults to 1 mm)
+    of the volumes shown.
+
+    """
+
+    self.volume_shape = tuple(shape)
+    self.spacing = tuple(spacing) if spacing is not None else (1., 1., 1.)
+    self.max_axial = self.volume_shape[0] - 1
+
+    # decimation factor of the previews (a power of two)
+    self.preview_step = 1
+    if self.preview_size:
+      while max(self.volume_shape) > self.preview_size * self.preview_step:
+        self.preview_step *= 2
+
 
   def views(self):
-    """ 
-    method description goes here
-    
     """
+    Display the plane selector, the slider and the figure, and show the first slice.
+
+    """
+
+    plane_buttons = ipyw.ToggleButtons(options = [plane.capitalize() for plane in self.planes],
+                                       description = 'View:')
+
+    slider = ipyw.IntSlider(min = 0, max = self.max_axial,
+                            step = 1, continuous_update = True,
+                            description = 'Axial slice:')
+    slider.observe(lambda change: self.plot_plane(self.view_plane, change["new"]), names = "value")
+
+    def _on_plane(change):
+      self.view_plane = change["new"].lower()
+      max_idx = self.volume_shape[PLANES[self.view_plane]] - 1
+
+      slider.description = change["new"] + ' slice:'
+      slider.max = max_idx
+
+      # start from the middle of the volume (re-plotting only if the slider does not move)
+      if slider.value == max_idx // 2:
+        self.plot_plane(self.view_plane, slider.value)
+      else:
+        slider.value = max_idx // 2
+
+    plane_buttons.observe(_on_plane, names = "value")
+
+    self.output = ipyw.Output()
+    display(ipyw.VBox([plane_buttons, slider, self.output]))
+
+    self.plot_slice(slider.value)
+
+
+  def window_slice(self, ct_slice):
+    """
+    Map a CT slice to uint8, clipping the HU values to [min_hu, max_hu]
+    (so that it is shown with vmin = 0 and vmax = 255).
+
+    """
+
+    scale = 255. / (self.max_hu - self.min_hu)
+    ct_slice = np.clip(np.asarray(ct_slice, dtype = np.float32), self.min_hu, self.max_hu)
+
+    return ((ct_slice - self.min_hu) * scale + 0.5).astype(np.uint8)
+
+
+  def ct_plane(self, ct_volume, plane, idx, step = 1):
+    """
+    Get a HU-windowed plane of a CT volume (see `get_plane` and `window_slice`).
+
+    Previews of volumes that are not in memory are taken from a decimated copy of the volume,
+    computed the first time it is needed, so that they do not read the whole file every time.
+
+    """
+
+    if step > 1 and (not isinstance(ct_volume, np.ndarray) or isinstance(ct_volume, np.memmap)):
+      key = (id(ct_volume), step)
+      if key not in self._decimated:
+        self._decimated[key] = decimate_volume(ct_volume, step)
+      ct_volume, idx, step = self._decimated[key], idx // step, 1
+
+    return self.window_slice(get_plane(ct_volume, plane, idx, step))
+
+
+  def overlay_slice(self, segmask_dict, segmask_cmap_dict, segmask_alpha, plane, idx, step, shape):
+    """
+    Composite a plane of all the structures into a single RGBA (uint8) image.
+
+    As for an imshow() of the binary segmask per structure (in the order of `segmask_dict`),
+    the voxels of a structure are coloured with cmap(1.0) and the background with cmap(0.0),
+    scaled by `segmask_alpha` (so that colormaps with a transparent bottom only show the structure).
+
+    """
+
+    # premultiplied RGBA, flattened so that the voxels of each structure can be indexed directly
+    overlay = np.zeros((int(np.prod(shape)), 4), dtype = np.float32)
+
+    for key, segmask in segmask_dict.items():
+      segmask_cmap = plt.get_cmap(segmask_cmap_dict[key])
+      mask = get_plane(segmask, plane, idx, step).ravel() > 0
+
+      for color, is_foreground in ((segmask_cmap(0.0), False), (segmask_cmap(1.0), True)):
+        alpha = color[3] * segmask_alpha
+
+        # e.g., the (transparent) background of most structure colormaps
+        if alpha == 0:
+          continue
+
+        voxels = np.flatnonzero(mask if is_foreground else ~mask)
+        color = np.array([color[0] * alpha, color[1] * alpha, color[2] * alpha, alpha], dtype = np.float32)
+        overlay[voxels] = color + overlay[voxels] * (1 - alpha)
+
+    alpha = overlay[:, 3:]
+    overlay[:, :3] = np.divide(overlay[:, :3], alpha, out = np.zeros_like(overlay[:, :3]), where = alpha > 0)
+
+    return (overlay * 255 + 0.5).astype(np.uint8).reshape(tuple(shape) + (4,))
+
+
+  @abc.abstractmethod
+  def get_plane_images(self, plane, idx, step):
+    """
+    Compute the images shown for a plane, keeping one voxel every `step`
+    (in the order of `self.images`). Implemented by every widget.
+
+    """
+
+
+  @abc.abstractmethod
+  def create_figure(self, plane_images):
+    """
+    Create the figure and its images (stored in `self.images`) for the first plane shown.
+    Implemented by every widget.
+
+    """
+
+
+  def plot_slice(self, axial_idx):
+    """
+    Show an axial slice, updating the images of the figure in place.
+
+    """
+
+    self.plot_plane("axial", axial_idx)
+
+
+  def plot_plane(self, plane, idx):
+    """
+    Show a plane ("axial", "coronal" or "sagittal"), updating the images of the figure in place.
 
-    ipyw.interact(self.plot_slice, 
-                  axial_idx = ipyw.IntSlider(min = 0, max = self.max_axial,
-                                             step = 1, continuous_update = True,
-                                             description = 'Axial slice:'))
+    If the volumes need a preview (see `preview_size`) and the full resolution plane is not cached,
+    the preview is shown, and the full resolution plane once the slider stays still for `refine_delay` s.
+
+    """
+
+    self._shown = (plane, idx)
+
+    if self.preview_step > 1 and (plane, idx, 1) not in self._cache:
+      self._show(plane, idx // self.preview_step * self.preview_step, self.preview_step)
+      self._schedule_refine()
+    else:
+      self._show(plane, idx, 1)
+
+
+  def _get_plane_images(self, plane, idx, step):
+
+    key = (plane, idx, step)
+
+    if key in self._cache:
+      self._cache.move_to_end(key)
+      return self._cache[key]
+
+    plane_images = self.get_plane_images(plane, idx, step)
+
+    self._cache[key] = plane_images
+    if len(self._cache) > self.cache_size:
+      self._cache.popitem(last = False)
+
+    return plane_images
+
+
+  def _show(self, plane, idx, step):
+
+    plane_images = self._get_plane_images(plane, idx, step)
+
+    if self.fig is None:
+      # do not let the (inline) backend show the figure on its own, it is displayed below
+      with plt.ioff():
+        self.create_figure(plane_images)
+    else:
+      for image, plane_image in zip(self.images, plane_images):
+        image.set_data(plane_image)
+
+    new_plane = plane != self._shown_plane
+    if new_plane:
+      self._set_plane_geometry(plane)
+
+    self._draw(full = new_plane)
+
+
+  def _set_plane_geometry(self, plane):
+    """
+    Lay the images of a plane over the full resolution voxel grid (so that previews and full
+    resolution planes overlap), with the aspect ratio of the voxels.
+
+    """
+
+    rows_axis, cols_axis = [axis for axis in range(3) if axis != PLANES[plane]]
+    image_grids = self.image_grids or [(self.volume_shape, self.spacing)] * len(self.images)
+
+    for image, (shape, spacing) in zip(self.images, image_grids):
+      spacing = spacing[::-1]
+      rows, cols = shape[rows_axis], shape[cols_axis]
+
+      image.set_extent((-0.5, cols - 0.5, rows - 0.5, -0.5))
+      image.axes.set_aspect(spacing[rows_axis] / spacing[cols_axis])
+
+    self._shown_plane = plane
+
+
+  def _schedule_refine(self):
+
+    try:
+      loop = asyncio.get_running_loop()
+    except RuntimeError:
+      # no event loop (e.g., outside of a notebook): no need to wait
+      self._refine()
+      return
+
+    if self._refine_handle is not None:
+      self._refine_handle.cancel()
+
+    self._refine_handle = loop.call_later(self.refine_delay, self._refine)
+
+
+  def _refine(self):
+
+    self._refine_handle = None
+    self._show(*self._shown, 1)
+
+
+  def _draw(self, full = False):
+
+    canvas = self.fig.canvas
+
+    if not isinstance(canvas, ipyw.DOMWidget):
+      # static backend (e.g., inline): render the figure again
+      self._display(self.fig, clear = True)
+      return
+
+    # interactive backend (e.g., ipympl): display the canvas once, then redraw it in place
+    if not self._canvas_displayed:
+      self._display(canvas)
+      self._canvas_displayed = True
+      canvas.draw_idle()
+      return
+
+    if full or not getattr(canvas, "supports_blit", False):
+      canvas.draw_idle()
+      return
+
+    # only the images change between slices: redraw them, not the titles, ticks and legend
+    for ax in {image.axes for image in self.images}:
+      for image in self.images:
+        if image.axes is ax:
+          ax.draw_artist(image)
+      canvas.blit(ax.bbox)
+
+
+  def _display(self, obj, clear = False):
+
+    if self.output is None:
+      display(obj)
+      return
+
+    with self.output:
+      if clear:
+        clear_output(wait = True)
+      display(obj)
 
 ## ----------------------------------------
 ## ----------------------------------------
 
 class AxialSliceComparison(AxialSliceFigure):
-  """ 
+  """
   class description goes here
-  
+
   """
-  
+
   def __init__(self, ct_volume_left, ct_volume_right,
                title_left = "", title_right = "",
                ct_cmap = "gray", figsize = (12, 12), dpi = 100,
-               min_hu = -1024, max_hu = 3072):
-    
-    super().__init__(ct_cmap, figsize, dpi, min_hu, max_hu)
+               min_hu = -1024, max_hu = 3072, cache_size = 32,
+               spacing = None, preview_size = 512):
+
+    super().__init__(ct_cmap, figsize, dpi, min_hu, max_hu, cache_size, preview_size)
+
+    self.ct_volume_left = as_volume(ct_volume_left)
+    self.ct_volume_right = as_volume(ct_volume_right)
+
+    # the axial slices of both volumes are shown side by side
+    assert self.ct_volume_left.shape[0] == self.ct_volume_right.shape[0]
 
-    # the only constraint should be on the number of axial slice of the volumes to visualise
-    assert ct_volume_left.shape[0] == ct_volume_right.shape[0]
+    shape_left, shape_right = tuple(self.ct_volume_left.shape), tuple(self.ct_volume_right.shape)
+    spacing_left = spacing or get_volume_spacing(ct_volume_left) or (1., 1., 1.)
+    spacing_right = spacing or get_volume_spacing(ct_volume_right) or (1., 1., 1.)
+
+    self.set_geometry([max(left, right) for left, right in zip(shape_left, shape_right)], spacing_left)
+
+    if shape_left != shape_right:
+      # different in-plane grids: the coronal and sagittal planes would not match, only show axial slices
+      self.planes = ["axial"]
+      self.image_grids = [(shape_left, spacing_left), (shape_right, spacing_right)]
 
-    self.ct_volume_left = ct_volume_left
-    self.ct_volume_right = ct_volume_right
-    self.max_axial = self.ct_volume_left.shape[0] - 1
-   
     self.title_left = title_left
     self.title_right = title_right
 
-    ipyw.interact(self.views)
-  
+    self.views()
 
-  def plot_slice(self, axial_idx):
-    """ 
-    method description goes here
-    
-    """
 
-    fig, (ax_left, ax_right) = plt.subplots(1, 2, figsize = self.figsize, dpi = self.dpi)
+  def get_plane_images(self, plane, idx, step):
+
+    return (self.ct_plane(self.ct_volume_left, plane, idx, step),
+            self.ct_plane(self.ct_volume_right, plane, idx, step))
+
 
-    # plot CT axial slices
+  def create_figure(self, plane_images):
+
+    self.fig, (ax_left, ax_right) = plt.subplots(1, 2, figsize = self.figsize, dpi = self.dpi)
+
+    # plot CT planes
     ax_left.set_title(self.title_left)
-    ax_left.imshow(self.ct_volume_left[axial_idx, :, :], cmap = self.ct_cmap,
-                   vmin = self.min_hu, vmax = self.max_hu)
-    
     ax_right.set_title(self.title_right)
-    ax_right.imshow(self.ct_volume_right[axial_idx, :, :], cmap = self.ct_cmap,
-                    vmin = self.min_hu, vmax = self.max_hu)
 
-    plt.subplots_adjust(hspace = 0.2)
-    plt.show()
-  
+    self.images = [ax.imshow(slice_image, cmap = self.ct_cmap, vmin = 0, vmax = 255, interpolation = "nearest")
+                   for ax, slice_image in zip((ax_left, ax_right), plane_images)]
+
+    self.fig.subplots_adjust(hspace = 0.2)
+
 
 ## ----------------------------------------
 ## ----------------------------------------
 
 class AxialSliceSegmaskComparison(AxialSliceFigure):
-  """ 
+  """
   class description goes here
-  
+
   """
-  
+
   def __init__(self, ct_volume, segmask_ai_dict, segmask_manual_dict,
                segmask_cmap_dict, segmask_alpha = 0.6, title_left = "", title_right = "",
                ct_cmap = "gray", figsize = (12, 12), dpi = 100,
-               min_hu = -1024, max_hu = 3072):
-    
-    super().__init__(ct_cmap, figsize, dpi, min_hu, max_hu)
+               min_hu = -1024, max_hu = 3072, cache_size = 32,
+               spacing = None, preview_size = 512):
+
+    super().__init__(ct_cmap, figsize, dpi, min_hu, max_hu, cache_size, preview_size)
 
-    self.ct_volume = ct_volume
-    self.max_axial = self.ct_volume.shape[0] - 1
+    self.ct_volume = as_volume(ct_volume)
+    self.set_geometry(self.ct_volume.shape, spacing or get_volume_spacing(ct_volume))
 
-    self.segmask_ai_dict = segmask_ai_dict
-    self.segmask_manual_dict = segmask_manual_dict
+    self.segmask_ai_dict = as_packed_segmasks(segmask_ai_dict)
+    self.segmask_manual_dict = as_packed_segmasks(segmask_manual_dict)
 
     self.segmask_cmap_dict = segmask_cmap_dict
     self.segmask_alpha = segmask_alpha
-    
+
     self.title_left = title_left
     self.title_right = title_right
 
-    ipyw.interact(self.views)
+    # check the lenght of cmaps is enough to colour all the structures
+    assert len(self.segmask_cmap_dict) == np.max([len(self.segmask_ai_dict),
+                                                  len(self.segmask_manual_dict)])
 
+    self.views()
 
-  def plot_slice(self, axial_idx):
-    """
-    method description goes here
-    
-    """
 
-    fig, (ax_ai, ax_manual) = plt.subplots(1, 2, figsize = self.figsize, dpi = self.dpi)
+  def get_plane_images(self, plane, idx, step):
+
+    ct_slice = self.ct_plane(self.ct_volume, plane, idx, step)
+
+    overlay_ai = self.overlay_slice(self.segmask_ai_dict, self.segmask_cmap_dict,
+                                    self.segmask_alpha, plane, idx, step, ct_slice.shape)
+    overlay_manual = self.overlay_slice(self.segmask_manual_dict, self.segmask_cmap_dict,
+                                        self.segmask_alpha, plane, idx, step, ct_slice.shape)
+
+    return ct_slice, overlay_ai, ct_slice, overlay_manual
+
+
+  def create_figure(self, plane_images):
+
+    self.fig, (ax_ai, ax_manual) = plt.subplots(1, 2, figsize = self.figsize, dpi = self.dpi)
 
-    # plot CT axial slices
     ax_ai.set_title(self.title_left)
-    ax_ai.imshow(self.ct_volume[axial_idx, :, :], cmap = self.ct_cmap,
-                 vmin = self.min_hu, vmax = self.max_hu)
-    
     ax_manual.set_title(self.title_right)
-    ax_manual.imshow(self.ct_volume[axial_idx, :, :], cmap = self.ct_cmap,
-                     vmin = self.min_hu, vmax = self.max_hu)
 
-    # check the lenght of cmaps is enough to colour all the structures
-    assert len(self.segmask_cmap_dict) == np.max([len(self.segmask_ai_dict),
-                                                  len(self.segmask_manual_dict)])
-    
-    # plot overlaying masks
-    for key in self.segmask_ai_dict:
-      segmask_ai = self.segmask_ai_dict[key]
-      segmask_cmap = self.segmask_cmap_dict[key]
-      ax_ai.imshow(segmask_ai[axial_idx, :, :], label = key,
-                   cmap = segmask_cmap, alpha = self.segmask_alpha)
-
-    for key in self.segmask_manual_dict:
-      segmask_manual = self.segmask_manual_dict[key]
-      segmask_cmap = self.segmask_cmap_dict[key]
-      ax_manual.imshow(segmask_manual[axial_idx, :, :], label = key,
-                       cmap = segmask_cmap, alpha = self.segmask_alpha)
-
-    plt.subplots_adjust(hspace = 0.2)
-    plt.show()
+    self.images = list()
+
+    # plot CT planes, and the overlaying masks
+    for ax, (ct_slice, overlay) in zip((ax_ai, ax_manual), (plane_images[:2], plane_images[2:])):
+      self.images.append(ax.imshow(ct_slice, cmap = self.ct_cmap, vmin = 0, vmax = 255,
+                                   interpolation = "nearest"))
+      self.images.append(ax.imshow(overlay, interpolation = "nearest"))
+
+    self.fig.subplots_adjust(hspace = 0.2)
 
 ## ----------------------------------------
 ## ----------------------------------------
 
 class AxialSliceSegmaskViz(AxialSliceFigure):
-  """ 
+  """
   class description goes here
-  
+
   """
-  
+
   def __init__(self, ct_volume, segmask_dict, segmask_cmap_dict,
                segmask_alpha = 0.4,
-               random_cmap = False, # FIXME - legend in the figure is wrong
+               random_cmap = False,
                fig_title = "",
                ct_cmap = "gray", figsize = (6, 6), dpi = 100,
-               min_hu = -1024, max_hu = 3072):
-    
-    """ 
+               min_hu = -1024, max_hu = 3072, cache_size = 32,
+               spacing = None, preview_size = 512):
+
+    """
     constructor description goes here
-    
+
     """
-    
-    super().__init__(ct_cmap, figsize, dpi, min_hu, max_hu)
 
-    self.ct_volume = ct_volume
-    self.max_axial = self.ct_volume.shape[0] - 1
+    super().__init__(ct_cmap, figsize, dpi, min_hu, max_hu, cache_size, preview_size)
+
+    self.ct_volume = as_volume(ct_volume)
+    self.set_geometry(self.ct_volume.shape, spacing or get_volume_spacing(ct_volume))
 
-    self.segmask_dict = segmask_dict
+    self.segmask_dict = as_packed_segmasks(segmask_dict)
 
     self.fig_title = fig_title
-    
+
     if random_cmap:
       self.segmask_cmap_dict = self.get_random_cmap_dict(segmask_dict.keys())
     else:
       self.segmask_cmap_dict = segmask_cmap_dict
 
     self.segmask_alpha = segmask_alpha
-    
-    ipyw.interact(self.views)
-  
+
+    # check the lenght of cmaps is enough to colour all the structures
+    assert len(self.segmask_cmap_dict) == len(self.segmask_dict)
+
+    self.views()
+
 
   def get_random_cmap_dict(self, dict_keys):
-    """ 
+    """
     method description goes here
-    
+
     """
 
     segmask_cmap_dict = dict()
@@ -234,43 +627,32 @@ class AxialSliceSegmaskViz(AxialSliceFigure):
     return segmask_cmap_dict
 
 
-  def plot_slice(self, axial_idx):
-    """
-    method description goes here
-    
-    """
+  def get_plane_images(self, plane, idx, step):
 
-    fig, ax = plt.subplots(1, 1, figsize = self.figsize, dpi = self.dpi)
+    ct_slice = self.ct_plane(self.ct_volume, plane, idx, step)
+    overlay = self.overlay_slice(self.segmask_dict, self.segmask_cmap_dict,
+                                 self.segmask_alpha, plane, idx, step, ct_slice.shape)
 
-    try:
-      len(legend_elements)
-    except:
-      legend_elements = list()
+    return ct_slice, overlay
+
+
+  def create_figure(self, plane_images):
+
+    self.fig, ax = plt.subplots(1, 1, figsize = self.figsize, dpi = self.dpi)
 
-    # plot CT axial slices
+    # plot CT planes, and the overlaying masks
     ax.set_title(self.fig_title)
-    ax.imshow(self.ct_volume[axial_idx, :, :], cmap = self.ct_cmap,
-              vmin = self.min_hu, vmax = self.max_hu)
+    self.images = [ax.imshow(plane_images[0], cmap = self.ct_cmap, vmin = 0, vmax = 255,
+                             interpolation = "nearest"),
+                   ax.imshow(plane_images[1], interpolation = "nearest")]
 
-    # check the lenght of cmaps is enough to colour all the structures
-    assert len(self.segmask_cmap_dict) == len(self.segmask_dict)
-    
-    # plot overlaying masks
-    for key in self.segmask_dict:
-      segmask = self.segmask_dict[key]
-      segmask_cmap = self.segmask_cmap_dict[key]
-
-      ax.imshow(segmask[axial_idx, :, :], label = key,
-                cmap = segmask_cmap, alpha = self.segmask_alpha)
-      
-      if not len(legend_elements) == len(self.segmask_dict):        
-        legend_elements.append(Patch(facecolor = segmask_cmap(0.7),
-                                     edgecolor = 'k',
-                                     label = key))
-      
-    plt.subplots_adjust(hspace = 0.2)
-    plt.show()
+    # same colour as the structures in the overlay
+    legend_elements = [Patch(facecolor = plt.get_cmap(self.segmask_cmap_dict[key])(1.0),
+                             edgecolor = 'k',
+                             label = key) for key in self.segmask_dict]
 
     ax.legend(handles = legend_elements,
               loc = 'upper left',
               bbox_to_anchor = (1, 1))
+
+    self.fig.subplots_adjust(hspace = 0.2)
@@ -0,0 +1,211 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Shared test fixtures
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+# stand-in for the plastimatch executable (see benchmarks/stub/plastimatch)
+STUB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "stub")
+
+SPACING = (0.9765625, 0.9765625, 2.5)
+ORIGIN = (-250.0, -180.0, -95.0)
+
+## ----------------------------------------
+
+@pytest.fixture
+def stub_plastimatch(monkeypatch):
+
+    """
+    Put the plastimatch stand-in first on PATH, so that the CLI wrappers run without the real binary.
+    """
+
+    monkeypatch.setenv("PATH", os.pathsep.join([STUB_DIR, os.environ.get("PATH", "")]))
+
+    return os.path.join(STUB_DIR, "plastimatch")
+
+## ----------------------------------------
+
+@pytest.fixture
+def write_volume(tmp_path):
+
+    """
+    Save a numpy (z, y, x) array as a volume under the temporary directory of the test.
+
+    Returns:
+        function `write_volume(file_name, arr, spacing = SPACING, origin = ORIGIN)` returning the path
+        to the saved (uncompressed) volume
+    """
+
+    def _write_volume(file_name, arr, spacing = SPACING, origin = ORIGIN):
+        sitk_img = sitk.GetImageFromArray(np.asarray(arr))
+        sitk_img.SetSpacing(spacing)
+        sitk_img.SetOrigin(origin)
+
+        path_to_file = str(tmp_path / file_name)
+        sitk.WriteImage(sitk_img, path_to_file, False)
+
+        return path_to_file
+
+    return _write_volume
+
+## ----------------------------------------
+
+def ellipsoid(shape, center, radii):
+
+    """
+    Binary (uint8) mask of an ellipsoid, with center and radii in voxels (z, y, x order).
+    """
+
+    zz, yy, xx = np.indices(shape)
+
+    return ((((zz - center[0])/radii[0])**2 + ((yy - center[1])/radii[1])**2 +
+             ((xx - center[2])/radii[2])**2) <= 1).astype(np.uint8)
+
+## ----------------------------------------
+
+# grid of the synthetic CT series: (rows, columns, slices), (column, row) spacing, slice spacing,
+# and origin of the first slice
+CT_NUM_ROWS, CT_NUM_COLS, CT_NUM_SLICES = 40, 48, 10
+CT_PIXEL_SPACING = (0.8, 0.9)
+CT_SLICE_SPACING = 2.5
+CT_ORIGIN = (-20.0, -15.0, -10.0)
+
+def _new_dicom_dataset(sop_class_uid):
+
+    # imported here so that the tests not using DICOM data do not need pydicom
+    from pydicom.dataset import FileDataset, FileMetaDataset
+    from pydicom.uid import generate_uid, ExplicitVRLittleEndian
+
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = sop_class_uid
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = FileDataset(None, {}, file_meta = file_meta, preamble = b"\0"*128)
+    ds.SOPClassUID = sop_class_uid
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+
+    return ds
+
+## ----------------------------------------
+
+def write_ct_series(path_to_ct_dir, patient_id = "PAT-0001", num_slices = CT_NUM_SLICES, study_uid = None):
+
+    """
+    Write a synthetic CT series (one file per slice, "ct_<slice index>.dcm") on the CT_* grid.
+
+    Returns:
+        dictionary storing the "patient_id", "study", "series" and "frame_of_reference" UIDs of the series
+    """
+
+    from pydicom.uid import generate_uid, CTImageStorage
+
+    uids = {"patient_id" : patient_id, "study" : study_uid or generate_uid(), "series" : generate_uid(),
+            "frame_of_reference" : generate_uid()}
+
+    os.makedirs(path_to_ct_dir, exist_ok = True)
+
+    # written in reverse order, so that the slices have to be sorted by position
+    for slice_idx in reversed(range(num_slices)):
+        ds = _new_dicom_dataset(CTImageStorage)
+        ds.PatientID = patient_id
+        ds.Modality = "CT"
+        ds.StudyInstanceUID = uids["study"]
+        ds.SeriesInstanceUID = uids["series"]
+        ds.FrameOfReferenceUID = uids["frame_of_reference"]
+        ds.ImagePositionPatient = [CT_ORIGIN[0], CT_ORIGIN[1], CT_ORIGIN[2] + slice_idx*CT_SLICE_SPACING]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.PixelSpacing = [CT_PIXEL_SPACING[1], CT_PIXEL_SPACING[0]]
+        ds.SliceThickness = CT_SLICE_SPACING
+        ds.Rows, ds.Columns = CT_NUM_ROWS, CT_NUM_COLS
+        ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 16, 15, 1
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.PixelData = np.zeros((CT_NUM_ROWS, CT_NUM_COLS), dtype = np.int16).tobytes()
+
+        ds.save_as(os.path.join(path_to_ct_dir, "ct_%03d.dcm"%(slice_idx)), enforce_file_format = True)
+
+    return uids
+
+## ----------------------------------------
+
+def write_rtstruct(path_to_rtstruct, uids, structures):
+
+    """
+    Write an RTSTRUCT drawn on the CT series identified by `uids` (see `write_ct_series`).
+
+    Args:
+        structures: dictionary mapping the name of every structure to the list of its contours
+                    ((N, 3) arrays of points in patient coordinates)
+    """
+
+    from pydicom.dataset import Dataset
+    from pydicom.uid import generate_uid, RTStructureSetStorage
+
+    ds = _new_dicom_dataset(RTStructureSetStorage)
+    ds.PatientID = uids["patient_id"]
+    ds.Modality = "RTSTRUCT"
+    ds.StudyInstanceUID = uids["study"]
+    ds.SeriesInstanceUID = generate_uid()
+
+    series = Dataset()
+    series.SeriesInstanceUID = uids["series"]
+    study = Dataset()
+    study.RTReferencedSeriesSequence = [series]
+    frame_of_reference = Dataset()
+    frame_of_reference.FrameOfReferenceUID = uids["frame_of_reference"]
+    frame_of_reference.RTReferencedStudySequence = [study]
+    ds.ReferencedFrameOfReferenceSequence = [frame_of_reference]
+
+    ds.StructureSetROISequence, ds.ROIContourSequence = list(), list()
+
+    for roi_number, (name, contours) in enumerate(structures.items(), 1):
+        roi = Dataset()
+        roi.ROINumber, roi.ROIName = roi_number, name
+        ds.StructureSetROISequence.append(roi)
+
+        roi_contour = Dataset()
+        roi_contour.ReferencedROINumber = roi_number
+        roi_contour.ContourSequence = list()
+
+        for points in contours:
+            contour = Dataset()
+            contour.ContourGeometricType = "CLOSED_PLANAR"
+            contour.NumberOfContourPoints = len(points)
+            contour.ContourData = [round(float(val), 4) for val in np.ravel(points)]
+            roi_contour.ContourSequence.append(contour)
+
+        ds.ROIContourSequence.append(roi_contour)
+
+    os.makedirs(os.path.dirname(path_to_rtstruct), exist_ok = True)
+    ds.save_as(path_to_rtstruct, enforce_file_format = True)
+
+    return str(ds.SeriesInstanceUID)
+
+## ----------------------------------------
+
+def ct_slice_contour(index_points, slice_idx):
+
+    """
+    Contour on a slice of the synthetic CT: (column, row) voxel indices to patient coordinates (mm).
+    """
+
+    index_points = np.asarray(index_points, dtype = np.float64)
+
+    return np.column_stack([CT_ORIGIN[0] + index_points[:, 0]*CT_PIXEL_SPACING[0],
+                            CT_ORIGIN[1] + index_points[:, 1]*CT_PIXEL_SPACING[1],
+                            np.full(len(index_points), CT_ORIGIN[2] + slice_idx*CT_SLICE_SPACING)])
@@ -0,0 +1,140 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    asyncio wrapper (cancellation, timeouts, bounded concurrency, native backends)
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import asyncio
+import threading
+
+import pytest
+
+import pyplastimatch as pypla
+from pyplastimatch import aio
+from pyplastimatch.utils import metrics
+
+from conftest import ellipsoid
+
+# seconds each stub command sleeps for, in the tests needing plastimatch to be running for a while
+STUB_DELAY = 0.5
+
+## ----------------------------------------
+
+@pytest.fixture
+def slow_stub(stub_plastimatch, monkeypatch):
+
+    monkeypatch.setenv("PLASTIMATCH_STUB_DELAY", str(STUB_DELAY))
+
+    return stub_plastimatch
+
+@pytest.fixture
+def processes(monkeypatch):
+
+    """
+    Record every process started by the asyncio wrapper, together with the number of the
+    previously started ones that were still running at that time.
+    """
+
+    processes = list()
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def _create_subprocess_exec(*args, **kwargs):
+        num_running = sum(process.returncode is None for process, _ in processes)
+        process = await create_subprocess_exec(*args, **kwargs)
+        processes.append((process, num_running))
+        return process
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", _create_subprocess_exec)
+
+    return processes
+
+## ----------------------------------------
+
+def test_cancel_kills_the_process(slow_stub, processes):
+
+    async def _cancel():
+        task = asyncio.ensure_future(aio.dice("ref.nrrd", "cmp.nrrd", verbose = False))
+        await asyncio.sleep(STUB_DELAY/5)
+        task.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(_cancel())
+
+    assert len(processes) == 1
+    # killed by a signal, before the stub could exit on its own
+    assert processes[0][0].returncode < 0
+
+## ----------------------------------------
+
+def test_timeout_kills_the_process(slow_stub, processes):
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(aio.hd("ref.nrrd", "cmp.nrrd", verbose = False, timeout = STUB_DELAY/5))
+
+    assert len(processes) == 1
+    assert processes[0][0].returncode < 0
+
+    # with enough time, the same command succeeds
+    hd_dict = asyncio.run(aio.hd("ref.nrrd", "cmp.nrrd", verbose = False, timeout = 10*STUB_DELAY))
+    assert hd_dict["hd"] == 8.999999
+
+## ----------------------------------------
+
+@pytest.mark.parametrize("shared", [True, False])
+def test_semaphore_bounds_concurrency(slow_stub, processes, shared):
+
+    async def _run_all():
+        # the shared semaphore of the event loop, or one passed explicitly
+        semaphore = None if shared else asyncio.Semaphore(2)
+        return await asyncio.gather(*[aio.compare("ref.nrrd", "cmp.nrrd", verbose = False, semaphore = semaphore)
+                                      for _ in range(6)])
+
+    if shared:
+        aio.set_max_concurrency(2)
+
+    try:
+        results = asyncio.run(_run_all())
+    finally:
+        aio.set_max_concurrency(os.cpu_count() or 1)
+
+    assert len(results) == 6
+    assert all(compare_dict["MAE"] == 11.492838 for compare_dict in results)
+
+    # never more than two processes at a time, but two at a time nonetheless
+    assert max(num_running for _, num_running in processes) == 1
+    assert [num_running for _, num_running in processes].count(1) >= 2
+
+## ----------------------------------------
+
+def test_native_backends_run_in_the_executor(write_volume, processes, monkeypatch):
+
+    path_to_ref = write_volume("ref.nrrd", ellipsoid((12, 20, 24), (6, 10, 12), (3, 5, 6)))
+    path_to_cmp = write_volume("cmp.nrrd", ellipsoid((12, 20, 24), (6, 11, 12), (3, 6, 5)))
+
+    threads = list()
+    native_dice = metrics.native_dice
+
+    def _native_dice(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return native_dice(*args, **kwargs)
+
+    monkeypatch.setattr(metrics, "native_dice", _native_dice)
+
+    dice_dict = asyncio.run(aio.dice(path_to_ref, path_to_cmp, verbose = False, backend = "native"))
+
+    assert dice_dict == pypla.dice(path_to_ref, path_to_cmp, verbose = False, backend = "native")
+
+    # the first call ran outside of the thread of the event loop, and no plastimatch process was started
+    assert threads[0] is not threading.main_thread()
+    assert processes == []
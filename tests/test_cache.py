@@ -0,0 +1,102 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Persistent result cache
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+
+import pytest
+
+import pyplastimatch as pypla
+from pyplastimatch.utils.cache import ResultCache
+
+from conftest import ellipsoid
+
+SHAPE = (8, 16, 16)
+
+## ----------------------------------------
+
+@pytest.fixture
+def masks(write_volume):
+
+    return (write_volume("ref.nrrd", ellipsoid(SHAPE, (4, 8, 8), (3, 5, 5))),
+            write_volume("cmp.nrrd", ellipsoid(SHAPE, (4, 8, 9), (3, 5, 5))))
+
+## ----------------------------------------
+
+def test_hit_and_miss(masks, tmp_path):
+
+    cache = ResultCache(cache_dir = str(tmp_path / "cache"))
+
+    first = pypla.dice(*masks, verbose = False, backend = "native", cache = cache)
+    second = pypla.dice(*masks, verbose = False, backend = "native", cache = cache)
+
+    assert second == first
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+    # other metrics are stored under other keys
+    pypla.compare(*masks, verbose = False, backend = "native", cache = cache)
+    assert cache.stats()["misses"] == 2
+
+## ----------------------------------------
+
+def test_changed_input_is_a_miss(masks, tmp_path, write_volume):
+
+    cache = ResultCache(cache_dir = str(tmp_path / "cache"))
+
+    first = pypla.dice(*masks, verbose = False, backend = "native", cache = cache)
+
+    # same path, different content (and size or mtime)
+    write_volume("cmp.nrrd", ellipsoid(SHAPE, (4, 8, 8), (3, 5, 5)))
+    os.utime(masks[1], ns = (0, 0))
+
+    second = pypla.dice(*masks, verbose = False, backend = "native", cache = cache)
+
+    assert cache.stats()["misses"] == 2
+    assert second["dc"] == pytest.approx(1.0)
+    assert first["dc"] < 1.0
+
+## ----------------------------------------
+
+def test_lru_eviction(tmp_path):
+
+    value = {"dc" : 0.5, "padding" : "x"*100}
+    cache = ResultCache(cache_dir = str(tmp_path / "cache"), max_size = 2*len(str(value)) + 50)
+
+    cache.put("a", value)
+    cache.put("b", value)
+
+    # "a" is now more recently used than "b", which gets evicted first
+    assert cache.get("a") == value
+    cache.put("c", value)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == value
+    assert cache.get("c") == value
+
+    stats = cache.stats()
+    assert (stats["evictions"], stats["entries"]) == (1, 2)
+    assert stats["size"] <= cache.max_size
+
+## ----------------------------------------
+
+def test_clear(tmp_path):
+
+    cache = ResultCache(cache_dir = str(tmp_path / "cache"))
+
+    cache.put("a", [1, 2, 3])
+    cache.clear()
+
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,212 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Running plastimatch commands (command hooks, resource usage, streaming)
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+import pyplastimatch as pypla
+
+## ----------------------------------------
+
+@pytest.fixture
+def recorded_results():
+
+    """
+    Register a hook recording the result of every command, and unregister it at the end of the test.
+    """
+
+    results = list()
+    pypla.add_command_hook(results.append)
+
+    yield results
+
+    if results.append in pypla.pyplastimatch._command_hooks:
+        pypla.remove_command_hook(results.append)
+
+## ----------------------------------------
+
+def test_hooks_run_on_every_command(stub_plastimatch, recorded_results):
+
+    bash_command = pypla.get_bash_command("dice", "ref.nrrd", "cmp.nrrd")
+    result = pypla.run_plastimatch_command(bash_command)
+
+    pypla.hd("ref.nrrd", "cmp.nrrd", verbose = False)
+
+    assert len(recorded_results) == 2
+    assert recorded_results[0] is result
+    assert recorded_results[1].bash_command == ["plastimatch", "dice", "--hausdorff", "ref.nrrd", "cmp.nrrd"]
+
+    pypla.remove_command_hook(recorded_results.append)
+    pypla.run_plastimatch_command(bash_command)
+
+    assert len(recorded_results) == 2
+
+## ----------------------------------------
+
+def test_failing_hook_does_not_fail_the_command(stub_plastimatch, recorded_results, capsys):
+
+    def _failing_hook(result):
+        raise RuntimeError("profiler unreachable")
+
+    pypla.add_command_hook(_failing_hook)
+
+    try:
+        result = pypla.run_plastimatch_command(pypla.get_bash_command("dice", "ref.nrrd", "cmp.nrrd"))
+    finally:
+        pypla.remove_command_hook(_failing_hook)
+
+    assert result.returncode == 0
+    # hooks registered after the failing one still run
+    assert recorded_results == [result]
+    assert "profiler unreachable" in capsys.readouterr().out
+
+## ----------------------------------------
+
+def test_result_timing_and_memory(stub_plastimatch):
+
+    result = pypla.run_plastimatch_command(pypla.get_bash_command("dice", "ref.nrrd", "cmp.nrrd"))
+
+    assert result.returncode == 0
+    assert result.stdout.splitlines()[-3] == "DICE:      0.939273"
+    assert result.wall_time > 0
+
+    if hasattr(os, "wait4"):
+        # the stub is a Python script: starting the interpreter takes some CPU time and memory
+        assert result.user_time + result.sys_time > 0
+        assert result.max_rss > 1024*1024
+        if sys.platform.startswith("linux"):
+            # a kilobyte figure would have been converted to bytes
+            assert result.max_rss % 1024 == 0
+    else:
+        assert result.user_time is None and result.sys_time is None and result.max_rss is None
+
+## ----------------------------------------
+
+def test_result_of_failing_command(stub_plastimatch):
+
+    # the stub copies the input to the output, and fails if the input does not exist
+    result = pypla.run_plastimatch_command(pypla.get_bash_command("convert", input = "missing.nrrd",
+                                                                  **{"output-img" : "output.nrrd"}))
+
+    assert result.returncode != 0
+    assert "missing.nrrd" in result.stderr
+
+    with pytest.raises(subprocess.CalledProcessError) as exc_info:
+        result.check_returncode()
+
+    assert exc_info.value.returncode == result.returncode
+
+## ----------------------------------------
+
+# lines printed by the stub for 'plastimatch dice --dice'
+STUB_DICE_LINES = ["CENTER_OF_MASS",
+                   "ref\t    35.0662\t   -47.6561\t   -34.1450",
+                   "cmp\t    35.0477\t   -49.1853\t   -34.7870",
+                   "TP:        123456",
+                   "TN:        16000000",
+                   "FN:        4321",
+                   "FP:        5678",
+                   "DICE:      0.939273",
+                   "SE:        0.966197",
+                   "SP:        0.999645"]
+
+def test_streaming_callback_order_and_log_file(stub_plastimatch, tmp_path):
+
+    path_to_log_file = str(tmp_path / "dice.log")
+    received = list()
+
+    def _line_callback(line, stream_name):
+        # the line is already in the log file when the callback sees it
+        with open(path_to_log_file, "r") as f:
+            assert f.read().splitlines()[-1] == line
+        received.append((stream_name, line))
+
+    result = pypla.run_plastimatch_command(pypla.get_bash_command("dice", "--dice", "ref.nrrd", "cmp.nrrd"),
+                                           path_to_log_file = path_to_log_file, line_callback = _line_callback)
+
+    assert result.returncode == 0
+    assert received == [("stdout", line) for line in STUB_DICE_LINES]
+
+    with open(path_to_log_file, "r") as f:
+        assert f.read().splitlines() == STUB_DICE_LINES
+
+## ----------------------------------------
+
+def test_streaming_keeps_the_tail(stub_plastimatch):
+
+    received = list()
+
+    result = pypla.run_plastimatch_command(pypla.get_bash_command("dice", "--dice", "ref.nrrd", "cmp.nrrd"),
+                                           line_callback = lambda line, stream_name: received.append(line),
+                                           tail_lines = 3)
+
+    # every line goes through the callback, only the last ones are kept
+    assert received == STUB_DICE_LINES
+    assert result.stdout.splitlines() == STUB_DICE_LINES[-3:]
+    assert result.stderr == ""
+
+    # the parsers only need the tail, when it is long enough
+    assert pypla.pyplastimatch._parse_dice_output(
+        pypla.run_plastimatch_command(pypla.get_bash_command("dice", "--dice", "ref.nrrd", "cmp.nrrd"),
+                                      tail_lines = 10).stdout)["dc"] == 0.939273
+
+## ----------------------------------------
+
+def test_streaming_interleaves_stdout_and_stderr():
+
+    # the stub only prints on stdout: use a process alternating between the two streams
+    # (flushing and pausing, so that the order in which the lines are read is deterministic)
+    code = ("import sys, time\n"
+            "for idx in range(3):\n"
+            "    for stream in (sys.stdout, sys.stderr):\n"
+            "        print('%s %d' % (stream.name[1:-1], idx), file = stream, flush = True)\n"
+            "        time.sleep(0.05)\n")
+
+    received = list()
+
+    result = pypla.run_plastimatch_command([sys.executable, "-c", code],
+                                           line_callback = lambda line, stream_name: received.append((stream_name,
+                                                                                                      line)))
+
+    assert received == [(stream_name, "%s %d"%(stream_name, idx))
+                        for idx in range(3) for stream_name in ("stdout", "stderr")]
+
+    assert result.stdout.splitlines() == ["stdout 0", "stdout 1", "stdout 2"]
+    assert result.stderr.splitlines() == ["stderr 0", "stderr 1", "stderr 2"]
+
+## ----------------------------------------
+
+def test_failing_callback_is_raised(stub_plastimatch, recorded_results):
+
+    def _failing_callback(line, stream_name):
+        raise ValueError("stop at %s"%(line))
+
+    with pytest.raises(ValueError, match = "stop at CENTER_OF_MASS"):
+        pypla.run_plastimatch_command(pypla.get_bash_command("dice", "--dice", "ref.nrrd", "cmp.nrrd"),
+                                      line_callback = _failing_callback)
+
+    # the output is still drained and the process reaped before raising
+    assert len(recorded_results) == 1
+    assert recorded_results[0].returncode is not None
+
+## ----------------------------------------
+
+def test_streaming_with_stdout_file_is_rejected(tmp_path):
+
+    with pytest.raises(ValueError):
+        pypla.run_plastimatch_command(["plastimatch", "--version"], path_to_stdout = str(tmp_path / "stdout.txt"),
+                                      line_callback = print)
@@ -0,0 +1,96 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Native compare backend and memory-mapped volume reading
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+import pyplastimatch as pypla
+from pyplastimatch.utils import metrics, volume
+
+SHAPE = (10, 24, 32)
+
+## ----------------------------------------
+
+@pytest.fixture
+def ct_volumes(write_volume):
+
+    rng = np.random.default_rng(0)
+
+    ref_arr = rng.integers(-1000, 1000, SHAPE).astype(np.int16)
+    cmp_arr = ref_arr.copy()
+    cmp_arr[2:6, 5:15, 8:20] += rng.integers(-50, 50, (4, 10, 12)).astype(np.int16)
+
+    return ref_arr, cmp_arr, write_volume("ref.nrrd", ref_arr), write_volume("cmp.mha", cmp_arr)
+
+## ----------------------------------------
+
+@pytest.mark.parametrize("file_name", ["vol.nrrd", "vol.mha"])
+def test_memmap_volume_matches_sitk(write_volume, file_name):
+
+    arr = np.arange(np.prod(SHAPE), dtype = np.int16).reshape(SHAPE)
+    path_to_file = write_volume(file_name, arr)
+
+    memmap = volume.memmap_volume(path_to_file)
+
+    assert memmap is not None
+    np.testing.assert_array_equal(memmap, sitk.GetArrayFromImage(sitk.ReadImage(path_to_file)))
+
+## ----------------------------------------
+
+def test_memmap_volume_compressed(write_volume, tmp_path):
+
+    path_to_file = str(tmp_path / "compressed.nrrd")
+    sitk.WriteImage(sitk.ReadImage(write_volume("vol.nrrd", np.ones(SHAPE, dtype = np.uint8))), path_to_file, True)
+
+    # compressed voxel data can not be mapped, open_volume falls back to SimpleITK
+    assert volume.memmap_volume(path_to_file) is None
+    np.testing.assert_array_equal(volume.open_volume(path_to_file), 1)
+
+## ----------------------------------------
+
+def test_native_compare_matches_numpy(ct_volumes, monkeypatch):
+
+    ref_arr, cmp_arr, path_to_ref, path_to_cmp = ct_volumes
+
+    # stream the volumes in several slabs
+    monkeypatch.setattr(metrics, "SLAB_NUM_VOXELS", 3*SHAPE[1]*SHAPE[2])
+
+    compare_dict = metrics.native_compare(path_to_ref, path_to_cmp)
+    diff = ref_arr.astype(np.float64) - cmp_arr.astype(np.float64)
+
+    assert compare_dict == pytest.approx({"MIN" : diff.min(), "AVE" : diff.mean(), "MAX" : diff.max(),
+                                          "MAE" : np.abs(diff).mean(), "MSE" : np.square(diff).mean(),
+                                          "DIF" : np.count_nonzero(diff), "NUM" : diff.size}, abs = 1e-6)
+
+## ----------------------------------------
+
+def test_native_compare_matches_cli_layout(ct_volumes, stub_plastimatch):
+
+    _, _, path_to_ref, path_to_cmp = ct_volumes
+
+    cli_dict = pypla.compare(path_to_ref, path_to_cmp, verbose = False, backend = "cli")
+    native_dict = pypla.compare(path_to_ref, path_to_cmp, verbose = False, backend = "native")
+
+    assert list(native_dict) == list(cli_dict)
+
+## ----------------------------------------
+
+def test_native_compare_geometry_mismatch(write_volume):
+
+    path_to_ref = write_volume("ref.nrrd", np.zeros(SHAPE, dtype = np.int16))
+    path_to_cmp = write_volume("cmp.nrrd", np.zeros(SHAPE, dtype = np.int16), spacing = (1.0, 1.0, 1.0))
+
+    with pytest.raises(ValueError):
+        metrics.native_compare(path_to_ref, path_to_cmp)
@@ -0,0 +1,87 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Batch convert runner
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+
+import pytest
+
+import pyplastimatch as pypla
+
+from conftest import write_ct_series, write_rtstruct, ct_slice_contour
+
+## ----------------------------------------
+
+@pytest.fixture
+def input_files(tmp_path):
+
+    path_list = list()
+
+    for idx in range(3):
+        path_to_input = tmp_path / ("input_%d.nrrd"%(idx))
+        path_to_input.write_bytes(b"voxels %d"%(idx))
+        path_list.append(str(path_to_input))
+
+    return path_list
+
+## ----------------------------------------
+
+def test_cli_jobs(input_files, tmp_path, stub_plastimatch):
+
+    jobs = [{"input" : path, "output-img" : path + ".out"} for path in input_files]
+    # the stand-in fails on a missing input
+    jobs.append({"input" : str(tmp_path / "missing.nrrd"), "output-img" : str(tmp_path / "missing.out")})
+
+    results = pypla.convert_many(jobs, max_workers = 2, log_dir = str(tmp_path / "logs"), verbose = False)
+
+    for job_idx, (job, job_result) in enumerate(zip(jobs[:3], results[:3])):
+        assert (job_result["backend"], job_result["returncode"], job_result["error"]) == ("cli", 0, None)
+        assert job_result["result"].wall_time is not None
+        assert job_result["path_to_log_file"] == str(tmp_path / "logs" / ("convert_%05d.log"%(job_idx)))
+        assert os.path.isfile(job["output-img"])
+
+    assert results[3]["returncode"] not in (0, None)
+    assert results[3]["error"] is not None
+
+## ----------------------------------------
+
+def test_missing_executable(input_files, tmp_path, monkeypatch):
+
+    # no plastimatch on PATH: the process can not be started
+    monkeypatch.setenv("PATH", str(tmp_path))
+
+    results = pypla.convert_many([{"input" : input_files[0], "output-img" : str(tmp_path / "out.nrrd")}],
+                                 verbose = False)
+
+    assert (results[0]["returncode"], results[0]["result"]) == (None, None)
+    assert results[0]["error"] is not None
+
+## ----------------------------------------
+
+def test_native_jobs(tmp_path, monkeypatch):
+
+    pytest.importorskip("pydicom")
+
+    uids = write_ct_series(str(tmp_path / "ct"))
+    write_rtstruct(str(tmp_path / "rtstruct.dcm"), uids,
+                   {"Heart" : [ct_slice_contour([(5.3, 5.2), (20.1, 6.4), (12.2, 18.3)], 3)]})
+
+    # no plastimatch on PATH: the job can only succeed in-process
+    monkeypatch.setenv("PATH", str(tmp_path))
+
+    job = {"input" : str(tmp_path / "rtstruct.dcm"), "referenced-ct" : str(tmp_path / "ct"),
+           "output-prefix" : str(tmp_path / "masks")}
+    results = pypla.convert_many([job], verbose = False, backend = "native")
+
+    assert (results[0]["backend"], results[0]["returncode"], results[0]["error"]) == ("native", 0, None)
+    assert os.path.isfile(tmp_path / "masks" / "Heart.mha")
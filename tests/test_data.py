@@ -0,0 +1,102 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Segmask writing utility functions
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from pyplastimatch.utils import data
+
+from conftest import SPACING, ORIGIN, ellipsoid
+
+SHAPE = (8, 16, 20)
+
+## ----------------------------------------
+
+@pytest.fixture
+def reference(write_volume):
+
+    return write_volume("ct.nrrd", np.zeros(SHAPE, dtype = np.int16))
+
+## ----------------------------------------
+
+def test_save_binary_segmask(reference, tmp_path):
+
+    segmask = ellipsoid(SHAPE, (4, 8, 10), (3, 5, 6)).astype(bool)
+    path_to_output = str(tmp_path / "mask.nrrd")
+
+    data.save_binary_segmask(reference, path_to_output, segmask, compress = True)
+    mask_img = sitk.ReadImage(path_to_output)
+
+    # boolean segmasks are saved as uint8, with the geometry of the reference
+    assert mask_img.GetPixelID() == sitk.sitkUInt8
+    assert mask_img.GetSpacing() == SPACING
+    assert mask_img.GetOrigin() == ORIGIN
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(mask_img), segmask)
+
+## ----------------------------------------
+
+def test_save_binary_segmask_pixel_type(reference, tmp_path):
+
+    path_to_output = str(tmp_path / "mask.nrrd")
+
+    data.save_binary_segmask(reference, path_to_output, np.ones(SHAPE, dtype = np.int64), pixel_type = "uint16")
+
+    assert sitk.ReadImage(path_to_output).GetPixelID() == sitk.sitkUInt16
+
+## ----------------------------------------
+
+def test_save_binary_segmask_size_mismatch(reference, tmp_path):
+
+    with pytest.raises(ValueError):
+        data.save_binary_segmask(reference, str(tmp_path / "mask.nrrd"), np.ones((8, 16, 16), dtype = np.uint8))
+
+## ----------------------------------------
+
+def test_geometry_cache(reference, write_volume):
+
+    data._read_geometry.cache_clear()
+
+    data.get_geometry(reference)
+    data.get_geometry(reference)
+    assert data._read_geometry.cache_info().hits == 1
+
+    # a modified reference is read again
+    write_volume("ct.nrrd", np.zeros(SHAPE, dtype = np.int16), spacing = (2.0, 2.0, 2.0))
+    assert data.get_geometry(reference)[2] == (2.0, 2.0, 2.0)
+
+## ----------------------------------------
+
+def test_save_binary_segmasks(reference, tmp_path):
+
+    segmask_dict = {str(tmp_path / ("mask_%d.nrrd"%(idx))) : ellipsoid(SHAPE, (4, 8, 10), (3, 5, 2 + idx))
+                    for idx in range(4)}
+
+    data.save_binary_segmasks(reference, segmask_dict, max_workers = 2)
+
+    for path_to_output, segmask in segmask_dict.items():
+        np.testing.assert_array_equal(sitk.GetArrayFromImage(sitk.ReadImage(path_to_output)), segmask)
+
+## ----------------------------------------
+
+def test_save_binary_segmasks_error(reference, tmp_path):
+
+    segmask_dict = {str(tmp_path / "good.nrrd") : np.ones(SHAPE, dtype = np.uint8),
+                    str(tmp_path / "bad.nrrd") : np.ones((1, 2, 3), dtype = np.uint8)}
+
+    with pytest.raises(ValueError):
+        data.save_binary_segmasks(reference, segmask_dict)
+
+    # the other writes still complete
+    assert (tmp_path / "good.nrrd").is_file()
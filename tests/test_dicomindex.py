@@ -0,0 +1,208 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Persistent DICOM index: incremental scans, series lookup, staging and convert jobs
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import shutil
+
+import pytest
+
+pydicom = pytest.importorskip("pydicom")
+
+from pyplastimatch import dicomindex
+
+from conftest import CT_NUM_SLICES, write_ct_series, write_rtstruct
+
+## ----------------------------------------
+
+@pytest.fixture
+def collection(tmp_path):
+
+    """
+    Synthetic collection:
+      PAT-0001/ct       a CT series, alone in its directory
+      PAT-0001/rt       an RTSTRUCT drawn on it
+      PAT-0002/mixed    two CT series sharing the directory, a text file and a malformed DICOM file
+    """
+
+    root_dir = tmp_path / "collection"
+
+    uids = {"ct" : write_ct_series(str(root_dir / "PAT-0001" / "ct"))}
+    uids["rtstruct"] = write_rtstruct(str(root_dir / "PAT-0001" / "rt" / "rtstruct.dcm"), uids["ct"], {})
+
+    mixed_dir = root_dir / "PAT-0002" / "mixed"
+    uids["first"] = write_ct_series(str(mixed_dir), patient_id = "PAT-0002")
+    uids["second"] = write_ct_series(str(tmp_path / "second"), patient_id = "PAT-0002", num_slices = 4,
+                                     study_uid = uids["first"]["study"])
+    for file_name in os.listdir(str(tmp_path / "second")):
+        shutil.move(str(tmp_path / "second" / file_name), str(mixed_dir / ("second_" + file_name)))
+
+    (mixed_dir / "notes.txt").write_text("not a DICOM file")
+
+    # an RTSTRUCT whose RTReferencedStudySequence is an integer: reading its references fails
+    ds = pydicom.dcmread(str(root_dir / "PAT-0001" / "rt" / "rtstruct.dcm"))
+    ds.ReferencedFrameOfReferenceSequence[0][0x30060012] = pydicom.DataElement(0x30060012, "US", 5)
+    ds.save_as(str(mixed_dir / "malformed.dcm"))
+
+    return str(root_dir), uids
+
+@pytest.fixture
+def index(tmp_path):
+
+    return dicomindex.DicomIndex(str(tmp_path / "index.db"))
+
+## ----------------------------------------
+
+def test_malformed_files_are_unreadable(collection):
+
+    root_dir, _ = collection
+    path_to_malformed = os.path.join(root_dir, "PAT-0002", "mixed", "malformed.dcm")
+    path_to_text = os.path.join(root_dir, "PAT-0002", "mixed", "notes.txt")
+
+    assert dicomindex.read_dicom_headers([path_to_malformed, path_to_text]) == \
+           [{"path" : path_to_malformed, "is_dicom" : False}, {"path" : path_to_text, "is_dicom" : False}]
+
+## ----------------------------------------
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_incremental_update(collection, index, monkeypatch, max_workers):
+
+    root_dir, uids = collection
+
+    # several chunks, so that the headers are read by the worker processes
+    monkeypatch.setattr(dicomindex, "SCAN_CHUNK_SIZE", 4)
+
+    num_files = 2*CT_NUM_SLICES + 4 + 3
+    assert index.update(root_dir, max_workers = max_workers, verbose = False) == \
+           {"added" : num_files, "updated" : 0, "removed" : 0, "unchanged" : 0}
+
+    # nothing changed: no header is read again
+    assert index.update(root_dir, max_workers = max_workers, verbose = False) == \
+           {"added" : 0, "updated" : 0, "removed" : 0, "unchanged" : num_files}
+
+    path_to_slice = index.files(uids["ct"]["series"])[0]
+    file_stat = os.stat(path_to_slice)
+    os.utime(path_to_slice, ns = (file_stat.st_atime_ns, file_stat.st_mtime_ns + 10**9))
+    os.remove(index.files(uids["second"]["series"])[-1])
+
+    assert index.update(root_dir, max_workers = max_workers, verbose = False) == \
+           {"added" : 0, "updated" : 1, "removed" : 1, "unchanged" : num_files - 2}
+
+    assert len(index.files(uids["second"]["series"])) == 3
+
+    # scanning another directory does not remove the files indexed under the first one
+    other_dir = os.path.join(os.path.dirname(root_dir), "other")
+    write_ct_series(other_dir, patient_id = "PAT-0003", num_slices = 2)
+
+    assert index.update(other_dir, verbose = False)["removed"] == 0
+    assert len(index.series()) == 5
+
+## ----------------------------------------
+
+def test_series_and_files(collection, index):
+
+    root_dir, uids = collection
+    index.update([root_dir], verbose = False)
+
+    series_list = index.series()
+
+    # sorted by patient, study and series; the malformed file and the text file are not listed
+    assert [series["patient_id"] for series in series_list] == ["PAT-0001", "PAT-0001", "PAT-0002", "PAT-0002"]
+    assert {series["series_uid"] for series in series_list} == {uids["ct"]["series"], uids["rtstruct"],
+                                                                uids["first"]["series"], uids["second"]["series"]}
+
+    ct_series = index.series(modality = "CT")
+    assert len(ct_series) == 3
+
+    ct_series = {series["series_uid"] : series for series in ct_series}[uids["ct"]["series"]]
+    assert ct_series["num_files"] == CT_NUM_SLICES
+    assert ct_series["directories"] == [os.path.join(root_dir, "PAT-0001", "ct")]
+    assert ct_series["frame_of_reference_uid"] == uids["ct"]["frame_of_reference"]
+
+    rtstruct_series = index.series(modality = "RTSTRUCT")
+    assert len(rtstruct_series) == 1
+    assert rtstruct_series[0]["referenced_series_uids"] == [uids["ct"]["series"]]
+
+    files = index.files(uids["second"]["series"])
+    assert files == sorted(files) and len(files) == 4
+    assert all(os.path.basename(path).startswith("second_") for path in files)
+
+    assert index.files("1.2.3.4") == []
+
+## ----------------------------------------
+
+def test_get_series_input(collection, index, tmp_path):
+
+    root_dir, uids = collection
+    staging_dir = str(tmp_path / "staging")
+    index.update(root_dir, verbose = False)
+
+    # a series alone in its directory is read from there
+    assert index.get_series_input(uids["ct"]["series"], staging_dir) == os.path.join(root_dir, "PAT-0001", "ct")
+
+    # a series sharing its directory is staged as links (if a staging directory is given)
+    assert index.get_series_input(uids["second"]["series"]) is None
+
+    series_dir = index.get_series_input(uids["second"]["series"], staging_dir)
+    assert series_dir == os.path.join(staging_dir, uids["second"]["series"])
+    assert sorted(os.readlink(os.path.join(series_dir, name)) for name in os.listdir(series_dir)) == \
+           index.files(uids["second"]["series"])
+
+    # stale links are removed (and the links renumbered) once the series changed
+    os.remove(index.files(uids["second"]["series"])[0])
+    index.update(root_dir, verbose = False)
+
+    series_dir = index.get_series_input(uids["second"]["series"], staging_dir)
+    links = sorted(os.listdir(series_dir))
+
+    assert len(links) == 3
+    assert [os.readlink(os.path.join(series_dir, name)) for name in links] == index.files(uids["second"]["series"])
+    assert all(os.path.exists(os.path.join(series_dir, name)) for name in links)
+
+## ----------------------------------------
+
+def test_get_convert_jobs(collection, index, tmp_path):
+
+    root_dir, uids = collection
+    output_dir = str(tmp_path / "nrrd")
+    staging_dir = str(tmp_path / "staging")
+    index.update(root_dir, verbose = False)
+
+    ct_dir = os.path.join(root_dir, "PAT-0001", "ct")
+
+    # without a staging directory, the series sharing their directory are skipped
+    jobs = index.get_convert_jobs(output_dir, verbose = False)
+
+    # (the CT and the RTSTRUCT are ordered by series UID)
+    assert sorted(jobs, key = lambda job: job["input"]) == \
+           [{"input" : ct_dir,
+             "output-img" : os.path.join(output_dir, "PAT-0001", "CT_%s.nrrd"%(uids["ct"]["series"]))},
+            {"input" : index.files(uids["rtstruct"])[0],
+             "referenced-ct" : ct_dir,
+             "output-prefix" : os.path.join(output_dir, "PAT-0001", "RTSTRUCT_%s"%(uids["rtstruct"])),
+             "prefix-format" : "nrrd"}]
+
+    jobs = index.get_convert_jobs(output_dir, staging_dir = staging_dir, output_format = "nii.gz", verbose = False)
+
+    image_jobs = {job["output-img"] : job["input"] for job in jobs if "output-img" in job}
+    assert image_jobs == {os.path.join(output_dir, "PAT-0001", "CT_%s.nii.gz"%(uids["ct"]["series"])) : ct_dir,
+                          os.path.join(output_dir, "PAT-0002", "CT_%s.nii.gz"%(uids["first"]["series"])) :
+                              os.path.join(staging_dir, uids["first"]["series"]),
+                          os.path.join(output_dir, "PAT-0002", "CT_%s.nii.gz"%(uids["second"]["series"])) :
+                              os.path.join(staging_dir, uids["second"]["series"])}
+
+    assert [job["prefix-format"] for job in jobs if "output-prefix" in job] == ["nii.gz"]
+
+    # filters on the modalities
+    assert index.get_convert_jobs(output_dir, modalities = ["MR"], rtstruct = False, verbose = False) == []
+    assert len(index.get_convert_jobs(output_dir, rtstruct = False, verbose = False)) == 1
@@ -0,0 +1,283 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Cohort evaluation drivers
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyplastimatch.utils import eval as pyplaeval
+from pyplastimatch.utils import metrics
+
+from conftest import ellipsoid
+
+SHAPE = (12, 20, 24)
+
+PATIENTS = ["PAT-0001", "PAT-0002", "PAT-0003"]
+STRUCTURES = ["heart", "cord"]
+
+## ----------------------------------------
+
+@pytest.fixture
+def cohort(tmp_path, write_volume):
+
+    """
+    Three patients with two structures each; the "cord" test mask of the last patient is missing.
+    """
+
+    pairs = dict()
+
+    for pat_idx, patient in enumerate(PATIENTS):
+        pairs[patient] = dict()
+
+        for struct_idx, structure in enumerate(STRUCTURES):
+            ref_mask = ellipsoid(SHAPE, (6, 10, 12), (3 + struct_idx, 5, 6))
+            cmp_mask = ellipsoid(SHAPE, (6, 10 + pat_idx, 12), (3, 5 + struct_idx, 6))
+
+            pairs[patient][structure] = (write_volume("%s_%s_ref.nrrd"%(patient, structure), ref_mask),
+                                         write_volume("%s_%s_cmp.nrrd"%(patient, structure), cmp_mask))
+
+    pairs["PAT-0003"]["cord"] = (pairs["PAT-0003"]["cord"][0], os.path.join(str(tmp_path), "missing.nrrd"))
+
+    return pairs
+
+## ----------------------------------------
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_evaluate_cohort_native(cohort, workers):
+
+    cohort_dict = pyplaeval.evaluate_cohort(cohort, workers = workers, backend = "native", verbose = False)
+
+    # nested metric -> patient -> structure layout, in the order of `pairs`
+    assert list(cohort_dict) == ["dice", "hd"]
+    for metric in ["dice", "hd"]:
+        assert list(cohort_dict[metric]) == PATIENTS
+        for patient in PATIENTS:
+            assert list(cohort_dict[metric][patient]) == STRUCTURES
+
+    for patient in PATIENTS:
+        for structure in STRUCTURES:
+            if (patient, structure) == ("PAT-0003", "cord"):
+                continue
+
+            path_to_ref, path_to_cmp = cohort[patient][structure]
+
+            assert cohort_dict["dice"][patient][structure] == metrics.native_dice(path_to_ref, path_to_cmp)
+            assert cohort_dict["hd"][patient][structure] == metrics.native_hd(path_to_ref, path_to_cmp)
+
+    # the failing pair is reported as FAILED_METRIC_DICT, and rendered as a row of NaNs
+    assert cohort_dict["dice"]["PAT-0003"]["cord"] == pyplaeval.FAILED_METRIC_DICT["dice"]
+    assert all(np.isnan(val) for val in cohort_dict["hd"]["PAT-0003"]["cord"].values())
+
+    dc_df = pyplaeval.dc_dict_to_df(cohort_dict["dice"], "cord")
+    hd_df = pyplaeval.hd_dict_to_df(cohort_dict["hd"], "cord")
+
+    assert list(dc_df.index) == PATIENTS and list(hd_df.index) == PATIENTS
+    assert dc_df["dc"].isna().tolist() == [False, False, True]
+    assert hd_df["hd95"].isna().tolist() == [False, False, True]
+
+## ----------------------------------------
+
+def test_iter_cohort_fan_out(cohort, stub_plastimatch):
+
+    results = list(pyplaeval.iter_cohort(cohort, metrics = ["dice"], workers = 2, backend = "cli"))
+
+    # one result per patient/structure pair, whatever the order of completion
+    assert sorted((patient, structure) for patient, structure, _, _, _ in results) == \
+           sorted((patient, structure) for patient in PATIENTS for structure in STRUCTURES)
+
+    for _, _, metric, metric_dict, error in results:
+        assert metric == "dice"
+        assert error is None
+        # value printed by the stub
+        assert metric_dict["dc"] == 0.939273
+
+## ----------------------------------------
+
+def test_iter_cohort_reports_errors(cohort):
+
+    results = pyplaeval.iter_cohort(cohort, metrics = ["hd"], workers = 1, backend = "native")
+
+    errors = {(patient, structure) : error for patient, structure, _, _, error in results}
+
+    assert [key for key, error in errors.items() if error is not None] == [("PAT-0003", "cord")]
+
+## ----------------------------------------
+
+def test_iter_cohort_unknown_metric(cohort):
+
+    with pytest.raises(ValueError):
+        next(pyplaeval.iter_cohort(cohort, metrics = ["jaccard"]))
+
+## ----------------------------------------
+
+@pytest.fixture
+def candidates(tmp_path, write_volume):
+
+    """
+    Reference mask, and candidates: two on the same grid, one on a coarser grid, one unreadable.
+    """
+
+    import SimpleITK as sitk
+
+    path_to_ref = write_volume("ref.nrrd", ellipsoid(SHAPE, (6, 10, 12), (3, 5, 6)))
+
+    candidates = {"shifted" : write_volume("shifted.nrrd", ellipsoid(SHAPE, (6, 11, 13), (3, 5, 6))),
+                  "smaller" : write_volume("smaller.nrrd", ellipsoid(SHAPE, (6, 10, 12), (2, 4, 5)))}
+
+    # same physical extent, half the resolution in-plane
+    coarse_img = sitk.ReadImage(candidates["shifted"])
+    coarse_img = sitk.Resample(coarse_img, [SHAPE[2]//2, SHAPE[1]//2, SHAPE[0]], sitk.Transform(),
+                               sitk.sitkNearestNeighbor, coarse_img.GetOrigin(),
+                               [2*coarse_img.GetSpacing()[0], 2*coarse_img.GetSpacing()[1], coarse_img.GetSpacing()[2]],
+                               coarse_img.GetDirection())
+    candidates["coarse"] = str(tmp_path / "coarse.nrrd")
+    sitk.WriteImage(coarse_img, candidates["coarse"])
+
+    candidates["unreadable"] = str(tmp_path / "unreadable.nrrd")
+    with open(candidates["unreadable"], "wb") as f:
+        f.write(b"not an image")
+
+    return path_to_ref, candidates
+
+## ----------------------------------------
+
+@pytest.mark.parametrize("workers, shared_memory", [(1, True), (2, True), (2, False)])
+def test_evaluate_candidates(candidates, workers, shared_memory, monkeypatch):
+
+    import sys
+
+    if not shared_memory:
+        # as on Python 3.7, where multiprocessing.shared_memory does not exist
+        monkeypatch.setitem(sys.modules, "multiprocessing.shared_memory", None)
+
+    path_to_ref, candidates = candidates
+
+    df = pyplaeval.evaluate_candidates(path_to_ref, candidates, metrics = ["dice", "hd", "compare"],
+                                       workers = workers, verbose = False)
+
+    assert list(df.index) == ["shifted", "smaller", "coarse", "unreadable"]
+
+    for name in ["shifted", "smaller", "coarse"]:
+        dice_dict = metrics.native_dice(path_to_ref, candidates[name])
+        hd_dict = metrics.native_hd(path_to_ref, candidates[name])
+
+        assert df.loc[name, "dc"] == pytest.approx(dice_dict["dc"])
+        assert [df.loc[name, "com_cmp_x%d"%(idx)] for idx in range(3)] == pytest.approx(dice_dict["com"]["cmp"])
+
+        for key, val in hd_dict.items():
+            assert df.loc[name, key] == pytest.approx(val)
+
+    for name in ["shifted", "smaller"]:
+        assert pd.isna(df.loc[name, "error"])
+
+        for key, val in metrics.native_compare(path_to_ref, candidates[name]).items():
+            assert df.loc[name, key] == pytest.approx(val)
+
+    # "compare" needs matching grids: only that metric fails for the coarse candidate
+    assert df.loc["coarse", "error"].startswith("compare: ")
+    assert np.isnan(df.loc["coarse", "MAE"])
+
+    # an unreadable candidate gets a row of NaNs, and the read error
+    assert df.loc["unreadable", "error"].startswith("read: ")
+    assert df.loc["unreadable", ["dc", "hd", "MAE"]].isna().all()
+
+## ----------------------------------------
+
+def test_evaluate_candidates_unknown_metric(candidates):
+
+    with pytest.raises(ValueError):
+        pyplaeval.evaluate_candidates(candidates[0], candidates[1], metrics = ["jaccard"], verbose = False)
+
+## ----------------------------------------
+
+# results formatted like the output of `evaluate_cohort` (values printed by plastimatch)
+COHORT_DICT = {"dice" : {"LUNG1-001" : {"heart" : {"com" : {"ref" : [35.0662, -47.6561, -34.145],
+                                                            "cmp" : [35.0477, -49.1853, -34.787]},
+                                                   "dc" : 0.939273},
+                                        "esophagus" : dict()},
+                         "LUNG1-002" : {"heart" : {"com" : {"ref" : [10.0202, -1.10146, 29.832],
+                                                            "cmp" : [7.15864, 2.45604, 34.21]},
+                                                   "dc" : 0.745591}}},
+               "hd" : {"LUNG1-001" : {"heart" : {"hd" : 8.999999, "hd95" : 1.5,
+                                                 "hd_boundaries" : 8.999999, "hd95_boundaries" : 7.373553},
+                                      "esophagus" : dict(pyplaeval.FAILED_METRIC_DICT["hd"])}}}
+
+def test_cohort_dict_to_long_df():
+
+    long_df = pyplaeval.cohort_dict_to_long_df(COHORT_DICT)
+
+    assert list(long_df.columns) == ["patient", "structure", "metric", "value"]
+    for col in ["patient", "structure", "metric"]:
+        assert isinstance(long_df[col].dtype, pd.CategoricalDtype)
+    assert long_df["value"].dtype == np.float64
+
+    # 7 dice values per pair (including the failed one), 4 hd values per pair
+    assert len(long_df) == 3*7 + 2*4
+    assert list(long_df["patient"].cat.categories) == ["LUNG1-001", "LUNG1-002"]
+    assert list(long_df["structure"].cat.categories) == ["heart", "esophagus"]
+
+    # same values as the wide Dataframes
+    dc_df = pyplaeval.dc_dict_to_df(COHORT_DICT["dice"], "heart")
+    heart_df = long_df[long_df["structure"] == "heart"]
+
+    for patient in ["LUNG1-001", "LUNG1-002"]:
+        patient_values = heart_df[heart_df["patient"] == patient].set_index("metric")["value"]
+        for col in dc_df.columns:
+            assert patient_values[col] == dc_df.loc[patient, col]
+
+    assert heart_df.set_index(["patient", "metric"]).loc[("LUNG1-001", "hd95"), "value"] == 1.5
+
+    # failures are reported as NaN values, under the usual metric names
+    failed_df = long_df[long_df["structure"] == "esophagus"]
+    assert failed_df["value"].isna().all()
+    assert sorted(failed_df["metric"].astype(str)) == sorted(pyplaeval.LONG_FORMAT_KEYS["dice"] +
+                                                             pyplaeval.LONG_FORMAT_KEYS["hd"])
+
+## ----------------------------------------
+
+def test_write_long_parquet(tmp_path):
+
+    pytest.importorskip("pyarrow")
+
+    path_to_dataset = str(tmp_path / "results")
+    long_df = pyplaeval.cohort_dict_to_long_df(COHORT_DICT)
+
+    pyplaeval.write_long_parquet(long_df, path_to_dataset)
+    assert sorted(os.listdir(path_to_dataset)) == ["structure=esophagus", "structure=heart"]
+
+    # partitions can be read on their own
+    heart_df = pd.read_parquet(path_to_dataset, filters = [("structure", "in", ["heart"])])
+    assert len(heart_df) == (long_df["structure"] == "heart").sum()
+
+    def _sorted_values(df):
+        df = df.astype({"patient" : str, "structure" : str, "metric" : str})
+        return df.sort_values(["patient", "structure", "metric"]).reset_index(drop = True)[long_df.columns]
+
+    pd.testing.assert_frame_equal(_sorted_values(pd.read_parquet(path_to_dataset)), _sorted_values(long_df))
+
+    # appending adds files, overwriting replaces the dataset
+    pyplaeval.write_long_parquet(long_df, path_to_dataset)
+    assert len(pd.read_parquet(path_to_dataset)) == 2*len(long_df)
+
+    pyplaeval.write_long_parquet(long_df[long_df["metric"] == "dc"], path_to_dataset, overwrite = True)
+    read_df = pd.read_parquet(path_to_dataset)
+    assert len(read_df) == 3 and set(read_df["metric"].astype(str)) == {"dc"}
+
+    # partitioned by several columns
+    path_to_nested_dataset = str(tmp_path / "nested")
+    pyplaeval.write_long_parquet(long_df, path_to_nested_dataset, partition_cols = ("structure", "patient"))
+    assert sorted(os.listdir(os.path.join(path_to_nested_dataset, "structure=heart"))) == \
+           ["patient=LUNG1-001", "patient=LUNG1-002"]
@@ -0,0 +1,116 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    In-memory wrappers: images staged in a scratch directory and read back
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import tempfile
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from pyplastimatch.utils import images
+
+from conftest import SPACING, ORIGIN, ellipsoid
+
+SHAPE = (12, 20, 24)
+
+# oblique direction cosines (rotation around z), x, y, z order
+DIRECTION = (0.0, -1.0, 0.0,
+             1.0, 0.0, 0.0,
+             0.0, 0.0, 1.0)
+
+## ----------------------------------------
+
+@pytest.fixture
+def scratch_dir(tmp_path, monkeypatch):
+
+    path_to_scratch_dir = tmp_path / "scratch"
+    path_to_scratch_dir.mkdir()
+
+    monkeypatch.setenv("PYPLASTIMATCH_SCRATCH_DIR", str(path_to_scratch_dir))
+
+    return path_to_scratch_dir
+
+## ----------------------------------------
+
+@pytest.mark.parametrize("wrapper", [images.convert_image, images.resample_image])
+def test_array_round_trip(wrapper, scratch_dir, stub_plastimatch, tmp_path):
+
+    # the stub copies the input to the output: what comes back is what was staged
+    arr = 7*ellipsoid(SHAPE, (6, 10, 12), (3, 5, 6)).astype(np.int16) - 1000
+    path_to_log_file = str(tmp_path / "plastimatch.log")
+
+    output_img = wrapper(arr, input_spacing = SPACING, input_origin = ORIGIN, input_direction = DIRECTION,
+                         path_to_log_file = path_to_log_file)
+
+    assert isinstance(output_img, sitk.Image)
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(output_img), arr)
+    assert output_img.GetPixelID() == sitk.sitkInt16
+    assert output_img.GetSpacing() == pytest.approx(SPACING)
+    assert output_img.GetOrigin() == pytest.approx(ORIGIN)
+    assert output_img.GetDirection() == pytest.approx(DIRECTION)
+
+    # the files were staged in the scratch directory, which is empty again
+    with open(path_to_log_file, "r") as f:
+        assert "Loading %s"%(os.path.join(str(scratch_dir), "")) in f.read()
+    assert os.listdir(str(scratch_dir)) == []
+
+## ----------------------------------------
+
+def test_image_arguments_are_staged(scratch_dir, stub_plastimatch):
+
+    input_img = images.to_sitk_image(np.ones(SHAPE, dtype = np.float32), spacing = SPACING, origin = ORIGIN)
+
+    # e.g., the fixed image of 'plastimatch resample'
+    output_arr = images.resample_image(input_img, return_array = True, fixed = np.zeros(SHAPE, dtype = np.uint8),
+                                       interpolation = "nn")
+
+    assert isinstance(output_arr, np.ndarray)
+    np.testing.assert_array_equal(output_arr, np.ones(SHAPE, dtype = np.float32))
+
+    # the geometry of the image of the caller is left untouched when overridden
+    overridden_img = images.convert_image(input_img, input_spacing = (1.0, 1.0, 1.0))
+
+    assert overridden_img.GetSpacing() == (1.0, 1.0, 1.0)
+    assert input_img.GetSpacing() == pytest.approx(SPACING)
+    assert os.listdir(str(scratch_dir)) == []
+
+## ----------------------------------------
+
+def test_scratch_dir_removed_on_failure(scratch_dir, tmp_path, monkeypatch):
+
+    # no plastimatch executable at all
+    monkeypatch.setenv("PATH", str(tmp_path))
+
+    with pytest.raises(OSError):
+        images.convert_image(np.zeros(SHAPE, dtype = np.uint8))
+
+    assert os.listdir(str(scratch_dir)) == []
+
+## ----------------------------------------
+
+def test_scratch_dir_selection(tmp_path, monkeypatch):
+
+    monkeypatch.setenv("PYPLASTIMATCH_SCRATCH_DIR", str(tmp_path))
+    assert images.get_scratch_dir() == str(tmp_path)
+
+    monkeypatch.delenv("PYPLASTIMATCH_SCRATCH_DIR")
+    assert images.get_scratch_dir() in (images.TMPFS_DIR, tempfile.gettempdir())
+
+## ----------------------------------------
+
+def test_unsupported_image_type():
+
+    with pytest.raises(TypeError):
+        images.to_sitk_image([[0, 1], [1, 0]])
@@ -0,0 +1,94 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Import-time regression tests
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+# packages `import pyplastimatch` must not import (see `pyplastimatch.utils`)
+HEAVY_MODULES = ["numpy", "pandas", "SimpleITK", "requests"]
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+## ----------------------------------------
+
+def _run_python(code):
+
+    """
+    Run `code` in a fresh interpreter (so that the modules imported by the tests do not count),
+    and return what it printed as JSON.
+    """
+
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join([REPO_DIR, os.environ.get("PYTHONPATH", "")]))
+    output = subprocess.run([sys.executable, "-c", code], env = env, check = True,
+                            capture_output = True, text = True).stdout
+
+    return json.loads(output)
+
+## ----------------------------------------
+
+def test_import_does_not_load_heavy_modules():
+
+    loaded = _run_python("import sys, json; import pyplastimatch; "
+                         "print(json.dumps([name for name in %r if name in sys.modules]))"%(HEAVY_MODULES))
+
+    assert loaded == []
+
+## ----------------------------------------
+
+def test_star_import_exports():
+
+    exported = _run_python("import json; namespace = dict(); exec('from pyplastimatch import *', namespace); "
+                           "print(json.dumps(sorted(namespace)))")
+
+    for name in ["save_binary_segmask", "dc_dict_to_df", "hd_dict_to_df", "install_precompiled_binaries",
+                 "convert", "dice"]:
+        assert name in exported
+
+## ----------------------------------------
+
+def test_lazy_attributes():
+
+    import pyplastimatch as pypla
+
+    assert callable(pypla.save_binary_segmask)
+    assert pypla.utils.save_binary_segmask is pypla.save_binary_segmask
+
+    with pytest.raises(AttributeError):
+        pypla.not_a_utility
+
+## ----------------------------------------
+
+def test_lazy_utils_submodules():
+
+    # imported on access, and not by `import pyplastimatch` (see test_import_does_not_load_heavy_modules)
+    loaded = _run_python("import sys, json; import pyplastimatch as pypla; "
+                         "before = [name for name in ('pyplastimatch.utils.data', 'pyplastimatch.utils.eval') "
+                         "if name in sys.modules]; pypla.eval; "
+                         "print(json.dumps([before, 'pyplastimatch.utils.eval' in sys.modules]))")
+
+    assert loaded == [[], True]
+
+    import pyplastimatch as pypla
+    from pyplastimatch.utils import data, eval, install
+
+    assert pypla.data is data
+    assert pypla.eval is eval
+    assert pypla.install is install
+
+    for name in ["data", "eval", "install"]:
+        assert name in dir(pypla)
@@ -0,0 +1,142 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Release asset download cache and mirrors
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import json
+import hashlib
+import pathlib
+
+import pytest
+import requests
+
+from pyplastimatch.utils import install
+
+ASSET_CONTENT = b"plastimatch binaries"
+
+## ----------------------------------------
+
+@pytest.fixture
+def mirror_dir(tmp_path):
+
+    path_to_asset = tmp_path / "mirror" / "v1" / "plastimatch-ubuntu_22_04"
+    path_to_asset.parent.mkdir(parents = True)
+    path_to_asset.write_bytes(ASSET_CONTENT)
+
+    (tmp_path / "mirror" / "v1" / "plastimatch-ubuntu_22_04.sha256").write_text(
+        hashlib.sha256(ASSET_CONTENT).hexdigest() + "  plastimatch-ubuntu_22_04\n")
+
+    return tmp_path / "mirror"
+
+## ----------------------------------------
+
+@pytest.fixture
+def releases_api(monkeypatch):
+
+    """
+    Replace the GitHub releases API with a canned answer, counting the queries.
+    """
+
+    queries = list()
+
+    class _Response:
+        def json(self):
+            return [{"tag_name" : "v%d"%(len(queries)), "assets" : []}]
+
+    def _get(url, **kwargs):
+        queries.append(url)
+        return _Response()
+
+    monkeypatch.setattr(install.requests, "get", _get)
+
+    return queries
+
+## ----------------------------------------
+
+@pytest.mark.parametrize("as_url", [False, True])
+def test_fetch_from_local_mirror(mirror_dir, tmp_path, as_url):
+
+    mirror = pathlib.Path(mirror_dir).as_uri() if as_url else str(mirror_dir)
+    cache_dir = str(tmp_path / "cache")
+
+    path_to_asset = install.fetch_release_asset("plastimatch-ubuntu_22_04", tag = "v1", mirror = mirror,
+                                                cache_dir = cache_dir)
+
+    assert path_to_asset == os.path.join(cache_dir, "v1", "plastimatch-ubuntu_22_04")
+    assert open(path_to_asset, "rb").read() == ASSET_CONTENT
+
+## ----------------------------------------
+
+def test_checksum_mismatch(mirror_dir, tmp_path):
+
+    (mirror_dir / "v1" / "plastimatch-ubuntu_22_04.sha256").write_text("0"*64 + "\n")
+
+    with pytest.raises(ValueError):
+        install.fetch_release_asset("plastimatch-ubuntu_22_04", tag = "v1", mirror = str(mirror_dir),
+                                    cache_dir = str(tmp_path / "cache"))
+
+    assert not os.path.exists(tmp_path / "cache" / "v1" / "plastimatch-ubuntu_22_04")
+
+## ----------------------------------------
+
+def test_corrupted_cache_is_fetched_again(mirror_dir, tmp_path):
+
+    kwargs = {"tag" : "v1", "mirror" : str(mirror_dir), "cache_dir" : str(tmp_path / "cache")}
+    path_to_asset = install.fetch_release_asset("plastimatch-ubuntu_22_04", **kwargs)
+
+    with open(path_to_asset, "wb") as f:
+        f.write(b"truncated")
+
+    install.fetch_release_asset("plastimatch-ubuntu_22_04", **kwargs)
+
+    assert open(path_to_asset, "rb").read() == ASSET_CONTENT
+
+## ----------------------------------------
+
+def test_latest_release_info_expires(tmp_path, releases_api):
+
+    cache_dir = str(tmp_path / "cache")
+
+    assert install.get_release_info(cache_dir = cache_dir)["tag_name"] == "v1"
+    assert install.get_release_info(cache_dir = cache_dir)["tag_name"] == "v1"
+    assert len(releases_api) == 1
+
+    # older than RELEASE_INFO_MAX_AGE
+    path_to_release_json = os.path.join(cache_dir, "release_latest.json")
+    expired = os.path.getmtime(path_to_release_json) - install.RELEASE_INFO_MAX_AGE - 1
+    os.utime(path_to_release_json, (expired, expired))
+
+    assert install.get_release_info(cache_dir = cache_dir)["tag_name"] == "v2"
+    assert len(releases_api) == 2
+
+    # never expires
+    os.utime(path_to_release_json, (expired, expired))
+    assert install.get_release_info(cache_dir = cache_dir, max_age = None)["tag_name"] == "v2"
+
+## ----------------------------------------
+
+def test_expired_release_info_offline(tmp_path, monkeypatch):
+
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+
+    path_to_release_json = cache_dir / "release_latest.json"
+    path_to_release_json.write_text(json.dumps({"tag_name" : "v1", "assets" : {}}))
+    os.utime(path_to_release_json, (0, 0))
+
+    def _offline(url, **kwargs):
+        raise requests.ConnectionError("offline")
+
+    monkeypatch.setattr(install.requests, "get", _offline)
+
+    assert install.get_release_info(cache_dir = str(cache_dir))["tag_name"] == "v1"
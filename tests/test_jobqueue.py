@@ -0,0 +1,202 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    SQLite job queue and workers
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import sys
+import sqlite3
+import subprocess
+
+import pytest
+
+from pyplastimatch import jobqueue
+from pyplastimatch.__main__ import main
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+## ----------------------------------------
+
+@pytest.fixture
+def job_queue(tmp_path):
+
+    return jobqueue.JobQueue(str(tmp_path / "queue.sqlite"))
+
+## ----------------------------------------
+
+def test_claim_order(job_queue):
+
+    low_id = job_queue.enqueue("dice", path_to_reference_img = "a", path_to_test_img = "b")
+    high_id = job_queue.enqueue("hd", priority = 1, path_to_reference_img = "a", path_to_test_img = "b")
+
+    assert job_queue.claim("w1")["id"] == high_id
+
+    job = job_queue.claim("w1")
+    assert (job["id"], job["status"], job["attempts"], job["worker"]) == (low_id, "running", 1, "w1")
+    assert job["kwargs"] == {"path_to_reference_img" : "a", "path_to_test_img" : "b"}
+
+    assert job_queue.claim("w1") is None
+
+## ----------------------------------------
+
+def test_unknown_kind(job_queue):
+
+    with pytest.raises(ValueError):
+        job_queue.enqueue("register")
+
+## ----------------------------------------
+
+def test_lease_expiry(job_queue):
+
+    job_id = job_queue.enqueue("compare", path_to_reference_img = "a", path_to_test_img = "b")
+
+    # a lease already expired, as if the worker stopped sending heartbeats
+    job_queue.claim("w1", lease_time = -1)
+
+    job = job_queue.claim("w2")
+    assert (job["id"], job["worker"], job["attempts"]) == (job_id, "w2", 2)
+
+    # the first worker lost the job: its heartbeats and outcome are discarded
+    assert not job_queue.heartbeat(job_id, "w1")
+    assert not job_queue.complete(job_id, {"dc" : 0.5}, "w1")
+
+    assert job_queue.heartbeat(job_id, "w2")
+    assert job_queue.complete(job_id, {"dc" : 0.9}, "w2")
+    assert job_queue.get_job(job_id)["result"] == {"dc" : 0.9}
+
+## ----------------------------------------
+
+def test_lease_expiry_on_last_attempt(job_queue):
+
+    job_id = job_queue.enqueue("compare", max_attempts = 1, path_to_reference_img = "a", path_to_test_img = "b")
+    job_queue.claim("w1", lease_time = -1)
+
+    assert job_queue.claim("w2") is None
+
+    job = job_queue.get_job(job_id)
+    assert job["status"] == "failed" and "lease expired" in job["error"]
+
+## ----------------------------------------
+
+def test_fail_and_retry_failed(job_queue):
+
+    job_id = job_queue.enqueue("dice", max_attempts = 2, path_to_reference_img = "a", path_to_test_img = "b")
+
+    job_queue.claim("w1")
+    assert job_queue.fail(job_id, "first error", "w1")
+    assert job_queue.get_job(job_id)["status"] == "pending"
+
+    job_queue.claim("w1")
+    job_queue.fail(job_id, "second error", "w1")
+    assert job_queue.counts() == {"pending" : 0, "running" : 0, "done" : 0, "failed" : 1}
+    assert job_queue.jobs(status = "failed")[0]["error"] == "second error"
+
+    assert job_queue.retry_failed() == 1
+
+    job = job_queue.claim("w1")
+    assert (job["id"], job["attempts"], job["max_attempts"]) == (job_id, 3, 3)
+
+## ----------------------------------------
+
+def test_run_worker(job_queue, tmp_path, stub_plastimatch):
+
+    path_to_input = tmp_path / "input.nrrd"
+    path_to_input.write_bytes(b"voxels")
+
+    convert_id = job_queue.enqueue("convert", input = str(path_to_input), **{"output-img" : str(tmp_path / "out.nrrd")})
+    dice_id = job_queue.enqueue("dice", path_to_reference_img = "a", path_to_test_img = "b")
+    failing_id = job_queue.enqueue("dice", max_attempts = 1, backend = "native",
+                                   path_to_reference_img = str(tmp_path / "missing.nrrd"),
+                                   path_to_test_img = str(tmp_path / "missing.nrrd"))
+
+    assert jobqueue.run_worker(job_queue.path_to_db, exit_when_empty = True, verbose = False) == 3
+
+    assert job_queue.get_job(convert_id)["status"] == "done"
+    assert (tmp_path / "out.nrrd").read_bytes() == b"voxels"
+
+    # values printed by the stub
+    assert job_queue.get_job(dice_id)["result"]["dc"] == 0.939273
+
+    assert job_queue.get_job(failing_id)["status"] == "failed"
+
+## ----------------------------------------
+
+def test_status_command(job_queue, capsys):
+
+    job_queue.enqueue("dice", path_to_reference_img = "a", path_to_test_img = "b")
+
+    assert main(["status", job_queue.path_to_db]) == 0
+    assert "pending  1" in capsys.readouterr().out
+
+## ----------------------------------------
+
+def test_heartbeat_errors_are_retried(job_queue, stub_plastimatch, monkeypatch, capsys):
+
+    # the job outlives its lease several times over: it is only kept through the heartbeats
+    monkeypatch.setenv("PLASTIMATCH_STUB_DELAY", "0.6")
+
+    heartbeat = jobqueue.JobQueue.heartbeat
+    outcomes = list()
+
+    def _flaky_heartbeat(self, *args, **kwargs):
+        # the first two heartbeats fail
+        if len(outcomes) < 2:
+            outcomes.append("error")
+            raise sqlite3.OperationalError("database is locked")
+        outcomes.append(heartbeat(self, *args, **kwargs))
+        return outcomes[-1]
+
+    monkeypatch.setattr(jobqueue.JobQueue, "heartbeat", _flaky_heartbeat)
+
+    job_id = job_queue.enqueue("dice", path_to_reference_img = "a", path_to_test_img = "b")
+
+    assert jobqueue.run_worker(job_queue.path_to_db, lease_time = 0.3, exit_when_empty = True) == 1
+
+    # the thread survived the errors, and renewed the lease afterwards
+    assert outcomes[:2] == ["error", "error"] and outcomes[2] is True
+    assert job_queue.get_job(job_id)["status"] == "done"
+
+    output = capsys.readouterr().out
+    assert output.count("Heartbeat of job %d failed, retrying: database is locked"%(job_id)) == 2
+    assert "lease lost" not in output
+
+## ----------------------------------------
+
+def test_concurrent_workers_run_each_job_once(job_queue, tmp_path, stub_plastimatch, monkeypatch):
+
+    monkeypatch.setenv("PLASTIMATCH_STUB_DELAY", "0.05")
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join([REPO_DIR, os.environ.get("PYTHONPATH", "")]))
+
+    path_to_input = tmp_path / "input.nrrd"
+    path_to_input.write_bytes(b"voxels")
+
+    # every run of a job appends a "Loading" line to the log of the job
+    job_ids = job_queue.enqueue_many([{"kind" : "convert", "input" : str(path_to_input),
+                                       "output-img" : str(tmp_path / ("out_%02d.nrrd"%(idx))),
+                                       "path_to_log_file" : str(tmp_path / ("job_%02d.log"%(idx)))}
+                                      for idx in range(16)])
+
+    # independent worker processes, as started on different hosts
+    workers = [subprocess.Popen([sys.executable, "-m", "pyplastimatch", "worker", job_queue.path_to_db,
+                                 "--exit-when-empty", "--quiet", "--poll-interval", "0.05"])
+               for _ in range(3)]
+
+    assert [worker.wait(timeout = 120) for worker in workers] == [0, 0, 0]
+
+    jobs = job_queue.jobs()
+
+    assert [job["id"] for job in jobs] == job_ids
+    assert all(job["status"] == "done" and job["attempts"] == 1 for job in jobs)
+    assert len({job["worker"] for job in jobs}) > 1
+
+    for idx in range(16):
+        assert (tmp_path / ("job_%02d.log"%(idx))).read_text().count("Loading ") == 1
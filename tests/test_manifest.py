@@ -0,0 +1,120 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Incremental convert (conversion manifest)
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import json
+
+import pytest
+
+import pyplastimatch as pypla
+from pyplastimatch.utils import manifest
+
+## ----------------------------------------
+
+@pytest.fixture
+def convert_kwargs(tmp_path, stub_plastimatch):
+
+    path_to_input = tmp_path / "input.nrrd"
+    path_to_input.write_bytes(b"voxels")
+
+    return {"input" : str(path_to_input), "output-img" : str(tmp_path / "output.nrrd")}
+
+## ----------------------------------------
+
+def _convert(convert_kwargs, **kwargs):
+
+    # the stand-in copies the input to the output; None means the conversion was skipped
+    return pypla.convert(verbose = False, incremental = True, **kwargs, **convert_kwargs)
+
+## ----------------------------------------
+
+def test_skip_and_force(convert_kwargs):
+
+    assert _convert(convert_kwargs) is not None
+    assert os.path.isfile(manifest.get_manifest_path(convert_kwargs))
+
+    assert _convert(convert_kwargs) is None
+    assert _convert(convert_kwargs, force = True) is not None
+
+## ----------------------------------------
+
+def test_changed_input_is_converted_again(convert_kwargs):
+
+    _convert(convert_kwargs)
+
+    with open(convert_kwargs["input"], "wb") as f:
+        f.write(b"new voxels")
+
+    assert not manifest.is_up_to_date(convert_kwargs)
+    assert _convert(convert_kwargs) is not None
+
+## ----------------------------------------
+
+def test_missing_output_is_converted_again(convert_kwargs):
+
+    _convert(convert_kwargs)
+    os.remove(convert_kwargs["output-img"])
+
+    assert _convert(convert_kwargs) is not None
+    assert os.path.isfile(convert_kwargs["output-img"])
+
+## ----------------------------------------
+
+def test_changed_arguments_are_converted_again(convert_kwargs):
+
+    _convert(convert_kwargs)
+
+    assert _convert(dict(convert_kwargs, **{"output-type" : "float"})) is not None
+
+## ----------------------------------------
+
+def test_touched_input_with_hashes(convert_kwargs):
+
+    _convert(convert_kwargs, hash_inputs = True)
+
+    # same content, new modification time
+    file_stat = os.stat(convert_kwargs["input"])
+    os.utime(convert_kwargs["input"], ns = (file_stat.st_atime_ns, file_stat.st_mtime_ns + 10**9))
+
+    assert not manifest.is_up_to_date(convert_kwargs)
+    assert manifest.is_up_to_date(convert_kwargs, hash_inputs = True)
+
+## ----------------------------------------
+
+def test_convert_many_reports_skipped_jobs(convert_kwargs):
+
+    results = pypla.convert_many([convert_kwargs], verbose = False, incremental = True)
+    assert not results[0]["skipped"] and results[0]["error"] is None
+
+    results = pypla.convert_many([convert_kwargs], verbose = False, incremental = True)
+    assert results[0]["skipped"]
+
+## ----------------------------------------
+
+def test_convert_many_touched_input_with_hashes(convert_kwargs):
+
+    pypla.convert_many([convert_kwargs], verbose = False, incremental = True, hash_inputs = True)
+
+    with open(manifest.get_manifest_path(convert_kwargs), "r") as f:
+        assert all("sha256" in identity for identity in json.load(f)["inputs"].values())
+
+    # same content, new modification time
+    file_stat = os.stat(convert_kwargs["input"])
+    os.utime(convert_kwargs["input"], ns = (file_stat.st_atime_ns, file_stat.st_mtime_ns + 10**9))
+
+    results = pypla.convert_many([convert_kwargs], verbose = False, incremental = True, hash_inputs = True)
+    assert results[0]["skipped"]
+
+    results = pypla.convert_many([convert_kwargs], verbose = False, incremental = True)
+    assert not results[0]["skipped"]
@@ -0,0 +1,188 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Native Dice engine vs. the CLI parser and a direct NumPy computation
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import numpy as np
+import pytest
+
+import pyplastimatch as pypla
+from pyplastimatch.utils import metrics
+
+from conftest import SPACING, ORIGIN, ellipsoid
+
+SHAPE = (24, 40, 48)
+
+## ----------------------------------------
+
+def _numpy_dice(ref_mask, cmp_mask):
+
+    return 2*np.sum(ref_mask & cmp_mask) / (np.sum(ref_mask) + np.sum(cmp_mask))
+
+def _numpy_com(mask):
+
+    # mean (z, y, x) index, mapped to physical (x, y, z) coordinates (identity direction)
+    return np.array(ORIGIN) + np.argwhere(mask).mean(axis = 0)[::-1] * np.array(SPACING)
+
+## ----------------------------------------
+
+@pytest.fixture
+def masks(write_volume):
+
+    ref_mask = ellipsoid(SHAPE, (12, 20, 24), (8, 12, 15))
+    cmp_mask = ellipsoid(SHAPE, (13, 18, 26), (7, 13, 14))
+
+    return ref_mask, cmp_mask, write_volume("ref.nrrd", ref_mask), write_volume("cmp.nrrd", cmp_mask)
+
+## ----------------------------------------
+
+def test_native_dice_matches_numpy(masks):
+
+    ref_mask, cmp_mask, path_to_ref, path_to_cmp = masks
+
+    dice_dict = metrics.native_dice(path_to_ref, path_to_cmp)
+
+    assert dice_dict["dc"] == pytest.approx(_numpy_dice(ref_mask, cmp_mask))
+    assert dice_dict["com"]["ref"] == pytest.approx(_numpy_com(ref_mask))
+    assert dice_dict["com"]["cmp"] == pytest.approx(_numpy_com(cmp_mask))
+
+## ----------------------------------------
+
+def test_native_dice_matches_cli_layout(masks, stub_plastimatch):
+
+    _, _, path_to_ref, path_to_cmp = masks
+
+    cli_dict = pypla.dice(path_to_ref, path_to_cmp, verbose = False, backend = "cli")
+    native_dict = pypla.dice(path_to_ref, path_to_cmp, verbose = False, backend = "native")
+
+    # values printed by the stub
+    assert cli_dict == {"com" : {"ref" : [35.0662, -47.6561, -34.145],
+                                 "cmp" : [35.0477, -49.1853, -34.787]},
+                        "dc" : 0.939273}
+
+    # same layout, so that e.g. dc_dict_to_df works with both backends
+    assert native_dict.keys() == cli_dict.keys()
+    assert native_dict["com"].keys() == cli_dict["com"].keys()
+
+    for key in ["ref", "cmp"]:
+        assert len(native_dict["com"][key]) == 3
+        assert all(isinstance(val, float) for val in native_dict["com"][key])
+
+    assert isinstance(native_dict["dc"], float)
+
+## ----------------------------------------
+
+def test_multilabel_dice_sparse_labels(write_volume):
+
+    ref_arr = np.zeros(SHAPE, dtype = np.uint16)
+    cmp_arr = np.zeros(SHAPE, dtype = np.uint16)
+
+    ref_arr[ellipsoid(SHAPE, (12, 20, 12), (6, 8, 8)) > 0] = 3
+    ref_arr[ellipsoid(SHAPE, (12, 20, 34), (6, 8, 8)) > 0] = 65535
+    cmp_arr[ellipsoid(SHAPE, (12, 21, 13), (6, 8, 8)) > 0] = 3
+    cmp_arr[ellipsoid(SHAPE, (12, 19, 33), (6, 8, 8)) > 0] = 65535
+
+    path_to_ref = write_volume("ref_labels.nrrd", ref_arr)
+    path_to_cmp = write_volume("cmp_labels.nrrd", cmp_arr)
+
+    dice_dict = metrics.multilabel_dice(path_to_ref, path_to_cmp)
+
+    assert list(dice_dict) == [3, 65535]
+
+    for label in [3, 65535]:
+        assert dice_dict[label]["dc"] == pytest.approx(_numpy_dice(ref_arr == label, cmp_arr == label))
+        assert dice_dict[label]["com"]["ref"] == pytest.approx(_numpy_com(ref_arr == label))
+
+    # labels missing from both images
+    missing_dict = metrics.multilabel_dice(path_to_ref, path_to_cmp, labels = [7])[7]
+
+    assert np.isnan(missing_dict["dc"])
+    assert np.all(np.isnan(missing_dict["com"]["ref"]))
+
+## ----------------------------------------
+
+# small grid with strongly anisotropic voxels, so that the brute-force reference stays cheap
+HD_SHAPE = (10, 16, 20)
+HD_SPACING = (0.7, 1.1, 3.0)
+
+def _brute_force_hd(ref_mask, cmp_mask, spacing, percentile = 95):
+
+    from scipy.spatial.distance import cdist
+
+    # voxel centres in mm, (z, y, x) indices scaled by the (x, y, z) spacing
+    ref_points = np.argwhere(ref_mask) * np.array(spacing[::-1])
+    cmp_points = np.argwhere(cmp_mask) * np.array(spacing[::-1])
+
+    dist = cdist(ref_points, cmp_points)
+    dist_ab, dist_ba = dist.min(axis = 1), dist.min(axis = 0)
+
+    return (max(dist_ab.max(), dist_ba.max()),
+            max(np.percentile(dist_ab, percentile), np.percentile(dist_ba, percentile)))
+
+def _brute_force_boundary(mask):
+
+    from scipy import ndimage
+
+    # 6-connected erosion, voxels outside of the grid count as background
+    return mask & ~ndimage.binary_erosion(mask, structure = ndimage.generate_binary_structure(3, 1),
+                                          border_value = 0)
+
+## ----------------------------------------
+
+@pytest.mark.parametrize("offset", [(0, 0, 0), (1, -2, 3), (-3, 0, -1)])
+def test_native_hd_matches_brute_force(write_volume, offset):
+
+    ref_mask = ellipsoid(HD_SHAPE, (5, 8, 9), (3, 5, 6)) > 0
+    cmp_mask = ellipsoid(HD_SHAPE, (5 + offset[0], 8 + offset[1], 10 + offset[2]), (2, 6, 5)) > 0
+
+    # a mask touching the edge of the grid, where the boundary is the grid border
+    cmp_mask[:, :, 0] |= ref_mask[:, :, 9]
+
+    path_to_ref = write_volume("ref.nrrd", ref_mask.astype(np.uint8), spacing = HD_SPACING)
+    path_to_cmp = write_volume("cmp.nrrd", cmp_mask.astype(np.uint8), spacing = HD_SPACING)
+
+    hd_dict = metrics.native_hd(path_to_ref, path_to_cmp)
+
+    hd, hd95 = _brute_force_hd(ref_mask, cmp_mask, HD_SPACING)
+    hd_boundaries, hd95_boundaries = _brute_force_hd(_brute_force_boundary(ref_mask),
+                                                     _brute_force_boundary(cmp_mask), HD_SPACING)
+
+    assert hd_dict["hd"] == pytest.approx(hd, abs = 1e-4)
+    assert hd_dict["hd95"] == pytest.approx(hd95, abs = 1e-4)
+    assert hd_dict["hd_boundaries"] == pytest.approx(hd_boundaries, abs = 1e-4)
+    assert hd_dict["hd95_boundaries"] == pytest.approx(hd95_boundaries, abs = 1e-4)
+
+## ----------------------------------------
+
+def test_native_hd_empty_mask(write_volume):
+
+    ref_mask = ellipsoid(HD_SHAPE, (5, 8, 9), (3, 5, 6))
+
+    path_to_ref = write_volume("ref.nrrd", ref_mask, spacing = HD_SPACING)
+    path_to_empty = write_volume("empty.nrrd", np.zeros_like(ref_mask), spacing = HD_SPACING)
+
+    for hd_dict in [metrics.native_hd(path_to_ref, path_to_empty),
+                    metrics.native_hd(path_to_empty, path_to_ref)]:
+        assert list(hd_dict) == ["hd", "hd95", "hd_boundaries", "hd95_boundaries"]
+        assert all(np.isnan(val) for val in hd_dict.values())
+
+## ----------------------------------------
+
+def test_native_hd_identical_masks(write_volume):
+
+    ref_mask = ellipsoid(HD_SHAPE, (5, 8, 9), (3, 5, 6))
+
+    path_to_ref = write_volume("ref.nrrd", ref_mask, spacing = HD_SPACING)
+
+    hd_dict = pypla.hd(path_to_ref, path_to_ref, verbose = False, backend = "native")
+
+    assert hd_dict == {"hd" : 0.0, "hd95" : 0.0, "hd_boundaries" : 0.0, "hd95_boundaries" : 0.0}
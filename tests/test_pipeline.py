@@ -0,0 +1,194 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Declarative pipelines: dependency graph, failures, intermediates and timings
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+import time
+import threading
+
+import pytest
+
+from pyplastimatch.pipeline import Pipeline, Scratch
+
+## ----------------------------------------
+
+@pytest.fixture
+def path_to_input(tmp_path):
+
+    path_to_input = tmp_path / "input.nrrd"
+    path_to_input.write_bytes(b"voxels")
+
+    return str(path_to_input)
+
+def _sleep(seconds):
+
+    time.sleep(seconds)
+
+def _ends_before(records, before, after):
+
+    return records[before]["start_time"] + records[before]["wall_time"] <= records[after]["start_time"]
+
+## ----------------------------------------
+
+def test_dag_ordering(path_to_input, tmp_path, stub_plastimatch):
+
+    pipe = Pipeline(scratch_dir = str(tmp_path / "scratch"))
+
+    ct, pred = pipe.scratch("ct.nrrd"), pipe.scratch("pred.nrrd")
+
+    # declared in dependency order, but only the intermediates tie the nodes together
+    pipe.add("convert", "convert", input = path_to_input, **{"output-img" : ct})
+    pipe.add("resample", "resample", input = path_to_input, fixed = ct, output = pred)
+    pipe.add("dice", "dice", path_to_reference_img = ct, path_to_test_img = pred)
+    pipe.add("report", lambda: "done", after = ["dice"])
+
+    assert pipe.nodes["resample"]["after"] == {"convert"}
+    assert pipe.nodes["dice"]["after"] == {"convert", "resample"}
+
+    records = pipe.run(verbose = False)
+
+    assert list(records) == ["convert", "resample", "dice", "report"]
+    assert all(record["status"] == "done" and record["error"] is None for record in records.values())
+
+    assert _ends_before(records, "convert", "resample")
+    assert _ends_before(records, "resample", "dice")
+    assert _ends_before(records, "dice", "report")
+
+    # value printed by the stub
+    assert records["dice"]["result"]["dc"] == 0.939273
+    assert records["convert"]["result"].returncode == 0
+
+## ----------------------------------------
+
+def test_independent_nodes_run_in_parallel(tmp_path):
+
+    # each node waits for the other one: run serially, both would time out
+    barrier = threading.Barrier(2, timeout = 10)
+
+    pipe = Pipeline(scratch_dir = str(tmp_path), max_workers = 2)
+    pipe.add("PAT-0001/step", barrier.wait)
+    pipe.add("PAT-0002/step", barrier.wait)
+
+    records = pipe.run(verbose = False)
+
+    assert [record["status"] for record in records.values()] == ["done", "done"]
+
+## ----------------------------------------
+
+def test_failures_skip_the_dependent_nodes(path_to_input, tmp_path, stub_plastimatch):
+
+    pipe = Pipeline(scratch_dir = str(tmp_path / "scratch"))
+
+    ct, pred = pipe.scratch("ct.nrrd"), pipe.scratch("pred.nrrd")
+
+    # the stub fails if the input does not exist
+    pipe.add("convert", "convert", input = str(tmp_path / "missing.nrrd"), **{"output-img" : ct})
+    pipe.add("resample", "resample", input = path_to_input, fixed = ct, output = pred)
+    pipe.add("dice", "dice", path_to_reference_img = ct, path_to_test_img = pred)
+    pipe.add("report", lambda: "done", after = ["dice"])
+    pipe.add("independent", "compare", path_to_reference_img = path_to_input, path_to_test_img = path_to_input)
+
+    records = pipe.run(verbose = False)
+
+    assert {name : record["status"] for name, record in records.items()} == \
+           {"convert" : "failed", "resample" : "skipped", "dice" : "skipped", "report" : "skipped",
+            "independent" : "done"}
+
+    # the failure carries the tail of stderr, the skips name the dependency that did not complete
+    assert "missing.nrrd" in records["convert"]["error"]
+    assert records["resample"]["error"] == "dependency 'convert' did not complete"
+    assert records["report"]["error"] == "dependency 'dice' did not complete"
+
+    assert records["report"]["start_time"] is None and records["report"]["wall_time"] is None
+    assert records["independent"]["result"]["MAE"] == 11.492838
+
+## ----------------------------------------
+
+@pytest.mark.parametrize("keep_intermediates", [False, True])
+def test_intermediates_are_deleted_when_unused(path_to_input, tmp_path, stub_plastimatch, keep_intermediates):
+
+    path_to_scratch_dir = tmp_path / "scratch"
+    pipe = Pipeline(scratch_dir = str(path_to_scratch_dir), max_workers = 1, keep_intermediates = keep_intermediates)
+
+    ct, masks = pipe.scratch("ct.nrrd"), pipe.scratch("masks")
+
+    def _check_intermediates(path_to_mask):
+        # every node using the CT is done, the masks are still in use
+        path_to_ct = os.path.join(os.path.dirname(os.path.dirname(path_to_mask)), ct.root)
+        return os.path.exists(path_to_ct), os.path.exists(path_to_mask)
+
+    pipe.add("convert", "convert", input = path_to_input, **{"output-img" : ct})
+    pipe.add("resample", "resample", input = ct, output = masks / "heart.nrrd")
+    pipe.add("check", _check_intermediates, path_to_mask = masks / "heart.nrrd")
+
+    records = pipe.run(verbose = False)
+
+    assert records["check"]["result"] == (keep_intermediates, True)
+
+    # the run directory is removed with what it still holds, unless the intermediates are kept
+    run_dirs = os.listdir(str(path_to_scratch_dir))
+    if keep_intermediates:
+        assert sorted(os.listdir(str(path_to_scratch_dir / run_dirs[0]))) == [ct.root, masks.root]
+    else:
+        assert run_dirs == []
+
+## ----------------------------------------
+
+def test_summary_timings(tmp_path):
+
+    pipe = Pipeline(scratch_dir = str(tmp_path), max_workers = 4)
+
+    def _fail():
+        time.sleep(0.05)
+        raise RuntimeError("broken")
+
+    for idx in range(3):
+        pipe.add("PAT-%04d/slow"%(idx), _sleep, stage = "slow", seconds = 0.1 + 0.05*idx)
+        pipe.add("PAT-%04d/fast"%(idx), _sleep, stage = "fast", seconds = 0.01)
+    pipe.add("PAT-0000/broken", _fail, stage = "broken")
+    pipe.add("PAT-0000/never", _sleep, stage = "never", after = ["PAT-0000/broken"], seconds = 0)
+
+    records = pipe.run(verbose = False)
+    summary = pipe.summary()
+
+    assert records["PAT-0000/never"]["status"] == "skipped"
+
+    # skipped nodes have no timing; stages are sorted by decreasing total time
+    assert list(summary) == ["slow", "broken", "fast"]
+
+    slow_times = [records["PAT-%04d/slow"%(idx)]["wall_time"] for idx in range(3)]
+    assert summary["slow"]["count"] == 3 and summary["slow"]["failed"] == 0
+    assert summary["slow"]["total"] == pytest.approx(sum(slow_times))
+    assert summary["slow"]["mean"] == pytest.approx(sum(slow_times) / 3)
+    assert summary["slow"]["max"] == max(slow_times) >= 0.2
+
+    assert summary["broken"]["count"] == 1 and summary["broken"]["failed"] == 1
+
+## ----------------------------------------
+
+def test_invalid_declarations(tmp_path):
+
+    pipe = Pipeline(scratch_dir = str(tmp_path))
+    pipe.add("first", _sleep, seconds = 0)
+
+    with pytest.raises(ValueError):
+        pipe.add("first", _sleep, seconds = 0)
+    with pytest.raises(ValueError):
+        pipe.add("second", "register")
+    with pytest.raises(ValueError):
+        pipe.add("second", _sleep, after = ["third"], seconds = 0)
+    with pytest.raises(ValueError):
+        # nothing writes this intermediate
+        pipe.add("second", "dice", path_to_reference_img = pipe.scratch("ct.nrrd"), path_to_test_img = "pred.nrrd")
+
+    assert isinstance(pipe.scratch("masks") / "heart.nrrd", Scratch)
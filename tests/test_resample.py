@@ -0,0 +1,151 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    SimpleITK resample backend: output grid and values, and fallback to the CLI
+
+    Self-consistency tests: the output grid and values are checked against the geometry of the
+    inputs and analytic expectations (a linear ramp), not against the output of plastimatch.
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+import pyplastimatch as pypla
+from pyplastimatch.utils import images
+
+from conftest import SPACING, ORIGIN
+
+SHAPE = (12, 20, 24)
+
+## ----------------------------------------
+
+@pytest.fixture
+def ramp(write_volume):
+
+    # intensity growing linearly with the physical x coordinate, which linear interpolation preserves
+    arr = np.broadcast_to(10*np.arange(SHAPE[2], dtype = np.float32), SHAPE)
+
+    return write_volume("ramp.nrrd", arr)
+
+## ----------------------------------------
+
+def _physical_x(sitk_img):
+
+    return sitk_img.GetOrigin()[0] + np.arange(sitk_img.GetSize()[0])*sitk_img.GetSpacing()[0]
+
+## ----------------------------------------
+
+def test_spacing_keeps_extent(ramp, tmp_path):
+
+    path_to_output = str(tmp_path / "out.nrrd")
+
+    pypla.resample(verbose = False, backend = "sitk", input = ramp, output = path_to_output, spacing = "2 2 5")
+    output_img = sitk.ReadImage(path_to_output)
+
+    assert output_img.GetSpacing() == (2.0, 2.0, 5.0)
+    assert output_img.GetOrigin() == ORIGIN
+    assert output_img.GetSize() == tuple(int(round(n*s/ns)) for n, s, ns in zip(SHAPE[::-1], SPACING, (2, 2, 5)))
+
+    # inside the input grid, the values follow the ramp
+    output_arr = sitk.GetArrayFromImage(output_img)
+    x_idx = (_physical_x(output_img) - ORIGIN[0]) / SPACING[0]
+    inside = x_idx <= SHAPE[2] - 1
+
+    np.testing.assert_allclose(output_arr[0, 0, inside], 10*x_idx[inside], rtol = 1e-5)
+
+## ----------------------------------------
+
+def test_fixed_grid_and_output_type(ramp, tmp_path, write_volume):
+
+    path_to_fixed = write_volume("fixed.nrrd", np.zeros((6, 10, 12), dtype = np.uint8),
+                                 spacing = (1.5, 1.5, 3.0), origin = (-248.0, -178.0, -90.0))
+    path_to_output = str(tmp_path / "out.nrrd")
+
+    pypla.resample(verbose = False, backend = "sitk", input = ramp, output = path_to_output,
+                   fixed = path_to_fixed, interpolation = "nn", **{"output-type" : "short"})
+
+    output_img = sitk.ReadImage(path_to_output)
+    fixed_img = sitk.ReadImage(path_to_fixed)
+
+    assert output_img.GetSize() == fixed_img.GetSize()
+    assert output_img.GetSpacing() == fixed_img.GetSpacing()
+    assert output_img.GetOrigin() == fixed_img.GetOrigin()
+    assert output_img.GetPixelID() == sitk.sitkInt16
+
+    # nearest neighbour: the values are the ones of the closest input voxel
+    x_idx = np.round((_physical_x(output_img) - ORIGIN[0]) / SPACING[0])
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(output_img)[0, 0], 10*x_idx)
+
+## ----------------------------------------
+
+def test_unsupported_options(ramp, tmp_path):
+
+    kwargs = {"input" : ramp, "output" : str(tmp_path / "out.nrrd")}
+
+    assert images.get_sitk_resample_unsupported(kwargs) == []
+    assert images.get_sitk_resample_unsupported(dict(kwargs, fixed = str(tmp_path))) == ["fixed"]
+    assert images.get_sitk_resample_unsupported(dict(kwargs, input = str(tmp_path))) == ["input"]
+    assert images.get_sitk_resample_unsupported(dict(kwargs, interpolation = "cubic")) == ["interpolation"]
+    assert images.get_sitk_resample_unsupported(dict(kwargs, subsample = "2 2 1")) == ["subsample"]
+
+## ----------------------------------------
+
+def test_dicom_fixed_falls_back_to_cli(ramp, tmp_path, stub_plastimatch):
+
+    # e.g., a DICOM series as the fixed image
+    path_to_fixed_dir = tmp_path / "fixed_dicom"
+    path_to_fixed_dir.mkdir()
+    path_to_output = str(tmp_path / "out.nrrd")
+
+    result = pypla.resample(verbose = False, backend = "sitk", input = ramp, output = path_to_output,
+                            fixed = str(path_to_fixed_dir))
+
+    # the stub copies the input to the output
+    assert result is not None and result.returncode == 0
+    assert os.path.isfile(path_to_output)
+
+## ----------------------------------------
+
+def test_sitk_failure_falls_back_to_cli(tmp_path, stub_plastimatch):
+
+    # a file SimpleITK can not read
+    path_to_input = tmp_path / "broken.nrrd"
+    path_to_input.write_text("not an image")
+    path_to_output = str(tmp_path / "out.nrrd")
+
+    result = pypla.resample(verbose = False, backend = "sitk", input = str(path_to_input), output = path_to_output)
+
+    assert result is not None and result.returncode == 0
+    assert open(path_to_output).read() == "not an image"
+
+## ----------------------------------------
+
+def _is_compressed(path_to_img):
+
+    with open(path_to_img, "rb") as f:
+        header = f.read(1024)
+
+    return b"encoding: gzip" in header or b"CompressedData = True" in header
+
+@pytest.mark.parametrize("file_name, compress, expected", [("out.nrrd", None, True),
+                                                           ("out.mha", None, False),
+                                                           ("out.nrrd", False, False),
+                                                           ("out.mha", True, True)])
+def test_output_compression(ramp, tmp_path, file_name, compress, expected):
+
+    path_to_output = str(tmp_path / file_name)
+
+    images.sitk_resample(compress = compress, input = ramp, output = path_to_output, spacing = "2 2 5")
+
+    assert _is_compressed(path_to_output) == expected
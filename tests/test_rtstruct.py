@@ -0,0 +1,182 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Native RTSTRUCT rasterization vs. a brute-force point-in-polygon reference
+    ----------------------------------------
+
+    These are self-consistency tests: the masks are compared with a brute-force rasterization
+    (and the CT grid with the one SimpleITK reads), not with the masks written by plastimatch.
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import os
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+pydicom = pytest.importorskip("pydicom")
+
+from matplotlib.path import Path
+
+import pyplastimatch as pypla
+from pyplastimatch.utils import rtstruct
+
+from conftest import write_ct_series, write_rtstruct, ct_slice_contour
+from conftest import CT_NUM_ROWS as NUM_ROWS, CT_NUM_COLS as NUM_COLS, CT_NUM_SLICES as NUM_SLICES
+from conftest import CT_PIXEL_SPACING as PIXEL_SPACING, CT_SLICE_SPACING as SLICE_SPACING, CT_ORIGIN as ORIGIN
+
+## ----------------------------------------
+
+def _circle(center, radius, num_points = 60):
+
+    angles = np.linspace(0, 2*np.pi, num_points, endpoint = False)
+
+    return np.column_stack([center[0] + radius*np.cos(angles), center[1] + radius*np.sin(angles)])
+
+## ----------------------------------------
+
+# contours in (column, row) voxel indices per slice, with vertices off the voxel centers
+# (so that no voxel center lies on an edge, where point-in-polygon conventions differ)
+STRUCTURES = {
+    "Body" : {slice_idx : [[(2.3, 1.7), (45.2, 3.1), (44.6, 37.4), (3.1, 38.2)]] for slice_idx in range(NUM_SLICES)},
+    # an inner contour carves a hole
+    "Ring (outer/inner)" : {slice_idx : [_circle((20.3, 18.7), 12.2), _circle((20.3, 18.7), 5.1)]
+                            for slice_idx in range(2, 7)},
+    # concave, partly outside of the grid
+    "Spine" : {4 : [[(30.2, 20.3), (52.4, 25.1), (30.6, 30.2), (38.1, 25.4)]],
+               5 : [[(30.2, 20.3), (52.4, 25.1), (30.6, 30.2), (38.1, 25.4)]]},
+    "Empty" : {},
+}
+
+## ----------------------------------------
+
+@pytest.fixture(scope = "module")
+def dicom_data(tmp_path_factory):
+
+    data_dir = tmp_path_factory.mktemp("dicom")
+
+    uids = write_ct_series(str(data_dir / "ct"))
+
+    structures = {name : [ct_slice_contour(points, slice_idx)
+                          for slice_idx, contours in slice_contours.items() for points in contours]
+                  for name, slice_contours in STRUCTURES.items()}
+    write_rtstruct(str(data_dir / "rtstruct.dcm"), uids, structures)
+
+    return str(data_dir / "ct"), str(data_dir / "rtstruct.dcm")
+
+## ----------------------------------------
+
+def _reference_mask(slice_contours):
+
+    """
+    Brute-force rasterization: test every voxel center against every contour (even-odd rule).
+    """
+
+    mask = np.zeros((NUM_SLICES, NUM_ROWS, NUM_COLS), dtype = np.uint8)
+    rows, cols = np.mgrid[0:NUM_ROWS, 0:NUM_COLS]
+    centers = np.column_stack([cols.ravel(), rows.ravel()])
+
+    for slice_idx, contours in slice_contours.items():
+        for points in contours:
+            mask[slice_idx] ^= Path(points).contains_points(centers).reshape(NUM_ROWS, NUM_COLS).astype(np.uint8)
+
+    return mask
+
+## ----------------------------------------
+
+def test_ct_geometry_matches_sitk(dicom_data):
+
+    path_to_ct_dir, _ = dicom_data
+
+    geometry = rtstruct.read_ct_geometry(path_to_ct_dir)
+
+    reader = sitk.ImageSeriesReader()
+    reader.SetFileNames(reader.GetGDCMSeriesFileNames(path_to_ct_dir))
+    ct_img = reader.Execute()
+
+    assert geometry["size"] == ct_img.GetSize()
+    assert geometry["spacing"] == pytest.approx(ct_img.GetSpacing())
+    assert geometry["origin"] == pytest.approx(ct_img.GetOrigin())
+    assert geometry["direction"] == pytest.approx(ct_img.GetDirection())
+
+## ----------------------------------------
+
+def test_rasterize_contours_matches_reference(dicom_data):
+
+    path_to_ct_dir, path_to_rtstruct = dicom_data
+
+    geometry = rtstruct.read_ct_geometry(path_to_ct_dir)
+    _, contours = rtstruct.read_rtstruct_contours(path_to_rtstruct)
+
+    assert list(contours) == list(STRUCTURES)
+
+    for name, slice_contours in STRUCTURES.items():
+        mask = rtstruct.rasterize_contours(contours[name], geometry)
+        np.testing.assert_array_equal(mask, _reference_mask(slice_contours), err_msg = name)
+
+    # the hole is empty
+    assert rtstruct.rasterize_contours(contours["Ring (outer/inner)"], geometry)[4, 18, 20] == 0
+
+## ----------------------------------------
+
+def test_native_convert_naming_and_format(dicom_data, tmp_path):
+
+    path_to_ct_dir, path_to_rtstruct = dicom_data
+
+    pypla.convert(verbose = False, backend = "native", input = path_to_rtstruct,
+                  **{"referenced-ct" : path_to_ct_dir, "output-prefix" : str(tmp_path / "masks")})
+
+    # file names and format follow the plastimatch conventions (see `get_structure_file_name`)
+    assert sorted(os.listdir(tmp_path / "masks")) == ["Body.mha", "Empty.mha", "Ring__outer_inner_.mha", "Spine.mha"]
+
+    mask_img = sitk.ReadImage(str(tmp_path / "masks" / "Spine.mha"))
+
+    assert mask_img.GetPixelID() == sitk.sitkUInt8
+    assert mask_img.GetSpacing() == pytest.approx(PIXEL_SPACING + (SLICE_SPACING,))
+    assert mask_img.GetOrigin() == pytest.approx(ORIGIN)
+
+    # uncompressed by default, as `save_binary_segmask` writes
+    with open(str(tmp_path / "masks" / "Spine.mha"), "rb") as f:
+        assert b"CompressedData = False" in f.read(1024)
+
+## ----------------------------------------
+
+def test_native_convert_compress_and_pixel_type(dicom_data, tmp_path):
+
+    path_to_ct_dir, path_to_rtstruct = dicom_data
+
+    paths = rtstruct.native_convert(compress = True, pixel_type = np.int16, input = path_to_rtstruct,
+                                    **{"referenced-ct" : path_to_ct_dir, "output-prefix" : str(tmp_path / "masks"),
+                                       "prefix-format" : "nrrd"})
+
+    with open(paths["Spine"], "rb") as f:
+        assert b"encoding: gzip" in f.read(1024)
+
+    mask_img = sitk.ReadImage(paths["Spine"])
+
+    assert mask_img.GetPixelID() == sitk.sitkInt16
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(mask_img), _reference_mask(STRUCTURES["Spine"]))
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(mask_img), _reference_mask(STRUCTURES["Spine"]))
+
+## ----------------------------------------
+
+def test_unsupported_options_fall_back_to_cli(dicom_data, tmp_path, stub_plastimatch):
+
+    path_to_ct_dir, path_to_rtstruct = dicom_data
+    convert_kwargs = {"input" : path_to_rtstruct, "referenced-ct" : path_to_ct_dir,
+                      "output-prefix" : str(tmp_path / "masks"), "output-ss-img" : str(tmp_path / "ss.nrrd")}
+
+    assert rtstruct.get_native_convert_unsupported(convert_kwargs) == ["output-ss-img"]
+
+    # run by the stand-in (i.e., not in-process)
+    result = pypla.convert(verbose = False, backend = "native", **convert_kwargs)
+
+    assert result is not None and result.returncode == 0
+    assert not os.path.exists(tmp_path / "masks")
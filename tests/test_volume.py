@@ -0,0 +1,159 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Lazy volumes: slab-wise reading and packed segmasks
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import numpy as np
+import pytest
+import SimpleITK as sitk
+
+from pyplastimatch.utils import volume
+
+from conftest import ellipsoid
+
+SHAPE = (10, 12, 14)
+
+# keys a SlabVolume must index like the array it was written from
+INDEX_KEYS = [3, -1, np.int64(2), slice(2, 7), slice(1, None, 3), slice(None, None, -2), (4, slice(2, 5)),
+              (slice(0, 3), 5, slice(None, None, 2)), Ellipsis, [0, 4, 9]]
+
+## ----------------------------------------
+
+@pytest.fixture
+def arr():
+
+    return np.arange(np.prod(SHAPE), dtype = np.int16).reshape(SHAPE) - 500
+
+def _write(tmp_path, arr, file_name, compress):
+
+    path_to_file = str(tmp_path / file_name)
+    sitk.WriteImage(sitk.GetImageFromArray(arr), path_to_file, compress)
+
+    return path_to_file
+
+## ----------------------------------------
+
+@pytest.mark.parametrize("file_name, compress, streaming", [("vol.mha", False, True),
+                                                            ("vol.nii", False, True),
+                                                            ("vol.mha", True, False),
+                                                            ("vol.nii.gz", True, False),
+                                                            ("vol.nrrd", True, False),
+                                                            ("vol.nrrd", False, False)])
+def test_slab_volume_indexing(tmp_path, arr, monkeypatch, file_name, compress, streaming):
+
+    path_to_file = _write(tmp_path, arr, file_name, compress)
+
+    num_full_reads = list()
+    read_image = sitk.ReadImage
+    monkeypatch.setattr(sitk, "ReadImage", lambda *args: num_full_reads.append(1) or read_image(*args))
+
+    slab_volume = volume.SlabVolume(path_to_file)
+
+    assert slab_volume.streaming == streaming == volume.can_stream(path_to_file)
+    assert (slab_volume.shape, slab_volume.ndim, len(slab_volume), slab_volume.dtype) == \
+           (SHAPE, 3, SHAPE[0], np.dtype(np.int16))
+
+    # nothing is read until the volume is indexed
+    assert num_full_reads == []
+
+    for key in INDEX_KEYS:
+        np.testing.assert_array_equal(slab_volume[key], arr[key])
+
+    np.testing.assert_array_equal(np.asarray(slab_volume), arr)
+    assert np.asarray(slab_volume, dtype = np.float32).dtype == np.float32
+
+    # files that can not be streamed are read once, and kept in memory
+    assert len(num_full_reads) == (0 if streaming else 1)
+
+    with pytest.raises(IndexError):
+        slab_volume[SHAPE[0]]
+
+## ----------------------------------------
+
+def test_lazy_volume(tmp_path, arr):
+
+    # memory-mapped where possible, read slab-wise otherwise
+    assert isinstance(volume.lazy_volume(_write(tmp_path, arr, "raw.nrrd", False)), np.memmap)
+    assert isinstance(volume.lazy_volume(_write(tmp_path, arr, "gzip.nrrd", True)), volume.SlabVolume)
+
+## ----------------------------------------
+
+def _structures(overlapping):
+
+    structures = {"heart" : ellipsoid(SHAPE, (5, 4, 4), (3, 3, 3)),
+                  "lung" : ellipsoid(SHAPE, (5, 8, 10), (3, 3, 3))}
+
+    if overlapping:
+        structures["tumor"] = ellipsoid(SHAPE, (5, 8, 9), (2, 2, 2))
+
+    return structures
+
+@pytest.mark.parametrize("overlapping, mode, expected_mode", [(False, "auto", "labels"),
+                                                              (True, "auto", "bitplanes"),
+                                                              (False, "bitplanes", "bitplanes")])
+def test_packed_segmasks(overlapping, mode, expected_mode):
+
+    structures = _structures(overlapping)
+    packed = volume.PackedSegmasks(structures, mode = mode, slab_size = 3)
+
+    assert packed.mode == expected_mode
+    assert list(packed) == list(structures) and len(packed) == len(structures)
+    assert packed.shape == SHAPE
+
+    for key, mask in structures.items():
+        assert packed[key].shape == SHAPE and packed[key].dtype == bool
+        for index_key in [5, slice(2, 8), (5, slice(None), 9), Ellipsis]:
+            np.testing.assert_array_equal(packed[key][index_key], mask[index_key] > 0)
+        np.testing.assert_array_equal(np.asarray(packed[key]), mask > 0)
+
+    with pytest.raises(KeyError):
+        packed["spine"]
+
+## ----------------------------------------
+
+def test_packed_segmasks_overlapping_labels():
+
+    # a label map is forced: the last structure wins where they overlap
+    structures = _structures(overlapping = True)
+    packed = volume.PackedSegmasks(structures, mode = "labels")
+
+    assert packed.mode == "labels"
+    np.testing.assert_array_equal(packed["tumor"][...], structures["tumor"] > 0)
+    np.testing.assert_array_equal(packed["lung"][...], (structures["lung"] > 0) & ~(structures["tumor"] > 0))
+
+## ----------------------------------------
+
+def test_packed_segmasks_many_structures(tmp_path):
+
+    # more than 8 overlapping structures span several bytes per voxel; files are read slab-wise
+    structures = {"slab_%02d"%(idx) : np.zeros(SHAPE, dtype = np.uint8) for idx in range(11)}
+    for idx, mask in enumerate(structures.values()):
+        mask[:, :, idx:idx + 3] = 1
+
+    segmask_dict = {key : _write(tmp_path, mask, key + ".nrrd", True) for key, mask in structures.items()}
+    packed = volume.PackedSegmasks(segmask_dict)
+
+    assert packed.mode == "bitplanes"
+    assert packed.data.shape == SHAPE + (2,)
+
+    for key, mask in structures.items():
+        np.testing.assert_array_equal(packed[key][...], mask > 0)
+
+## ----------------------------------------
+
+def test_packed_segmasks_shape_mismatch():
+
+    with pytest.raises(ValueError):
+        volume.PackedSegmasks({"heart" : np.zeros(SHAPE), "lung" : np.zeros((4, 4, 4))})
+
+    with pytest.raises(ValueError):
+        volume.PackedSegmasks({"heart" : np.zeros(SHAPE)}, mode = "rle")
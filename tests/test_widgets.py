@@ -0,0 +1,82 @@
+"""
+    ----------------------------------------
+    PyPlastimatch
+
+    Slice visualisation widgets (rendered off-screen)
+    ----------------------------------------
+
+    ----------------------------------------
+    Author: Dennis Bontempi
+    Email:  dbontempi@bwh.harvard.edu
+    ----------------------------------------
+
+"""
+
+import numpy as np
+import pytest
+
+matplotlib = pytest.importorskip("matplotlib")
+matplotlib.use("Agg")
+
+pytest.importorskip("ipywidgets")
+
+from pyplastimatch.utils import widgets
+
+SHAPE = (6, 20, 24)
+
+## ----------------------------------------
+
+def _ct_volume(shape):
+
+    return np.arange(np.prod(shape), dtype = np.int16).reshape(shape) - 1024
+
+## ----------------------------------------
+
+def test_base_class_is_abstract():
+
+    with pytest.raises(TypeError):
+        widgets.AxialSliceFigure("gray", (4, 4), 50, -1024, 3072)
+
+## ----------------------------------------
+
+def test_comparison_same_grid():
+
+    widget = widgets.AxialSliceComparison(_ct_volume(SHAPE), _ct_volume(SHAPE), figsize = (4, 4), dpi = 50)
+
+    assert widget.planes == ["axial", "coronal", "sagittal"]
+
+    widget.plot_plane("coronal", 10)
+    assert [image.get_array().shape for image in widget.images] == [(SHAPE[0], SHAPE[2])]*2
+
+## ----------------------------------------
+
+def test_comparison_different_in_plane_grids():
+
+    widget = widgets.AxialSliceComparison(_ct_volume(SHAPE), _ct_volume((SHAPE[0], 10, 12)),
+                                          figsize = (4, 4), dpi = 50)
+
+    # only the axial slices can be compared
+    assert widget.planes == ["axial"]
+
+    widget.plot_slice(3)
+    assert [image.get_array().shape for image in widget.images] == [SHAPE[1:], (10, 12)]
+    assert [image.get_extent() for image in widget.images] == [[-0.5, 23.5, 19.5, -0.5], [-0.5, 11.5, 9.5, -0.5]]
+
+## ----------------------------------------
+
+def test_comparison_different_number_of_slices():
+
+    with pytest.raises(AssertionError):
+        widgets.AxialSliceComparison(_ct_volume(SHAPE), _ct_volume((SHAPE[0] + 1,) + SHAPE[1:]))
+
+## ----------------------------------------
+
+def test_get_plane():
+
+    volume = _ct_volume(SHAPE)
+
+    np.testing.assert_array_equal(widgets.get_plane(volume, "axial", 2), volume[2])
+    np.testing.assert_array_equal(widgets.get_plane(volume, "coronal", 5, 2), volume[::2, 5, ::2][::-1])
+
+    with pytest.raises(ValueError):
+        widgets.get_plane(volume, "oblique", 0)